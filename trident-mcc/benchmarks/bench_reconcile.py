@@ -0,0 +1,396 @@
+"""Benchmarks check_backends against local fake Kubernetes and ONTAP servers
+
+For every size the fake servers are started in this process and the real reconcile loop is
+run in a fresh worker process, so its peak RSS isn't mixed with the fakes or earlier sizes.
+The worker runs a cold pass (every backend is patched with its SVM UUID), a steady state
+pass, then switches over one cluster and measures how long it takes for the renamed SVMs
+to be patched into their backends.
+
+    python benchmarks/bench_reconcile.py                      # compare against baseline.json
+    python benchmarks/bench_reconcile.py --update-baseline    # record a new baseline
+    python benchmarks/bench_reconcile.py --sizes 10,100 --ontap-latency 0.02
+
+The reconciler reads its usual environment variables, e.g. MAX_WORKERS or ASYNC_ENGINE, so
+different configurations can be compared. Timings are compared relative to a fixed reference
+workload timed in the same run, see calibrate, so a baseline recorded on one machine can be
+compared against on a faster or slower one. Call counts are compared as they are. The fake
+ONTAP clusters listen on port 443 of 127.0.0.11 onwards, like a real management LIF, so
+this needs to run as root or with CAP_NET_BIND_SERVICE.
+"""
+
+import argparse
+import json
+import os
+import resource
+import ssl
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+PROJECT_DIR = BENCHMARK_DIR.parent
+BASELINE_FILE = BENCHMARK_DIR / "baseline.json"
+SECRET_NAME = "ontap-credentials"
+
+KUBE_CONFIG = """apiVersion: v1
+kind: Config
+clusters:
+- name: fake
+  cluster:
+    server: {server}
+contexts:
+- name: fake
+  context:
+    cluster: fake
+    user: fake
+current-context: fake
+users:
+- name: fake
+  user:
+    token: fake
+"""
+
+# Compared against the baseline, the rest (e.g. startup, which depends on the disk cache) are
+# only reported
+REGRESSION_METRICS = (
+    "cold_cycle_seconds",
+    "steady_cycle_seconds",
+    "failover_cycle_seconds",
+    "failover_to_patch_seconds",
+    "k8s_calls_per_backend",
+    "ontap_calls_per_backend",
+    "peak_rss_mb",
+)
+# Allowed growth over the baseline before an API call count counts as a regression
+CALLS_TOLERANCE = 0.1
+# Slack for timings, so sub 50ms timings don't fail on scheduling noise. In seconds on the
+# baseline's machine, it is scaled like the timings
+TIME_SLACK = 0.05
+
+
+def _backend_name(index: int) -> str:
+    return f"backend-{index:05d}"
+
+
+def _server_ssl_context(workdir: Path) -> ssl.SSLContext:
+    """Creates a self signed certificate for the fake ONTAP servers"""
+    cert, key = workdir / "ontap.crt", workdir / "ontap.key"
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1"]
+        + ["-subj", "/CN=localhost", "-keyout", str(key), "-out", str(cert)],
+        check=True,
+        capture_output=True,
+    )
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(str(cert), str(key))
+    return context
+
+
+def calibrate() -> float:
+    """Times a fixed CPU bound workload, the reference timings are compared relative to
+
+    Most of a pass is spent in Python decoding and indexing API responses, so this decodes
+    and indexes a large SVM collection. It runs in the worker, after the passes, so it is
+    timed under the same conditions. The fastest of a few runs is taken, to leave out noise
+    from whatever else the machine is doing.
+
+    :returns: Seconds the workload took
+    :rtype: float
+    """
+    payload = json.dumps(
+        {
+            "records": [
+                {
+                    "name": f"svm{index:05d}",
+                    "uuid": str(uuid.UUID(int=index)),
+                    "state": "running",
+                    "subtype": "default",
+                }
+                for index in range(100000)
+            ]
+        }
+    )
+    fastest = None
+    for _ in range(10):
+        start_time = time.perf_counter()
+        records = json.loads(payload)["records"]
+        by_name = {record["name"]: record for record in records}
+        by_uuid = {record["uuid"]: record for record in by_name.values()}
+        sorted(by_uuid)
+        elapsed = time.perf_counter() - start_time
+        fastest = elapsed if fastest is None else min(fastest, elapsed)
+    return round(fastest, 4)
+
+
+def run_size(size: int, args) -> dict:
+    """Starts the fake servers for size backends and runs the worker against them"""
+    from fake_servers import FakeKubernetes, FakeOntap
+
+    with tempfile.TemporaryDirectory() as workdir:
+        workdir = Path(workdir)
+        ssl_context = _server_ssl_context(workdir)
+        clusters = [
+            FakeOntap(
+                f"127.0.0.{11 + index}",
+                ssl_context,
+                latency=args.ontap_latency,
+                error_rate=args.ontap_error_rate,
+            )
+            for index in range(min(args.clusters, size))
+        ]
+        kubernetes = FakeKubernetes()
+        kubernetes.add_secret(
+            SECRET_NAME, {"username": "admin", "password": "netapp123"}
+        )
+        for index in range(size):
+            cluster = clusters[index % len(clusters)]
+            svm_name = f"svm{index:05d}"
+            cluster.add_svm(svm_name, str(uuid.uuid4()))
+            kubernetes.add_backend(
+                _backend_name(index), cluster.management_lif, svm_name, SECRET_NAME
+            )
+
+        kube_config = workdir / "kubeconfig"
+        kube_config.write_text(
+            KUBE_CONFIG.format(server=f"http://127.0.0.1:{kubernetes.port}")
+        )
+        env = dict(
+            os.environ,
+            KUBE_CONFIG_LOCATION=str(kube_config),
+            TRIDENT_NAMESPACE=kubernetes.namespace,
+            DISCOVERY_CACHE_FILE=str(workdir / "discovery.json"),
+            PYTHONPATH=os.pathsep.join(
+                filter(None, [str(PROJECT_DIR), os.getenv("PYTHONPATH")])
+            ),
+        )
+        # requests prefers these over the verify=False the ONTAP connections are made with
+        env.pop("REQUESTS_CA_BUNDLE", None)
+        env.pop("CURL_CA_BUNDLE", None)
+        try:
+            worker = subprocess.run(
+                [sys.executable, __file__, "--worker", "--size", str(size)]
+                + ["--k8s-url", f"http://127.0.0.1:{kubernetes.port}"]
+                + [
+                    "--management-lifs",
+                    ",".join(cluster.management_lif for cluster in clusters),
+                ],
+                env=env,
+                stdout=subprocess.PIPE,
+                stderr=None if args.verbose else subprocess.DEVNULL,
+                text=True,
+                timeout=args.timeout,
+            )
+        finally:
+            kubernetes.shutdown()
+            for cluster in clusters:
+                cluster.shutdown()
+
+    if worker.returncode != 0:
+        raise RuntimeError(
+            f"Benchmark worker for {size} backends exited with {worker.returncode}"
+        )
+    return json.loads(worker.stdout.strip().splitlines()[-1])
+
+
+def worker(args) -> None:
+    """Runs in its own process - drives the real reconcile loop and prints the measurements"""
+    import requests
+    import urllib3
+
+    urllib3.disable_warnings()
+    management_lifs = args.management_lifs.split(",")
+
+    def request_counts():
+        k8s = requests.get(f"{args.k8s_url}/_bench/stats").json()["requests"]
+        ontap = [
+            requests.get(f"https://{lif}/_bench/stats", verify=False).json()["requests"]
+            for lif in management_lifs
+        ]
+        return sum(k8s.values()), sum(sum(counts.values()) for counts in ontap)
+
+    start_time = time.time()
+    from trident_mcc import reconciler
+
+    startup_seconds = time.time() - start_time
+    reports = []
+    reconciler.set_status_sink(
+        lambda status_update: reports.append(status_update.cycle)
+    )
+
+    def run_pass(count_requests: bool = True):
+        # Real polls are further apart than SVM_INVENTORY_TTL, so each starts with fresh inventories
+        if reconciler.svm_inventory_cache is not None:
+            for lif in management_lifs:
+                reconciler.svm_inventory_cache.invalidate_management_lif(lif)
+        k8s_before, ontap_before = request_counts() if count_requests else (0, 0)
+        pass_start = time.time()
+        reconciler.check_backends()
+        duration = time.time() - pass_start
+        k8s_after, ontap_after = request_counts() if count_requests else (0, 0)
+        return duration, k8s_after - k8s_before, ontap_after - ontap_before
+
+    cold_seconds, _, _ = run_pass()
+    steady_seconds, steady_k8s_calls, steady_ontap_calls = run_pass()
+
+    requests.post(f"https://{management_lifs[0]}/_bench/switchover", verify=False)
+    switchover_time = time.time()
+    failover_seconds, _, _ = run_pass(count_requests=False)
+    patch_times = requests.get(f"{args.k8s_url}/_bench/stats").json()["patch_times"]
+    switched_backends = [
+        _backend_name(index) for index in range(0, args.size, len(management_lifs))
+    ]
+    patched = [
+        patch_times[name]
+        for name in switched_backends
+        if patch_times.get(name, 0) > switchover_time
+    ]
+
+    # ru_maxrss is in KiB on Linux, read before calibrating so its payload isn't included
+    peak_rss_mb = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    print(
+        json.dumps(
+            {
+                "startup_seconds": round(startup_seconds, 3),
+                "cold_cycle_seconds": round(cold_seconds, 3),
+                "steady_cycle_seconds": round(steady_seconds, 3),
+                "failover_cycle_seconds": round(failover_seconds, 3),
+                "failover_to_patch_seconds": (
+                    round(max(patched) - switchover_time, 3)
+                    if len(patched) == len(switched_backends)
+                    else None
+                ),
+                "k8s_calls_per_backend": round(steady_k8s_calls / args.size, 6),
+                "ontap_calls_per_backend": round(steady_ontap_calls / args.size, 6),
+                "peak_rss_mb": peak_rss_mb,
+                "failed_backends": [report.backends_failed for report in reports],
+                "reference_seconds": calibrate(),
+            }
+        )
+    )
+
+
+def find_regressions(results: dict, baseline: dict, args) -> list:
+    regressions = []
+    for size, metrics in results.items():
+        # How much slower this run's machine is than the baseline's, timings are scaled by it
+        if metrics.get("reference_seconds") and baseline.get(size, {}).get(
+            "reference_seconds"
+        ):
+            speed = metrics["reference_seconds"] / baseline[size]["reference_seconds"]
+        else:
+            print(
+                f"No reference timing for {size} backends - comparing timings as they are",
+                file=sys.stderr,
+            )
+            speed = 1
+        for metric in REGRESSION_METRICS:
+            baseline_value = baseline.get(size, {}).get(metric)
+            value = metrics.get(metric)
+            if baseline_value is None:
+                continue
+            if value is None:
+                regressions.append(
+                    f"{size} backends - {metric} missing, baseline {baseline_value}"
+                )
+                continue
+            if metric.endswith("_seconds"):
+                limit = (
+                    baseline_value * (1 + args.time_tolerance) + TIME_SLACK
+                ) * speed
+            elif metric == "peak_rss_mb":
+                limit = baseline_value * (1 + args.rss_tolerance)
+            else:
+                limit = baseline_value * (1 + CALLS_TOLERANCE)
+            if value > limit:
+                regressions.append(
+                    f"{size} backends - {metric} {value} is over {limit:.3f} (baseline {baseline_value})"
+                )
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--sizes", default="10,100,1000,5000", help="Comma separated backend counts"
+    )
+    parser.add_argument(
+        "--clusters",
+        type=int,
+        default=4,
+        help="Fake ONTAP clusters the backends are spread across",
+    )
+    parser.add_argument(
+        "--ontap-latency",
+        type=float,
+        default=0,
+        help="Seconds added to every ONTAP request",
+    )
+    parser.add_argument(
+        "--ontap-error-rate",
+        type=float,
+        default=0,
+        help="Fraction of ONTAP requests that fail",
+    )
+    parser.add_argument(
+        "--time-tolerance", type=float, default=0.5, help="Allowed fractional slowdown"
+    )
+    parser.add_argument(
+        "--rss-tolerance",
+        type=float,
+        default=0.25,
+        help="Allowed fractional RSS growth",
+    )
+    parser.add_argument(
+        "--timeout", type=int, default=1800, help="Seconds allowed per size"
+    )
+    parser.add_argument("--baseline", type=Path, default=BASELINE_FILE)
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="Write the results as the new baseline",
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="Show the reconciler's logs"
+    )
+    # Used when the script runs itself as the worker process
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--k8s-url", help=argparse.SUPPRESS)
+    parser.add_argument("--management-lifs", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args)
+        return 0
+
+    results = {}
+    for size in [int(size) for size in args.sizes.split(",")]:
+        print(f"Benchmarking {size} backends", file=sys.stderr)
+        results[str(size)] = run_size(size, args)
+        print(f"  {json.dumps(results[str(size)])}", file=sys.stderr)
+    print(json.dumps(results, indent=2))
+
+    if args.update_baseline:
+        args.baseline.write_text(json.dumps(results, indent=2) + "\n")
+        print(f"Baseline written to {args.baseline}", file=sys.stderr)
+        return 0
+    if not args.baseline.exists():
+        print(
+            f"No baseline at {args.baseline} - run with --update-baseline",
+            file=sys.stderr,
+        )
+        return 0
+
+    regressions = find_regressions(results, json.loads(args.baseline.read_text()), args)
+    for regression in regressions:
+        print(f"REGRESSION: {regression}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,377 @@
+"""Local stand-ins for the Kubernetes API and ONTAP REST API used by the benchmarks
+
+Both servers keep their objects in memory, count the requests they serve and expose a
+small /_bench control API so the benchmark worker can read the counters and inject
+failovers without sharing memory with the servers.
+"""
+
+import base64
+import copy
+import json
+import random
+import ssl
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+TRIDENT_GROUP_VERSION = "trident.netapp.io/v1"
+BACKEND_PATH = (
+    f"/apis/{TRIDENT_GROUP_VERSION}/namespaces/{{namespace}}/tridentbackendconfigs"
+)
+SECRET_PATH = "/api/v1/namespaces/{namespace}/secrets"
+
+
+def _merge_patch(target: dict, patch: dict) -> dict:
+    """Applies a JSON merge patch (RFC 7386) to target in place"""
+    for key, value in patch.items():
+        if value is None:
+            target.pop(key, None)
+        elif isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge_patch(target[key], value)
+        else:
+            target[key] = copy.deepcopy(value)
+    return target
+
+
+class _JsonHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: dict) -> None:
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length)) if length else {}
+
+
+class _Server:
+    """Runs a ThreadingHTTPServer for handler_class in a daemon thread"""
+
+    def __init__(
+        self,
+        handler_class,
+        ssl_context: ssl.SSLContext = None,
+        address: str = "127.0.0.1",
+        port: int = 0,
+    ) -> None:
+        self.lock = threading.Lock()
+        self.requests = {}
+        handler = type(handler_class.__name__, (handler_class,), {"fake": self})
+        self._httpd = ThreadingHTTPServer((address, port), handler)
+        self._httpd.daemon_threads = True
+        if ssl_context is not None:
+            self._httpd.socket = ssl_context.wrap_socket(
+                self._httpd.socket, server_side=True
+            )
+        self.port = self._httpd.server_port
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+
+    def count(self, kind: str) -> None:
+        with self.lock:
+            self.requests[kind] = self.requests.get(kind, 0) + 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            return dict(self.requests)
+
+    def shutdown(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+class _KubernetesHandler(_JsonHandler):
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        fake = self.fake
+        namespace_prefix = f"/api/v1/namespaces/{fake.namespace}"
+        backends_path = BACKEND_PATH.format(namespace=fake.namespace)
+        secrets_path = SECRET_PATH.format(namespace=fake.namespace)
+
+        if url.path == "/_bench/stats":
+            return self._send_json(200, fake.bench_stats())
+        if url.path == "/version":
+            fake.count("discovery")
+            return self._send_json(
+                200, {"major": "1", "minor": "21", "gitVersion": "v1.21.0"}
+            )
+        if url.path in fake.DISCOVERY:
+            fake.count("discovery")
+            return self._send_json(200, fake.DISCOVERY[url.path])
+        if url.path == namespace_prefix:
+            fake.count("namespace_get")
+            return self._send_json(
+                200,
+                {
+                    "kind": "Namespace",
+                    "apiVersion": "v1",
+                    "metadata": {"name": fake.namespace},
+                },
+            )
+        if url.path.startswith(secrets_path + "/"):
+            fake.count("secret_get")
+            secret = fake.secrets.get(url.path[len(secrets_path) + 1 :])
+            if secret is None:
+                return self._send_json(
+                    404, {"kind": "Status", "code": 404, "reason": "NotFound"}
+                )
+            return self._send_json(200, secret)
+        if url.path == backends_path:
+            fake.count("backend_list")
+            return self._send_json(200, fake.list_backends(query))
+        return self._send_json(
+            404, {"kind": "Status", "code": 404, "reason": "NotFound"}
+        )
+
+    def do_PATCH(self):
+        fake = self.fake
+        backends_path = BACKEND_PATH.format(namespace=fake.namespace)
+        if not self.path.startswith(backends_path + "/"):
+            return self._send_json(
+                404, {"kind": "Status", "code": 404, "reason": "NotFound"}
+            )
+        fake.count("backend_patch")
+        status, body = fake.patch_backend(
+            self.path[len(backends_path) + 1 :], self._read_json()
+        )
+        self._send_json(status, body)
+
+
+class FakeKubernetes(_Server):
+    DISCOVERY = {
+        "/api": {"kind": "APIVersions", "versions": ["v1"]},
+        "/api/v1": {
+            "kind": "APIResourceList",
+            "groupVersion": "v1",
+            "resources": [
+                {
+                    "name": "namespaces",
+                    "singularName": "",
+                    "namespaced": False,
+                    "kind": "Namespace",
+                    "verbs": ["get", "list"],
+                },
+                {
+                    "name": "secrets",
+                    "singularName": "",
+                    "namespaced": True,
+                    "kind": "Secret",
+                    "verbs": ["get", "list"],
+                },
+            ],
+        },
+        "/apis": {
+            "kind": "APIGroupList",
+            "apiVersion": "v1",
+            "groups": [
+                {
+                    "name": "trident.netapp.io",
+                    "versions": [
+                        {"groupVersion": TRIDENT_GROUP_VERSION, "version": "v1"}
+                    ],
+                    "preferredVersion": {
+                        "groupVersion": TRIDENT_GROUP_VERSION,
+                        "version": "v1",
+                    },
+                }
+            ],
+        },
+        f"/apis/{TRIDENT_GROUP_VERSION}": {
+            "kind": "APIResourceList",
+            "groupVersion": TRIDENT_GROUP_VERSION,
+            "resources": [
+                {
+                    "name": "tridentbackendconfigs",
+                    "singularName": "tridentbackendconfig",
+                    "namespaced": True,
+                    "kind": "TridentBackendConfig",
+                    "verbs": ["get", "list", "patch", "watch"],
+                },
+            ],
+        },
+    }
+
+    def __init__(self, namespace: str = "trident") -> None:
+        """Fake Kubernetes API serving TridentBackendConfigs, Secrets and the Trident Namespace"""
+        self.namespace = namespace
+        self.backends = {}
+        self.secrets = {}
+        self.patch_times = {}
+        self._resource_version = 1
+        super().__init__(_KubernetesHandler)
+
+    def _next_resource_version(self) -> str:
+        self._resource_version += 1
+        return str(self._resource_version)
+
+    def add_secret(self, name: str, data: dict) -> None:
+        self.secrets[name] = {
+            "kind": "Secret",
+            "apiVersion": "v1",
+            "metadata": {
+                "name": name,
+                "namespace": self.namespace,
+                "resourceVersion": self._next_resource_version(),
+            },
+            "data": {
+                key: base64.b64encode(value.encode()).decode()
+                for key, value in data.items()
+            },
+        }
+
+    def add_backend(
+        self, name: str, management_lif: str, svm: str, secret: str
+    ) -> None:
+        self.backends[name] = {
+            "kind": "TridentBackendConfig",
+            "apiVersion": TRIDENT_GROUP_VERSION,
+            "metadata": {
+                "name": name,
+                "namespace": self.namespace,
+                "resourceVersion": self._next_resource_version(),
+                "generation": 1,
+                "annotations": {},
+            },
+            "spec": {
+                "version": 1,
+                "storageDriverName": "ontap-nas",
+                "managementLIF": management_lif,
+                "svm": svm,
+                "credentials": {"name": secret},
+            },
+        }
+
+    def list_backends(self, query: dict) -> dict:
+        with self.lock:
+            names = sorted(self.backends)
+            start = int(query.get("continue") or 0)
+            limit = int(query["limit"]) if query.get("limit") else len(names)
+            items = [self.backends[name] for name in names[start : start + limit]]
+            metadata = {"resourceVersion": str(self._resource_version)}
+            if start + limit < len(names):
+                metadata["continue"] = str(start + limit)
+            return {
+                "kind": "TridentBackendConfigList",
+                "apiVersion": TRIDENT_GROUP_VERSION,
+                "metadata": metadata,
+                "items": items,
+            }
+
+    def patch_backend(self, name: str, patch: dict):
+        with self.lock:
+            backend = self.backends.get(name)
+            if backend is None:
+                return 404, {"kind": "Status", "code": 404, "reason": "NotFound"}
+            expected_version = patch.get("metadata", {}).pop("resourceVersion", None)
+            if (
+                expected_version is not None
+                and expected_version != backend["metadata"]["resourceVersion"]
+            ):
+                return 409, {"kind": "Status", "code": 409, "reason": "Conflict"}
+            _merge_patch(backend, patch)
+            backend["metadata"]["resourceVersion"] = self._next_resource_version()
+            if "spec" in patch:
+                backend["metadata"]["generation"] += 1
+            self.patch_times[name] = time.time()
+            return 200, backend
+
+    def bench_stats(self) -> dict:
+        with self.lock:
+            return {
+                "requests": dict(self.requests),
+                "patch_times": dict(self.patch_times),
+            }
+
+
+class _OntapHandler(_JsonHandler):
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        fake = self.fake
+        if url.path == "/_bench/stats":
+            return self._send_json(200, {"requests": fake.stats()})
+
+        fake.count(url.path)
+        if fake.latency:
+            time.sleep(fake.latency)
+        if fake.error_rate and random.random() < fake.error_rate:
+            return self._send_json(
+                500, {"error": {"message": "Injected error", "code": "1"}}
+            )
+        if url.path != "/api/svm/svms":
+            return self._send_json(
+                404, {"error": {"message": "Not found", "code": "4"}}
+            )
+
+        with fake.lock:
+            records = list(fake.svms.values())
+        if "uuid" in query:
+            records = [svm for svm in records if svm["uuid"] == query["uuid"]]
+        if "name" in query:
+            names = query["name"].split("|")
+            records = [svm for svm in records if svm["name"] in names]
+        if "max_records" in query:
+            records = records[: int(query["max_records"])]
+        fields = query.get("fields", "name,uuid").split(",")
+        records = [
+            {field: svm[field] for field in fields if field in svm} for svm in records
+        ]
+        self._send_json(200, {"records": records, "num_records": len(records)})
+
+    def do_POST(self):
+        if urlsplit(self.path).path != "/_bench/switchover":
+            return self._send_json(404, {})
+        self._send_json(200, {"renamed": self.fake.switchover()})
+
+
+class FakeOntap(_Server):
+    def __init__(
+        self,
+        management_lif: str,
+        ssl_context: ssl.SSLContext,
+        latency: float = 0,
+        error_rate: float = 0,
+    ) -> None:
+        """Fake ONTAP /api/svm/svms with optional latency, injected errors and SVM renames
+
+        The clients always connect to port 443 of the management LIF, so each fake cluster
+        listens on 443 of its own loopback address e.g. 127.0.0.11 - this needs root or
+        CAP_NET_BIND_SERVICE.
+
+        :param management_lif: Loopback address to listen on
+        :param ssl_context: Server side TLS context, the clients only speak https to ONTAP
+        :param latency: Seconds added to every ONTAP request
+        :param error_rate: Fraction of ONTAP requests that fail with a 500
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.svms = {}
+        self.management_lif = management_lif
+        super().__init__(
+            _OntapHandler, ssl_context=ssl_context, address=management_lif, port=443
+        )
+
+    def add_svm(self, name: str, uuid: str) -> None:
+        self.svms[uuid] = {
+            "name": name,
+            "uuid": uuid,
+            "state": "running",
+            "subtype": "sync_source",
+        }
+
+    def switchover(self) -> int:
+        """Renames every SVM to its MetroCluster '-mc' name, as seen after a switchover"""
+        with self.lock:
+            for svm in self.svms.values():
+                svm["name"] = svm["name"] + "-mc"
+                svm["subtype"] = "sync_destination"
+            return len(self.svms)
@@ -3,3 +3,1400 @@ from trident_mcc import __version__
 
 def test_version():
     assert __version__ == '0.1.0'
+
+
+class _FakeResources:
+    """Resolves resource handles from a dict keyed by (api_version, kind), counting lookups"""
+
+    def __init__(self, resource_apis: dict):
+        self.resource_apis = resource_apis
+        self.resolved = []
+        self.invalidated = 0
+
+    def get(self, api_version, kind):
+        self.resolved.append((api_version, kind))
+        return self.resource_apis[(api_version, kind)]
+
+    def invalidate_cache(self):
+        self.invalidated += 1
+
+
+class _FakeDynamicClient:
+    def __init__(self, resource_apis: dict):
+        self.resources = _FakeResources(resource_apis)
+
+
+def _fake_k8sclient(resource_apis: dict, **attributes):
+    """K8sclient using fake resource handles, keyed by (api_version, kind), without a cluster"""
+    import threading
+
+    from trident_mcc.k8s_client import K8sclient
+
+    k8sclient = K8sclient.__new__(K8sclient)
+    k8sclient.client = _FakeDynamicClient(resource_apis)
+    k8sclient._resource_apis = {}
+    k8sclient._rate_limiter = None
+    k8sclient._throttle_retries = 3
+    k8sclient._trident_namespace = "trident"
+    k8sclient._label_selector = None
+    k8sclient._field_selector = None
+    k8sclient._list_page_size = None
+    k8sclient._secret_cache_ttl = 0
+    k8sclient._on_secret_rotated = None
+    k8sclient._secret_cache = {}
+    k8sclient._secret_cache_lock = threading.Lock()
+    for name, value in attributes.items():
+        setattr(k8sclient, f"_{name}", value)
+    return k8sclient
+
+
+def test_list_trident_backends_follows_continue_tokens():
+    import json
+
+    backend_api = _FakeBackendApi()
+
+    class PagedBackendApi:
+        """Serves two backends a page, every page from the same snapshot"""
+
+        def __init__(self):
+            self.requests = []
+
+        def get(self, serialize, **kwargs):
+            self.requests.append(kwargs)
+            page = int(kwargs["_continue"] or 0)
+            items = []
+            for index in range(page * 2, min(page * 2 + 2, 5)):
+                backend = json.loads(json.dumps(backend_api.backend))
+                backend["metadata"]["name"] = f"backend-{index}"
+                items.append(backend)
+            metadata = {"resourceVersion": "42"}
+            if page < 2:
+                metadata["continue"] = str(page + 1)
+
+            class Response:
+                data = json.dumps({"metadata": metadata, "items": items})
+
+            return Response()
+
+    paged_api = PagedBackendApi()
+    k8sclient = _fake_k8sclient(
+        {("trident.netapp.io/v1", "TridentBackendConfig"): paged_api},
+        label_selector="trident_mcc=enabled",
+        list_page_size=2,
+    )
+
+    trident_backends, resource_version = k8sclient.list_trident_backends()
+    assert [be.name for be in trident_backends] == [
+        f"backend-{index}" for index in range(5)
+    ]
+    assert resource_version == "42"
+    assert [request["_continue"] for request in paged_api.requests] == [None, "1", "2"]
+    for request in paged_api.requests:
+        assert request["namespace"] == "trident"
+        assert request["label_selector"] == "trident_mcc=enabled"
+        assert request["field_selector"] is None
+        assert request["limit"] == 2
+
+
+def test_resource_apis_are_resolved_once():
+    from kubernetes.dynamic.resource import ResourceInstance
+
+    class BackendApi:
+        def __init__(self):
+            self.gets = 0
+
+        def get(self, name, namespace, **kwargs):
+            self.gets += 1
+            return ResourceInstance(
+                None,
+                {
+                    "kind": "TridentBackendConfig",
+                    "apiVersion": "trident.netapp.io/v1",
+                    "metadata": {"name": name},
+                },
+            )
+
+    backend_api = BackendApi()
+    key = ("trident.netapp.io/v1", "TridentBackendConfig")
+    k8sclient = _fake_k8sclient({key: backend_api})
+
+    for _ in range(3):
+        k8sclient._get_trident_backend_by_name("backend-a")
+    assert k8sclient.client.resources.resolved == [key]
+    assert backend_api.gets == 3
+
+
+def test_connection_pool_shares_connections_per_credentials():
+    from trident_mcc.netapp_client.connection_pool import ConnectionPool
+
+    pool = ConnectionPool()
+    admin = {"username": "admin", "password": "one"}
+    connection, fingerprint = pool.get_connection("10.0.0.1", **admin)
+    assert pool.get_connection("10.0.0.1", **admin) == (connection, fingerprint)
+    assert pool.get_connection("10.0.0.2", **admin)[0] is not connection
+    rotated, rotated_fingerprint = pool.get_connection(
+        "10.0.0.1", username="admin", password="two"
+    )
+    assert rotated is not connection and rotated_fingerprint != fingerprint
+
+    pool.evict_credentials(**admin)
+    assert pool.get_connection("10.0.0.1", **admin)[0] is not connection
+    assert pool.get_connection("10.0.0.1", username="admin", password="two") == (
+        rotated,
+        rotated_fingerprint,
+    )
+
+    pool.evict("10.0.0.1", rotated_fingerprint)
+    assert (
+        pool.get_connection("10.0.0.1", username="admin", password="two")[0]
+        is not rotated
+    )
+
+    # Every connection has been idle for longer than a negative timeout
+    pool._idle_timeout = -1
+    connection, _ = pool.get_connection("10.0.0.2", **admin)
+    assert pool.get_connection("10.0.0.2", **admin)[0] is not connection
+
+
+class _FakeSvm:
+    """Stands in for netapp_ontap's Svm resource, serving a fixed SVM list"""
+
+    svms = []
+    queries = []
+
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+    @classmethod
+    def get_collection(cls, connection, **query):
+        cls.queries.append(query)
+        for svm in cls.svms:
+            if "uuid" in query and svm["uuid"] != query["uuid"]:
+                continue
+            # ONTAP matches names whatever their case
+            names = query.get("name", svm["name"]).lower().split("|")
+            if svm["name"].lower() not in names:
+                continue
+            yield cls(**svm)
+
+
+def test_svm_lookups_are_filtered_by_ontap(monkeypatch):
+    from trident_mcc.netapp_client import main
+
+    monkeypatch.setattr(main, "Svm", _FakeSvm)
+    _FakeSvm.queries = []
+    _FakeSvm.svms = [
+        {"name": "svm1-mc", "uuid": "1", "state": "running", "subtype": "default"},
+        {"name": "svm2", "uuid": "2", "state": "running", "subtype": "default"},
+    ]
+    netapp_client = main.NetAppClient("10.0.0.1", username="admin", password="one")
+
+    assert netapp_client.get_svm_by_name("SVM1")["uuid"] == "1"
+    assert netapp_client.get_svm_by_uuid("2")["name"] == "svm2"
+    assert netapp_client.get_svm() is None
+    assert _FakeSvm.queries == [
+        {"fields": main.SVM_FIELDS, "name": "SVM1|SVM1-mc"},
+        {"fields": main.SVM_FIELDS, "uuid": "2"},
+        {"fields": main.SVM_FIELDS, "max_records": 2},
+    ]
+
+
+def test_svm_inventory_is_shared_by_backends_on_a_cluster(monkeypatch):
+    import threading
+    import time
+
+    from trident_mcc.netapp_client import main
+    from trident_mcc.netapp_client.svm_inventory import SvmInventoryCache
+
+    monkeypatch.setattr(main, "Svm", _FakeSvm)
+    _FakeSvm.queries = []
+    _FakeSvm.svms = [
+        {"name": f"svm{index}-mc", "uuid": str(index), "state": "running"}
+        for index in range(20)
+    ]
+    svm_inventory_cache = SvmInventoryCache(ttl=60)
+    fetch = _FakeSvm.get_collection
+
+    def slow_fetch(connection, **query):
+        time.sleep(0.1)
+        return fetch(connection, **query)
+
+    monkeypatch.setattr(_FakeSvm, "get_collection", slow_fetch)
+
+    answers = {}
+
+    def lookup(index):
+        netapp_client = main.NetAppClient(
+            "10.0.0.1",
+            username="admin",
+            password="one",
+            svm_inventory_cache=svm_inventory_cache,
+        )
+        answers[index] = netapp_client.get_svm_by_name(f"svm{index}")
+
+    threads = [threading.Thread(target=lookup, args=(index,)) for index in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert {index: svm["uuid"] for index, svm in answers.items()} == {
+        index: str(index) for index in range(20)
+    }
+    assert _FakeSvm.queries == [{"fields": main.SVM_FIELDS}]
+
+    # Other credentials get their own inventory, invalidating drops every one for the LIF
+    other = main.NetAppClient(
+        "10.0.0.1",
+        username="other",
+        password="two",
+        svm_inventory_cache=svm_inventory_cache,
+    )
+    assert other.get_svm_by_uuid("3")["name"] == "svm3-mc"
+    assert len(_FakeSvm.queries) == 2
+    svm_inventory_cache.invalidate_management_lif("10.0.0.1")
+    assert other.get_svm_by_uuid("3")["name"] == "svm3-mc"
+    assert len(_FakeSvm.queries) == 3
+
+
+def test_backend_credentials_cached_until_secret_rotates():
+    import base64
+
+    from kubernetes.dynamic.resource import ResourceInstance
+
+    class FakeSecretApi:
+        def __init__(self):
+            self.password = "one"
+            self.resource_version = "1"
+            self.gets = 0
+
+        def get(self, name, namespace):
+            self.gets += 1
+            return ResourceInstance(
+                None,
+                {
+                    "kind": "Secret",
+                    "apiVersion": "v1",
+                    "metadata": {
+                        "name": name,
+                        "resourceVersion": self.resource_version,
+                    },
+                    "data": {
+                        "username": base64.b64encode(b"admin").decode(),
+                        "password": base64.b64encode(self.password.encode()).decode(),
+                    },
+                },
+            )
+
+    rotated = []
+    secret_api = FakeSecretApi()
+    k8sclient = _fake_k8sclient(
+        {("v1", "Secret"): secret_api},
+        secret_cache_ttl=60,
+        on_secret_rotated=lambda name, previous: rotated.append(
+            (name, previous["password"])
+        ),
+    )
+    backend_api = _FakeBackendApi()
+    backend_api.update(spec={"credentials": {"name": "backend-a-secret"}})
+    trident_config = backend_api.view()
+
+    credentials = k8sclient._get_backend_credentials(trident_config)
+    assert credentials == {"username": "admin", "password": "one"}
+    assert k8sclient._get_backend_credentials(trident_config) == credentials
+    assert secret_api.gets == 1
+
+    # Once expired the Secret is read again, but only decoded if it has changed
+    k8sclient._secret_cache_ttl = 0
+    assert k8sclient._get_backend_credentials(trident_config) is credentials
+    assert secret_api.gets == 2
+    assert rotated == []
+
+    secret_api.password = "two"
+    secret_api.resource_version = "2"
+    assert k8sclient._get_backend_credentials(trident_config)["password"] == "two"
+    assert rotated == [("backend-a-secret", "one")]
+
+    k8sclient._secret_cache_ttl = 60
+    k8sclient.invalidate_backend_credentials(trident_config)
+    k8sclient._get_backend_credentials(trident_config)
+    assert secret_api.gets == 4
+
+
+def test_histogram_render():
+    from trident_mcc.metrics import Histogram
+
+    histogram = Histogram(
+        "test_seconds", "Test histogram.", labels=("phase",), buckets=(1, 5)
+    )
+    histogram.observe(0.5, phase="list")
+    histogram.observe(3, phase="list")
+
+    lines = histogram.render()
+    assert 'test_seconds_bucket{phase="list",le="1.0"} 1' in lines
+    assert 'test_seconds_bucket{phase="list",le="5.0"} 2' in lines
+    assert 'test_seconds_bucket{phase="list",le="+Inf"} 2' in lines
+    assert 'test_seconds_sum{phase="list"} 3.5' in lines
+    assert 'test_seconds_count{phase="list"} 2' in lines
+
+
+def test_unified_runtime_status_updates_reach_app_state_and_metrics():
+    import asyncio
+    import time
+
+    from trident_mcc import healthz, metrics
+    from trident_mcc.models import (
+        AppHealth,
+        CycleReport,
+        RepairEvent,
+        StateEnum,
+        StatusUpdate,
+    )
+
+    now = time.time()
+    repair = RepairEvent(
+        backend_name="backend-a",
+        management_lif="10.9.9.9",
+        svm_name="svm1-mc",
+        detected_at=now - 5,
+        repaired_at=now,
+        time_to_repair=5,
+        cycles=1,
+    )
+    cycle = CycleReport(
+        duration=1, backends_patched=1, lif_requests={"10.9.9.9": 3}, repairs=[repair]
+    )
+    healthz.app_state = AppHealth(state=StateEnum.STARTING)
+    healthz.repair_history.clear()
+
+    # A failed sweep's report isn't recorded, only its state
+    assert asyncio.run(
+        healthz.record_status(
+            StatusUpdate(state=StateEnum.ERROR, message="failed", cycle=cycle)
+        )
+    )
+    assert healthz.app_state.state == StateEnum.ERROR
+    assert 'trident_mcc_ontap_requests_total{management_lif="10.9.9.9"}' not in (
+        metrics.render()
+    )
+    assert not healthz.repair_history
+
+    assert asyncio.run(
+        healthz.record_status(StatusUpdate(state=StateEnum.OK, cycle=cycle))
+    )
+    assert healthz.app_state.state == StateEnum.OK
+    rendered = metrics.render()
+    assert 'trident_mcc_ontap_requests_total{management_lif="10.9.9.9"} 3' in rendered
+    assert (
+        'trident_mcc_time_to_repair_seconds_count{management_lif="10.9.9.9"} 1'
+        in rendered
+    )
+    assert list(healthz.repair_history) == [repair]
+    healthz.repair_history.clear()
+
+
+def test_async_session_parses_responses_and_reuses_connections(monkeypatch):
+    import asyncio
+    import json
+
+    from trident_mcc.netapp_client.async_client import AsyncOntapSession
+
+    async def read(response: bytes):
+        reader = asyncio.StreamReader()
+        reader.feed_data(response)
+        reader.feed_eof()
+        return await AsyncOntapSession._read_response(reader)
+
+    status, headers, body = asyncio.run(
+        read(
+            b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n"
+            b"5;ext=1\r\nhello\r\n6\r\n world\r\n0\r\nX-Trailer: 1\r\n\r\n"
+        )
+    )
+    assert (status, body) == (200, b"hello world")
+    status, headers, body = asyncio.run(
+        read(b"HTTP/1.1 404 Not Found\r\nContent-Length: 2\r\n\r\n{}extra")
+    )
+    assert (status, body) == (404, b"{}")
+    assert "connection" not in headers
+    # Without framing the body runs to the end of the connection, which can't be reused
+    status, headers, body = asyncio.run(read(b"HTTP/1.0 200 OK\r\n\r\n{}"))
+    assert (body, headers["connection"]) == (b"{}", "close")
+
+    class FakeWriter:
+        """Answers every request on its connection, closing it after closes_after"""
+
+        def __init__(self, reader, closes_after):
+            self.reader = reader
+            self.closes_after = closes_after
+            self.requests = []
+            self.closed = False
+
+        def write(self, data):
+            self.requests.append(data)
+            if len(self.requests) > self.closes_after:
+                self.reader.feed_eof()
+                return
+            body = json.dumps({"records": [{"name": "svm1"}]}).encode()
+            self.reader.feed_data(
+                b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n%s" % (len(body), body)
+            )
+
+        async def drain(self):
+            pass
+
+        def close(self):
+            self.closed = True
+
+    connections = []
+
+    async def open_connection(host, port, ssl):
+        reader = asyncio.StreamReader()
+        # The first connection is closed by ONTAP once it has been used twice
+        writer = FakeWriter(reader, closes_after=2 if not connections else 100)
+        connections.append(writer)
+        return reader, writer
+
+    monkeypatch.setattr(asyncio, "open_connection", open_connection)
+
+    async def get_svms(session, count):
+        return [
+            await session.get_json(
+                "10.0.0.1", "/api/svm/svms", username="admin", password="one"
+            )
+            for _ in range(count)
+        ]
+
+    session = AsyncOntapSession()
+    responses = asyncio.run(get_svms(session, 4))
+    assert responses == [{"records": [{"name": "svm1"}]}] * 4
+    assert [len(writer.requests) for writer in connections] == [3, 2]
+    assert connections[0].closed and not connections[1].closed
+    assert connections[0].requests[0].startswith(b"GET /api/svm/svms HTTP/1.1\r\n")
+    assert b"Authorization: Basic YWRtaW46b25l\r\n" in connections[0].requests[0]
+
+    asyncio.run(session.close())
+    assert connections[1].closed
+
+
+def test_async_session_handles_interim_malformed_responses_and_ipv6(monkeypatch):
+    import asyncio
+
+    from trident_mcc.netapp_client import CircuitBreakers
+    from trident_mcc.netapp_client.async_client import (
+        AsyncOntapSession,
+        MalformedResponseError,
+    )
+
+    async def read(response: bytes):
+        reader = asyncio.StreamReader()
+        reader.feed_data(response)
+        reader.feed_eof()
+        return await AsyncOntapSession._read_response(reader)
+
+    # Interim responses are skipped, the final response follows them
+    status, headers, body = asyncio.run(
+        read(
+            b"HTTP/1.1 100 Continue\r\n\r\n"
+            b"HTTP/1.1 103 Early Hints\r\nLink: </style.css>\r\n\r\n"
+            b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\n{}"
+        )
+    )
+    assert (status, headers, body) == (200, {"content-length": "2"}, b"{}")
+    # A 204 has no body even without framing, so the connection stays usable
+    status, headers, body = asyncio.run(read(b"HTTP/1.1 204 No Content\r\n\r\n"))
+    assert (status, body) == (204, b"")
+    assert "connection" not in headers
+
+    for response in (
+        b"garbage\r\n\r\n",
+        b"HTTP/1.1 OK\r\n\r\n",
+        b"HTTP/1.1 200 OK\r\nContent-Length: two\r\n\r\n{}",
+        b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\nzz\r\n",
+    ):
+        try:
+            asyncio.run(read(response))
+        except MalformedResponseError:
+            pass
+        else:
+            raise AssertionError(f"Expected MalformedResponseError for {response!r}")
+
+    class FakeWriter:
+        def __init__(self, reader, responses):
+            self.reader = reader
+            self.responses = responses
+            self.requests = []
+            self.closed = False
+
+        def write(self, data):
+            self.requests.append(data)
+            self.reader.feed_data(self.responses.pop(0))
+
+        async def drain(self):
+            pass
+
+        def close(self):
+            self.closed = True
+
+    ok = b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\n{}"
+    # What each new connection answers, in order
+    connection_responses = [[ok, b"\x15\x03\x03 not http\r\n\r\n"], [ok], [b"???\r\n"]]
+    connections = []
+
+    async def open_connection(host, port, ssl):
+        reader = asyncio.StreamReader()
+        writer = FakeWriter(reader, connection_responses.pop(0))
+        connections.append((host, port, writer))
+        return reader, writer
+
+    monkeypatch.setattr(asyncio, "open_connection", open_connection)
+
+    circuit_breakers = CircuitBreakers(failure_threshold=1)
+    session = AsyncOntapSession(circuit_breakers=circuit_breakers)
+
+    async def get(management_lif):
+        return await session.get_json(
+            management_lif, "/api/cluster", username="admin", password="one"
+        )
+
+    # A garbled response on a reused connection is retried on a new one
+    assert asyncio.run(get("fd00::1")) == {}
+    assert asyncio.run(get("fd00::1")) == {}
+    assert [(host, port) for host, port, _ in connections] == [("fd00::1", 443)] * 2
+    assert b"\r\nHost: [fd00::1]\r\n" in connections[0][2].requests[0]
+    assert circuit_breakers.open_circuits() == []
+
+    # On a new connection it is a failure like a dropped connection
+    try:
+        asyncio.run(get("[fd00::2]:8443"))
+    except MalformedResponseError:
+        pass
+    else:
+        raise AssertionError("Expected MalformedResponseError")
+    host, port, writer = connections[-1]
+    assert (host, port) == ("fd00::2", 8443)
+    assert b"\r\nHost: [fd00::2]:8443\r\n" in writer.requests[0]
+    assert circuit_breakers.open_circuits() == ["[fd00::2]:8443"]
+    assert set(session._lif_semaphores) == {"fd00::1", "[fd00::2]:8443"}
+
+
+def test_adaptive_polling_follows_metrocluster_transitions():
+    from datetime import datetime, timedelta, timezone
+
+    from trident_mcc.polling import metrocluster_in_transition, next_polling_interval
+
+    def state(local_mode="normal", operation_state=None, ended_ago=None):
+        operation = None
+        if operation_state is not None:
+            operation = {
+                "type": "switchover",
+                "state": operation_state,
+                "end_time": (
+                    datetime.now(timezone.utc) - timedelta(seconds=ended_ago)
+                    if ended_ago is not None
+                    else None
+                ),
+            }
+        return {
+            "local_mode": local_mode,
+            "remote_mode": "normal",
+            "operation": operation,
+        }
+
+    assert not metrocluster_in_transition(state(), 300)
+    assert metrocluster_in_transition(state(local_mode="partial_switchback"), 300)
+    assert metrocluster_in_transition(state(operation_state="in_progress"), 300)
+    assert metrocluster_in_transition(state("switchover", "completed", 60), 300)
+    assert not metrocluster_in_transition(state("switchover", "completed", 600), 300)
+
+    intervals = [300]
+    for in_transition in (True, True, False, False, False, False, False):
+        intervals.append(next_polling_interval(intervals[-1], in_transition, 10, 300))
+    assert intervals == [300, 10, 10, 20, 40, 80, 160, 300]
+
+
+def test_reconcile_triggers_coalesce():
+    from trident_mcc.triggers import ReconcileTriggers
+
+    triggers = ReconcileTriggers(debounce=0, max_delay=0)
+    assert triggers.wait(0) is None
+
+    triggers.request(management_lif="10.0.0.1")
+    triggers.request(backend_name="backend-a")
+    triggers.request(management_lif="10.0.0.1")
+
+    scope = triggers.wait(0)
+    assert not scope.full
+    assert scope.backend_names == {"backend-a"}
+    assert scope.management_lifs == {"10.0.0.1"}
+    assert triggers.wait(0) is None
+
+
+def test_reconcile_scheduler_backs_off_failed_backends():
+    import threading
+    import time
+
+    from trident_mcc.models import ReconcileResult
+    from trident_mcc.scheduler import ReconcileScheduler
+    from trident_mcc.triggers import ReconcileTriggers
+
+    class Backend:
+        def __init__(self, name):
+            self.name = name
+
+    a, b = Backend("backend-a"), Backend("backend-b")
+    scheduler = ReconcileScheduler(
+        ReconcileTriggers(debounce=0, max_delay=0),
+        jitter=0,
+        retry_interval=0.05,
+        max_retry_interval=0.15,
+    )
+
+    delays = []
+    for _ in range(4):
+        start_time = time.time()
+        scheduler.record_results([a], [ReconcileResult.FAILED])
+        delays.append(round(scheduler._retries["backend-a"][1] - start_time, 2))
+    assert delays == [0.05, 0.1, 0.15, 0.15]
+
+    # Skipped backends keep their retry, a full sweep drops retries for backends not in it
+    scheduler.record_results([a, b], [ReconcileResult.SKIPPED, ReconcileResult.FAILED])
+    assert set(scheduler._retries) == {"backend-a", "backend-b"}
+    scheduler.record_results([b], [ReconcileResult.FAILED], full=True)
+    assert set(scheduler._retries) == {"backend-b"}
+
+    assert scheduler.poll() is None
+    scope = scheduler.wait(time.time() + 5)
+    assert scope.backend_names == {"backend-b"}
+    scheduler.record_results([b], [ReconcileResult.PATCHED])
+    assert scheduler.wait(time.time() + 0.05) is None
+
+    # Stopping wakes a waiting loop straight away
+    threading.Timer(0.05, scheduler.stop).start()
+    start_time = time.time()
+    assert scheduler.wait(time.time() + 5) is None
+    assert time.time() - start_time < 1
+
+
+def test_repair_tracker_counts_cycles():
+    from trident_mcc.metrics import RepairTracker, cycle_stats
+
+    tracker = RepairTracker()
+    tracker.mismatch("backend-a", "svm1")
+    tracker.mismatch("backend-a", "svm1")
+    tracker.mismatch("backend-b", "svm2")
+    tracker.discard("backend-b")
+
+    repair = tracker.repaired("backend-a", "10.0.0.1", "svm1-mc")
+    assert repair.cycles == 2
+    assert repair.previous_svm_name == "svm1"
+    assert repair.time_to_repair == repair.repaired_at - repair.detected_at
+    assert repair in cycle_stats.report(duration=0).repairs
+    assert tracker.repaired("backend-b", "10.0.0.1", "svm2-mc") is None
+    cycle_stats.reset()
+
+
+def test_shard_owner_only_moves_departed_members_keys():
+    from trident_mcc.sharding import shard_owner
+
+    lifs = [f"10.0.0.{index}" for index in range(50)]
+    before = {lif: shard_owner(lif, {"pod-a", "pod-b", "pod-c"}) for lif in lifs}
+    after = {lif: shard_owner(lif, {"pod-a", "pod-b"}) for lif in lifs}
+
+    assert set(before.values()) == {"pod-a", "pod-b", "pod-c"}
+    for lif in lifs:
+        if before[lif] != "pod-c":
+            assert after[lif] == before[lif]
+
+
+def test_shard_membership_renew_drops_expired_leases():
+    import time
+
+    from kubernetes.dynamic.resource import ResourceInstance
+
+    from trident_mcc.sharding import ShardMembership
+
+    class FakeK8sclient:
+        def __init__(self):
+            self.renew_times = {"pod-a": "1", "pod-b": "1", "pod-c": "1"}
+            self.deleted = []
+
+        def renew_lease(self, name, holder_identity, lease_duration, labels=None):
+            pass
+
+        def list_leases(self, label_selector):
+            leases = [
+                {
+                    "metadata": {
+                        "name": f"trident-mcc-shard-{holder}",
+                        "labels": {"trident_mcc_shard": "member"},
+                    },
+                    "spec": {"holderIdentity": holder, "renewTime": renew_time},
+                }
+                for holder, renew_time in self.renew_times.items()
+            ]
+            # Leader election Leases of other controllers aren't members
+            leases.append(
+                {"metadata": {"name": "other"}, "spec": {"holderIdentity": "other"}}
+            )
+            return ResourceInstance(
+                None,
+                {
+                    "apiVersion": "coordination.k8s.io/v1",
+                    "kind": "LeaseList",
+                    "items": leases,
+                },
+            ).items
+
+        def delete_lease(self, name):
+            self.deleted.append(name)
+            self.renew_times.pop(name[len("trident-mcc-shard-") :])
+
+    k8sclient = FakeK8sclient()
+    membership = ShardMembership(k8sclient, "pod-a", lease_duration=0.05)
+
+    assert membership.renew()
+    assert membership.members == {"pod-a", "pod-b", "pod-c"}
+
+    # pod-b keeps renewing, pod-c's Lease expires
+    time.sleep(0.06)
+    k8sclient.renew_times["pod-b"] = "2"
+    assert membership.renew()
+    assert membership.members == {"pod-a", "pod-b"}
+    assert k8sclient.deleted == []
+
+    time.sleep(0.2)
+    k8sclient.renew_times["pod-b"] = "3"
+    membership.renew()
+    assert membership.members == {"pod-a", "pod-b"}
+    assert k8sclient.deleted == ["trident-mcc-shard-pod-c"]
+
+
+def test_circuit_breaker_half_open_probe():
+    import time
+
+    from trident_mcc.netapp_client import CircuitBreakers
+
+    breakers = CircuitBreakers(
+        failure_threshold=2, reset_timeout=0.05, max_reset_timeout=0.05
+    )
+    breakers.record_failure("10.0.0.1")
+    assert breakers.open_circuits() == []
+    breakers.record_failure("10.0.0.1")
+    assert breakers.open_circuits() == ["10.0.0.1"]
+    assert not breakers.allow("10.0.0.1")
+
+    time.sleep(0.06)
+    # Only one probe is let through while half-open
+    assert breakers.allow("10.0.0.1")
+    assert not breakers.allow("10.0.0.1")
+    assert breakers.allow("10.0.0.2")
+
+    breakers.record_success("10.0.0.1")
+    assert breakers.open_circuits() == []
+    assert breakers.allow("10.0.0.1")
+
+
+def test_state_snapshot_round_trip():
+    from trident_mcc.k8s_client import BackendView
+    from trident_mcc.models import ReconcileResult
+    from trident_mcc.snapshot import StateSnapshot
+
+    def backend(name, resource_version, management_lif):
+        return BackendView(
+            name,
+            resource_version=resource_version,
+            management_lif=management_lif,
+            svm=f"{name}-svm",
+            annotations={"trident_mcc_svm_uuid": f"{name}-uuid"},
+        )
+
+    backends = [
+        backend("a", "1", "10.0.0.1"),
+        backend("b", "2", "10.0.0.2"),
+        backend("c", "3", "10.0.0.2"),
+    ]
+    snapshot = StateSnapshot.from_sweep(
+        None,
+        backends,
+        [ReconcileResult.UNCHANGED, ReconcileResult.FAILED, ReconcileResult.PATCHED],
+        {
+            "10.0.0.1": [
+                {
+                    "name": "a-svm-mc",
+                    "uuid": "x",
+                    "state": "running",
+                    "subtype": "sync_destination",
+                }
+            ]
+        },
+    )
+    loaded = StateSnapshot.loads(snapshot.dumps())
+
+    assert loaded.digest() == snapshot.digest()
+    assert loaded.switchover_lifs == {"10.0.0.1"}
+    assert not loaded.changed(backends[0])
+    assert loaded.changed(backend("a", "3", "10.0.0.1"))
+    # Failed backends aren't recorded, so they are checked first after a restart
+    assert loaded.changed(backends[1])
+    # Nor are patched ones, their SVM name and UUID are as they were before the patch
+    assert "c" not in loaded.backends
+
+
+def test_backend_view_projection():
+    from trident_mcc.k8s_client import BackendView
+
+    view = BackendView.from_dict(
+        {
+            "metadata": {
+                "name": "backend-a",
+                "resourceVersion": "42",
+                "generation": 3,
+                "annotations": {
+                    "trident_mcc_svm_uuid": "1234",
+                    "kubectl.kubernetes.io/last-applied-configuration": "{...}",
+                },
+                "managedFields": [{"manager": "kubectl"}],
+            },
+            "spec": {
+                "storageDriverName": "ontap-nas",
+                "managementLIF": "10.0.0.1",
+                "credentials": {"name": "ontap-secret"},
+            },
+            "status": {"phase": "Bound"},
+        }
+    )
+
+    assert view.name == "backend-a"
+    assert view.resource_version == "42"
+    assert view.generation == 3
+    assert view.storage_driver == "ontap-nas"
+    assert view.management_lif == "10.0.0.1"
+    assert view.svm is None
+    assert view.credentials_name == "ontap-secret"
+    assert view.annotations == {"trident_mcc_svm_uuid": "1234"}
+    assert not hasattr(view, "__dict__")
+
+
+def test_rate_limiter_serves_failover_first():
+    import threading
+    import time
+
+    from trident_mcc.k8s_client import RateLimiter, RequestPriority
+
+    limiter = RateLimiter(qps=100, burst=1)
+    # e.g. a 429 with Retry-After, everything queues until it has passed
+    limiter.backoff(0.2)
+    order = []
+
+    def request(priority):
+        limiter.acquire(priority)
+        order.append(priority)
+
+    verify = threading.Thread(target=request, args=(RequestPriority.VERIFY,))
+    verify.start()
+    time.sleep(0.05)
+    failover = threading.Thread(target=request, args=(RequestPriority.FAILOVER,))
+    failover.start()
+    verify.join()
+    failover.join()
+
+    assert order == [RequestPriority.FAILOVER, RequestPriority.VERIFY]
+
+
+def test_cycle_profiler_samples_requested_cycles():
+    from trident_mcc.k8s_client import RateLimiter
+    from trident_mcc.profiler import CycleProfiler
+
+    profiler = CycleProfiler(interval=0.005)
+    limiter = RateLimiter(qps=100, burst=1)
+
+    @profiler.profiled
+    def cycle():
+        limiter.backoff(0.1)
+        limiter.acquire()
+
+    cycle()
+    assert profiler.result() is None
+
+    profiler.request(cycles=2)
+    cycle()
+    assert profiler.in_progress and profiler.result() is None
+    cycle()
+
+    assert not profiler.in_progress
+    assert profiler.result()["cycles"] == 2
+    assert profiler.phases()["other"] > 0.1
+    assert "rate_limiter:acquire" in profiler.collapsed().splitlines()[0]
+
+
+def test_wire_log_keeps_failures_and_redacts():
+    from trident_mcc.netapp_client import WireLog
+
+    wire_log = WireLog(sample_rate=0, management_lifs=["10.0.0.1"], size=2)
+
+    wire_log.record("10.0.0.1", "GET", "/api/svm/svms", status=200, response_body=b"{}")
+    wire_log.record("10.0.0.2", "GET", "/api/svm/svms", error="timed out")
+    assert wire_log.dump() == []
+
+    wire_log.record(
+        "10.0.0.1",
+        "POST",
+        "/api/security/accounts?fields=name&token=abc",
+        status=400,
+        request_body='{"name": "admin", "password": "netapp123"}',
+        response_body=b'{"error": {"message": "invalid"}}',
+    )
+    exchange = wire_log.dump()[0]
+    assert "netapp123" not in str(exchange) and "abc" not in exchange["path"]
+    assert exchange["response_body"] == '{"error":{"message":"invalid"}}'
+
+    for _ in range(3):
+        wire_log.record("10.0.0.1", "GET", "/api/cluster", error="timed out")
+    assert len(wire_log.dump("10.0.0.1")) == 2
+
+
+class _FakeJobMonitor:
+    """JobMonitor checking that jobs never overlap"""
+
+    def __init__(self):
+        self.terminate = False
+        self.jobs = []
+
+    def start_job(self):
+        import threading
+
+        # Nothing may start while another job is running
+        assert not self.jobs
+        self.jobs.append(threading.get_ident())
+
+    def end_job(self):
+        self.jobs.pop()
+
+
+class _FakeWatchK8sclient:
+    """K8sclient listing and watching TridentBackendConfigs with the given functions"""
+
+    def __init__(self, list_backends, watch_backends):
+        self.list_backends = list_backends
+        self.watch_backends = watch_backends
+
+    def list_trident_backends(self):
+        return self.list_backends()
+
+    def watch_trident_backends(self, resource_version, timeout_seconds=None):
+        return self.watch_backends(resource_version)
+
+
+def test_backend_watcher_runs_triggers_between_events():
+    from trident_mcc.k8s_client import BackendView
+    from trident_mcc.models import ReconcileResult
+    from trident_mcc.scheduler import ReconcileScheduler
+    from trident_mcc.triggers import ReconcileTriggers
+    from trident_mcc.watcher import BackendWatcher
+
+    triggers = ReconcileTriggers(debounce=0, max_delay=0)
+    calls = []
+    job_monitor = _FakeJobMonitor()
+
+    def watch_backends(resource_version):
+        # e.g. POST /reconcile arrives while the stream is open
+        triggers.request(backend_name="b")
+        yield "MODIFIED", BackendView("a", "2", 2)
+        yield "MODIFIED", BackendView("b", "3", 1)
+        job_monitor.terminate = True
+        yield "BOOKMARK", BackendView("", "4")
+
+    watcher = BackendWatcher(
+        _FakeWatchK8sclient(
+            lambda: ([BackendView("a", "1", 1), BackendView("b", "1", 1)], "1"),
+            watch_backends,
+        ),
+        ReconcileScheduler(triggers, jitter=0),
+        sweep=lambda backends: calls.append(("sweep", len(backends))),
+        reconcile=lambda backend: calls.append(("reconcile", backend.name))
+        or ReconcileResult.UNCHANGED,
+        reconcile_scope=lambda scope, backends: calls.append(
+            ("triggered", sorted(scope.backend_names))
+        ),
+        resync_interval=lambda: 300,
+    )
+    watcher.run(job_monitor)
+
+    # The status only change to b isn't reconciled, the trigger runs after a's event
+    assert calls == [("sweep", 2), ("reconcile", "a"), ("triggered", ["b"])]
+    assert watcher.resource_version == "4"
+    assert watcher.backends["b"].resource_version == "3"
+
+
+def test_backend_watcher_relists_after_watch_errors():
+    import urllib3
+    from kubernetes.client.exceptions import ApiException
+
+    from trident_mcc.k8s_client import BackendView
+    from trident_mcc.models import ReconcileResult
+    from trident_mcc.scheduler import ReconcileScheduler
+    from trident_mcc.triggers import ReconcileTriggers
+    from trident_mcc.watcher import BackendWatcher
+
+    job_monitor = _FakeJobMonitor()
+    # What each watch does after its first event - expire, fail, drop the connection, stop
+    outcomes = [
+        ApiException(status=410),
+        ApiException(status=403),
+        urllib3.exceptions.ProtocolError("Connection reset by peer"),
+        None,
+    ]
+    lists = []
+
+    def list_backends():
+        lists.append(len(lists))
+        return [BackendView("a", str(len(lists)), 1)], str(len(lists))
+
+    def watch_backends(resource_version):
+        yield "MODIFIED", BackendView("a", f"{resource_version}.1", len(lists) + 1)
+        outcome = outcomes.pop(0)
+        if outcome is not None:
+            raise outcome
+        job_monitor.terminate = True
+
+    reconciled = []
+    watcher = BackendWatcher(
+        _FakeWatchK8sclient(list_backends, watch_backends),
+        ReconcileScheduler(ReconcileTriggers(), jitter=0),
+        sweep=lambda backends: None,
+        reconcile=lambda backend: reconciled.append(backend.resource_version)
+        or ReconcileResult.UNCHANGED,
+        reconcile_scope=lambda scope, backends: None,
+        resync_interval=lambda: 300,
+        retry_interval=0.01,
+    )
+    watcher.run(job_monitor)
+
+    # Every failure is followed by a relist, and the watch resumes from the new list
+    assert lists == [0, 1, 2, 3]
+    assert reconciled == ["1.1", "2.1", "3.1", "4.1"]
+    assert outcomes == []
+
+
+def test_unified_runtime_reports_reconcile_loop_failure():
+    import asyncio
+    import threading
+
+    from trident_mcc import healthz
+    from trident_mcc.models import AppHealth, StateEnum
+
+    def run(job_monitor):
+        raise RuntimeError("API Server unreachable")
+
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    try:
+        healthz.app_state = AppHealth(state=StateEnum.OK)
+        healthz._run_reconciler(run, _FakeJobMonitor(), loop)
+        assert healthz.app_state.state == StateEnum.ERROR
+        assert "API Server unreachable" in healthz.app_state.message
+
+        # Stopping when asked to, e.g. on shutdown, isn't a failure
+        healthz.app_state = AppHealth(state=StateEnum.OK)
+        job_monitor = _FakeJobMonitor()
+        job_monitor.terminate = True
+        healthz._run_reconciler(lambda job_monitor: None, job_monitor, loop)
+        assert healthz.app_state.state == StateEnum.OK
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+
+
+def test_map_per_lif_slow_lif_doesnt_block_others():
+    import threading
+
+    from trident_mcc.k8s_client import BackendView
+    from trident_mcc.lif_queues import map_per_lif
+
+    slow_lif_released = threading.Event()
+    fast_lif_done = threading.Event()
+    fast_done = []
+
+    def reconcile(trident_config):
+        if trident_config.management_lif == "10.0.0.1":
+            slow_lif_released.wait(5)
+        else:
+            fast_done.append(trident_config.name)
+            if len(fast_done) == 3:
+                fast_lif_done.set()
+        return trident_config.name
+
+    # The slow LIF's backends come first, they used to take every worker
+    backends = [
+        BackendView(f"slow-{i}", management_lif="10.0.0.1") for i in range(4)
+    ] + [BackendView(f"fast-{i}", management_lif="10.0.0.2") for i in range(3)]
+    results = []
+    runner = threading.Thread(
+        target=lambda: results.extend(map_per_lif(reconcile, backends, 2, 1))
+    )
+    runner.start()
+
+    assert fast_lif_done.wait(2)
+    slow_lif_released.set()
+    runner.join()
+    assert results == [be.name for be in backends]
+
+
+def test_hedged_lookups_alternate_answers_while_primary_hangs():
+    import threading
+    import time
+
+    from trident_mcc.hedging import HedgedLookups
+
+    primary_released = threading.Event()
+
+    class HangingClient:
+        def get_svm_by_uuid(self, svm_uuid):
+            primary_released.wait(5)
+            return {"name": "svm1", "uuid": svm_uuid, "state": "stopped"}
+
+    class AlternateClient:
+        def get_svm_by_uuid(self, svm_uuid):
+            return {"name": "svm1-mc", "uuid": svm_uuid, "state": "running"}
+
+    hedged_lookups = HedgedLookups(concurrency=1)
+    # Each backend leaves its primary lookup hanging, later ones mustn't queue behind it
+    for _ in range(3):
+        start_time = time.time()
+        svm_details = hedged_lookups.lookup_svm(
+            [HangingClient(), AlternateClient()], "svm1", "1234"
+        )
+        assert time.time() - start_time < 1
+        assert svm_details["name"] == "svm1-mc"
+
+    primary_released.set()
+
+
+class _FakeBackendApi:
+    """TridentBackendConfig resource handle serving one backend, rejecting stale patches"""
+
+    def __init__(self, name="backend-a", svm="svm1", annotations=None):
+        self.backend = {
+            "kind": "TridentBackendConfig",
+            "apiVersion": "trident.netapp.io/v1",
+            "metadata": {
+                "name": name,
+                "resourceVersion": "1",
+                "annotations": annotations or {},
+            },
+            "spec": {
+                "storageDriverName": "ontap-nas",
+                "managementLIF": "10.0.0.1",
+                "svm": svm,
+            },
+        }
+        self.patches = []
+        self.gets = 0
+
+    def update(self, annotations=None, spec=None):
+        """Changes the backend behind our back, as Trident or a user would"""
+        metadata = self.backend["metadata"]
+        metadata["annotations"].update(annotations or {})
+        self.backend["spec"].update(spec or {})
+        metadata["resourceVersion"] = str(int(metadata["resourceVersion"]) + 1)
+
+    def view(self):
+        from trident_mcc.k8s_client import BackendView
+
+        return BackendView.from_dict(self.backend)
+
+    def get(self, name, namespace, **kwargs):
+        from kubernetes.dynamic.resource import ResourceInstance
+
+        self.gets += 1
+        return ResourceInstance(None, self.backend)
+
+    def patch(self, body, name, namespace, content_type):
+        from kubernetes.client.exceptions import ApiException
+        from kubernetes.dynamic.exceptions import ConflictError
+        from kubernetes.dynamic.resource import ResourceInstance
+
+        self.patches.append(body)
+        if (
+            body["metadata"]["resourceVersion"]
+            != self.backend["metadata"]["resourceVersion"]
+        ):
+            raise ConflictError(ApiException(status=409, reason="Conflict"))
+        self.update(body["metadata"]["annotations"], body["spec"])
+        return ResourceInstance(None, self.backend)
+
+
+def test_patch_backend_sends_only_changed_fields():
+    backend_api = _FakeBackendApi(annotations={"trident_mcc_update_count": "2"})
+    k8sclient = _fake_k8sclient(
+        {("trident.netapp.io/v1", "TridentBackendConfig"): backend_api}
+    )
+
+    assert k8sclient._patch_backend_with_svmname(
+        backend_api.view(), svm_name="svm1-mc", svm_uuid="1234"
+    )
+    assert backend_api.patches == [
+        {
+            "metadata": {
+                "resourceVersion": "1",
+                "annotations": {
+                    "trident_mcc_managed": "True",
+                    "trident_mcc_svm_uuid": "1234",
+                    "trident_mcc_update_count": "3",
+                },
+            },
+            "spec": {"svm": "svm1-mc"},
+        }
+    ]
+
+
+def test_patch_backend_retries_after_conflict():
+    backend_api = _FakeBackendApi(annotations={"trident_mcc_svm_uuid": "1234"})
+    k8sclient = _fake_k8sclient(
+        {("trident.netapp.io/v1", "TridentBackendConfig"): backend_api}
+    )
+    stale = backend_api.view()
+    # e.g. Trident updated an annotation after we read the backend
+    backend_api.update(annotations={"trident_mcc_update_count": "1"})
+
+    assert k8sclient._patch_backend_with_svmname(stale, "svm1-mc", "1234")
+    assert backend_api.gets == 1
+    assert [patch["metadata"]["resourceVersion"] for patch in backend_api.patches] == [
+        "1",
+        "2",
+    ]
+    # Built from the backend as read again, not the stale copy
+    assert (
+        backend_api.patches[1]["metadata"]["annotations"]["trident_mcc_update_count"]
+        == "2"
+    )
+    assert backend_api.backend["spec"]["svm"] == "svm1-mc"
+
+    # Someone else repaired it meanwhile, nothing left to patch
+    backend_api.update(spec={"svm": "svm1"})
+    stale = backend_api.view()
+    backend_api.update(spec={"svm": "svm1-mc"})
+    backend_api.patches = []
+    assert k8sclient._patch_backend_with_svmname(stale, "svm1-mc", "1234")
+    assert len(backend_api.patches) == 1
+
+    # Now pointing at a different SVM, so it isn't ours to change any more
+    stale = backend_api.view()
+    backend_api.update(annotations={"trident_mcc_svm_uuid": "5678"})
+    assert not k8sclient._patch_backend_with_svmname(stale, "svm2", "1234")
+    assert backend_api.backend["spec"]["svm"] == "svm1-mc"
+
+
+def test_stale_resource_is_resolved_again_for_every_verb():
+    import json
+
+    from kubernetes.client.exceptions import ApiException
+    from kubernetes.dynamic.exceptions import NotFoundError
+
+    def not_found(name=None):
+        err = ApiException(status=404, reason="Not Found")
+        err.body = json.dumps(
+            {
+                "kind": "Status",
+                "reason": "NotFound",
+                "details": {"name": name} if name else {},
+            }
+        )
+        return NotFoundError(err)
+
+    class StaleBackendApi:
+        """Handle for a CRD version the API Server no longer serves"""
+
+        def get(self, **kwargs):
+            raise not_found()
+
+        def patch(self, **kwargs):
+            raise not_found()
+
+    backend_api = _FakeBackendApi(annotations={"trident_mcc_svm_uuid": "1234"})
+    key = ("trident.netapp.io/v1", "TridentBackendConfig")
+    k8sclient = _fake_k8sclient({key: backend_api})
+    k8sclient._resource_apis[key] = StaleBackendApi()
+    resources = k8sclient.client.resources
+
+    assert (
+        k8sclient._get_trident_backend_by_name("backend-a").metadata.name == "backend-a"
+    )
+    assert (resources.invalidated, len(resources.resolved)) == (1, 1)
+
+    k8sclient._resource_apis[key] = StaleBackendApi()
+    assert k8sclient._patch_backend_with_svmname(backend_api.view(), "svm1-mc", "1234")
+    assert (resources.invalidated, len(resources.resolved)) == (2, 2)
+
+    # A missing object is a real 404, it mustn't refresh discovery
+    def missing(**kwargs):
+        raise not_found("backend-b")
+
+    backend_api.get = missing
+    try:
+        k8sclient._get_trident_backend_by_name("backend-b")
+    except NotFoundError:
+        pass
+    else:
+        raise AssertionError("Expected NotFoundError")
+    assert (resources.invalidated, len(resources.resolved)) == (2, 2)
+
+
+def test_benchmark_timings_are_compared_relative_to_the_reference():
+    import argparse
+    import importlib.util
+    from pathlib import Path
+
+    spec = importlib.util.spec_from_file_location(
+        "bench_reconcile",
+        Path(__file__).resolve().parent.parent / "benchmarks" / "bench_reconcile.py",
+    )
+    bench_reconcile = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(bench_reconcile)
+
+    args = argparse.Namespace(time_tolerance=0.25, rss_tolerance=0.25)
+    baseline = {
+        "100": {
+            "steady_cycle_seconds": 1.0,
+            "ontap_calls_per_backend": 0.04,
+            "reference_seconds": 0.2,
+        }
+    }
+
+    # Twice as slow on a machine half the speed isn't a regression, call counts aren't scaled
+    results = {
+        "100": {
+            "steady_cycle_seconds": 2.0,
+            "ontap_calls_per_backend": 0.08,
+            "reference_seconds": 0.4,
+        }
+    }
+    regressions = bench_reconcile.find_regressions(results, baseline, args)
+    assert len(regressions) == 1 and "ontap_calls_per_backend" in regressions[0]
+
+    results["100"]["reference_seconds"] = 0.2
+    regressions = bench_reconcile.find_regressions(results, baseline, args)
+    assert len(regressions) == 2 and "steady_cycle_seconds" in regressions[0]
+
+
+def test_repairs_outside_a_sweep_are_recorded_straight_away():
+    import asyncio
+
+    from trident_mcc import healthz, metrics
+    from trident_mcc.metrics import RepairTracker, cycle_stats
+    from trident_mcc.models import RepairReport
+
+    tracker = RepairTracker()
+    tracker.mismatch("backend-a", "svm1")
+    repair = tracker.repaired("backend-a", "10.9.9.8", "svm1-mc")
+    assert cycle_stats.take_repairs() == [repair]
+    assert cycle_stats.take_repairs() == []
+
+    healthz.repair_history.clear()
+    asyncio.run(healthz.record_repairs(RepairReport(repairs=[repair])))
+    assert list(healthz.repair_history) == [repair]
+    assert (
+        'trident_mcc_time_to_repair_seconds_count{management_lif="10.9.9.8"} 1'
+        in metrics.render()
+    )
+    healthz.repair_history.clear()
+    cycle_stats.reset()
@@ -1,4 +1,9 @@
 #! /bin/bash
 
+if [ -n "$UNIFIED_RUNTIME" ]; then
+    # Reconcile loop runs inside the healthcheck application
+    exec poetry run uvicorn trident_mcc.healthz:app --host 0.0.0.0 --log-config trident_mcc/logging.yaml
+fi
+
 poetry run uvicorn trident_mcc.healthz:app --host 0.0.0.0 --log-config trident_mcc/logging.yaml &
 poetry run python3 -m trident_mcc
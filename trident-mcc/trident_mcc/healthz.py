@@ -1,18 +1,26 @@
 from __future__ import annotations
-from email import message
+import asyncio
+import json
 import os
 import logging
-from typing import Optional
+import threading
+from collections import deque
+from typing import List, Optional
+from xml.etree import ElementTree
 
 from datetime import datetime, timedelta
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
 from enum import Enum, IntEnum
 
 
+from trident_mcc import metrics
 from trident_mcc.models import (
     AppHealth,
+    ReconcileRequest,
+    RepairEvent,
+    RepairReport,
     StateEnum,
     StatusUpdate,
     StateMessageEnum,
@@ -25,6 +33,16 @@ app = FastAPI()
 # Environment Variables -
 DEBUG = os.getenv("DEBUG", None)
 POLLING_INTERVAL = int(os.getenv("POLLING_INTERVAL", 300))
+UNIFIED_RUNTIME = os.getenv("UNIFIED_RUNTIME", None)
+# EMS events starting with one of these trigger a reconcile, everything else is ignored
+EMS_EVENT_PREFIXES = tuple(
+    prefix.strip()
+    for prefix in os.getenv("EMS_EVENT_PREFIXES", "mcc.,metrocluster.").split(",")
+    if prefix.strip()
+)
+
+# Number of failover repairs kept for /repairs
+REPAIR_HISTORY_SIZE = int(os.getenv("REPAIR_HISTORY_SIZE", 100))
 
 # Set Up Logging
 if DEBUG:
@@ -48,6 +66,16 @@ log_formatter = logging.Formatter(
 )
 ch.setFormatter(log_formatter)
 logger.addHandler(ch)
+# The reconcile loop's "trident_mcc" logger has its own handler in the unified runtime
+logger.propagate = False
+
+# Reconcile loop job monitor, trigger, profiler and wire log when running in the unified runtime
+reconciler_monitor = None
+request_reconcile = None
+cycle_profiler = None
+wire_log = None
+# Most recent failover repairs reported by the reconcile loop, oldest first
+repair_history = deque(maxlen=REPAIR_HISTORY_SIZE)
 
 
 @app.get("/healthz")
@@ -78,9 +106,7 @@ async def update_status(status_update: StatusUpdate):
     logger.debug(
         f"/update_status - Received Application Status Update - {status_update} "
     )
-    await app_state.update_status(status_update)
-
-    if app_state.state == status_update.state:
+    if await record_status(status_update):
         logger.info(f"/update_status - Successfully Updated status")
         return PlainTextResponse(content="OK", status_code=200)
     else:
@@ -88,6 +114,200 @@ async def update_status(status_update: StatusUpdate):
         return PlainTextResponse(content="FAILED", status_code=500)
 
 
+async def record_status(status_update: StatusUpdate) -> bool:
+    """Applies a status update to the application state and metrics
+
+    :param status_update: StatusUpdate from the reconcile loop
+    :type status_update: trident_mcc.models.StatusUpdate
+    :returns: True if the application state now matches the update
+    :rtype: bool
+    """
+    await app_state.update_status(status_update)
+    if status_update.cycle is not None and status_update.state == StateEnum.OK:
+        metrics.observe_cycle(status_update.cycle)
+        repair_history.extend(status_update.cycle.repairs)
+    return app_state.state == status_update.state
+
+
+@app.post("/update_repairs")
+async def update_repairs(repair_report: RepairReport):
+    """Records failover repairs finished outside a sweep, e.g. by a triggered reconcile
+
+    This is called via the /update_repairs endpoint with a POST operation.
+    """
+    logger.debug(f"/update_repairs - Received {len(repair_report.repairs)} repairs")
+    await record_repairs(repair_report)
+    return PlainTextResponse(content="OK", status_code=200)
+
+
+async def record_repairs(repair_report: RepairReport) -> None:
+    """Applies failover repairs to the metrics and the repair history
+
+    :param repair_report: RepairReport from the reconcile loop
+    :type repair_report: trident_mcc.models.RepairReport
+    """
+    metrics.observe_repairs(repair_report.repairs)
+    repair_history.extend(repair_report.repairs)
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus metrics for the reconcile sweeps"""
+    return PlainTextResponse(
+        content=metrics.render(), media_type="text/plain; version=0.0.4"
+    )
+
+
+@app.get("/repairs", response_model=List[RepairEvent])
+async def repairs(limit: Optional[int] = None):
+    """Most recent failover repairs first - how long each backend's SVM name was out of date
+
+    Only the last REPAIR_HISTORY_SIZE are kept, the trident_mcc_time_to_repair_seconds
+    histogram on /metrics covers every repair since startup.
+    """
+    return list(reversed(repair_history))[:limit]
+
+
+@app.post("/reconcile", status_code=202)
+async def reconcile(reconcile_request: Optional[ReconcileRequest] = None):
+    """Wakes the reconcile loop for a backend, the backends on a management LIF, or all backends
+
+    Only available in the unified runtime, the split runtime's reconcile loop is in another process.
+    """
+    if request_reconcile is None:
+        return PlainTextResponse(
+            content="Triggered reconciles need UNIFIED_RUNTIME", status_code=501
+        )
+    reconcile_request = reconcile_request or ReconcileRequest()
+    logger.info(f"/reconcile - Reconcile requested - {reconcile_request}")
+    request_reconcile(
+        backend_name=reconcile_request.backend_name,
+        management_lif=reconcile_request.management_lif,
+    )
+    return PlainTextResponse(content="Reconcile requested", status_code=202)
+
+
+@app.post("/debug/profile", status_code=202)
+async def start_profile(cycles: int = 1):
+    """Profiles the next cycles reconcile cycles, the result is then served on GET /debug/profile
+
+    Only available in the unified runtime, in the split runtime set PROFILE_CYCLES instead
+    and the per phase breakdown is logged.
+    """
+    if cycle_profiler is None:
+        return PlainTextResponse(
+            content="Profiling on demand needs UNIFIED_RUNTIME", status_code=501
+        )
+    try:
+        cycle_profiler.request(cycles)
+    except ValueError as err:
+        return PlainTextResponse(content=str(err), status_code=400)
+    return PlainTextResponse(
+        content=f"Profiling the next {cycles} cycle(s)", status_code=202
+    )
+
+
+@app.get("/debug/profile")
+async def get_profile(format: str = "collapsed"):
+    """The last completed profile, as collapsed stacks or the seconds spent in each phase
+
+    format=collapsed (the default) returns one line per stack, the phase first, ready for
+    flamegraph.pl or speedscope. format=phases returns JSON of the sampled seconds per phase.
+    """
+    if cycle_profiler is None:
+        return PlainTextResponse(
+            content="Profiling on demand needs UNIFIED_RUNTIME", status_code=501
+        )
+    result = cycle_profiler.result()
+    if result is None:
+        return PlainTextResponse(
+            content=(
+                "Profile in progress"
+                if cycle_profiler.in_progress
+                else "No profile - POST /debug/profile to start one"
+            ),
+            status_code=404,
+        )
+    if format == "phases":
+        return {
+            "cycles": result["cycles"],
+            "interval": result["interval"],
+            "started_at": result["started_at"],
+            "finished_at": result["finished_at"],
+            "phases": cycle_profiler.phases(),
+        }
+    if format != "collapsed":
+        return PlainTextResponse(
+            content=f"Unknown format '{format}' - use collapsed or phases",
+            status_code=400,
+        )
+    return PlainTextResponse(content=cycle_profiler.collapsed())
+
+
+@app.get("/debug/ontap_wire")
+async def ontap_wire(management_lif: Optional[str] = None):
+    """The ONTAP exchanges kept in the wire log, oldest first, optionally for one management LIF
+
+    Needs ONTAP_WIRE_LOG_SAMPLE_RATE set. Only available in the unified runtime, in the split
+    runtime send the reconcile loop SIGUSR1 to log them instead.
+    """
+    if wire_log is None:
+        return PlainTextResponse(
+            content="The ONTAP wire log needs UNIFIED_RUNTIME and ONTAP_WIRE_LOG_SAMPLE_RATE",
+            status_code=501,
+        )
+    return wire_log.dump(management_lif)
+
+
+def _ems_event_names(body: bytes) -> List[str]:
+    """Returns the EMS message names in an ONTAP EMS notification, either XML or JSON"""
+    if body.lstrip().startswith(b"<"):
+        root = ElementTree.fromstring(body)
+        return [element.text for element in root.iter("message-name") if element.text]
+
+    events = json.loads(body)
+    if not isinstance(events, list):
+        events = [events]
+    names = []
+    for event in events:
+        message = event.get("message")
+        name = message.get("name") if isinstance(message, dict) else event.get("name")
+        if name:
+            names.append(name)
+    return names
+
+
+@app.post("/ems", status_code=202)
+async def ems_webhook(request: Request, management_lif: Optional[str] = None):
+    """Receives ONTAP EMS events from a rest-api notification destination
+
+    MetroCluster events reconcile the backends on management_lif, which should be set in the
+    destination URL e.g. /ems?management_lif=10.0.0.1, or every backend if it isn't.
+    """
+    if request_reconcile is None:
+        return PlainTextResponse(
+            content="Triggered reconciles need UNIFIED_RUNTIME", status_code=501
+        )
+    try:
+        event_names = _ems_event_names(await request.body())
+    except (ValueError, AttributeError, ElementTree.ParseError) as err:
+        logger.warning(f"/ems - Unable to parse EMS notification - {err}")
+        return PlainTextResponse(content="Invalid EMS notification", status_code=400)
+
+    matched_names = [
+        name for name in event_names if name.startswith(EMS_EVENT_PREFIXES)
+    ]
+    if not matched_names:
+        logger.debug(f"/ems - Ignoring EMS events {event_names}")
+        return PlainTextResponse(content="Ignored", status_code=202)
+
+    logger.info(
+        f"/ems - Received EMS events {matched_names} - requesting reconcile of {management_lif or 'all backends'}"
+    )
+    request_reconcile(management_lif=management_lif)
+    return PlainTextResponse(content="Reconcile requested", status_code=202)
+
+
 @app.on_event("startup")
 async def startup():
     """Startup Tasks"""
@@ -97,3 +317,76 @@ async def startup():
     app_state = AppHealth(
         state=StateEnum.STARTING, message="Application Starting - No Updates Recieved"
     )
+    if UNIFIED_RUNTIME:
+        start_reconciler(asyncio.get_running_loop())
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Shutdown Tasks"""
+    if reconciler_monitor is not None:
+        logger.info("Stopping reconcile loop")
+        reconciler_monitor.stop()
+
+
+def start_reconciler(loop: asyncio.AbstractEventLoop):
+    """Runs the reconcile loop in a background thread of this process
+
+    Status updates and repairs are applied on the event loop rather than POSTed to
+    /update_status and /update_repairs, so there is no second interpreter and no localhost
+    HTTP hop.
+
+    :param loop: The event loop serving the app
+    :type loop: asyncio.AbstractEventLoop
+    """
+    global reconciler_monitor, request_reconcile, cycle_profiler, wire_log
+    # Imported here so the healthcheck only process never loads the K8s and ONTAP clients
+    from trident_mcc import reconciler
+
+    def status_sink(status_update: StatusUpdate):
+        future = asyncio.run_coroutine_threadsafe(record_status(status_update), loop)
+        if not future.result():
+            logger.warning(f"Unable to set status")
+
+    def repair_sink(repair_report: RepairReport):
+        asyncio.run_coroutine_threadsafe(record_repairs(repair_report), loop).result()
+
+    reconciler.set_status_sink(status_sink, repair_sink)
+    request_reconcile = reconciler.request_reconcile
+    cycle_profiler = reconciler.cycle_profiler
+    wire_log = reconciler.wire_log
+    reconciler_monitor = reconciler.SignalCatcher(install_handlers=False)
+    logger.info("Starting reconcile loop in the healthcheck application")
+    threading.Thread(
+        target=_run_reconciler,
+        args=(reconciler.run, reconciler_monitor, loop),
+        name="trident_mcc-reconciler",
+        daemon=True,
+    ).start()
+
+
+def _run_reconciler(run, job_monitor, loop: asyncio.AbstractEventLoop):
+    """Runs the reconcile loop, marking the app in error if it stops without being asked to
+
+    Nothing else would update app_state once the loop's thread has gone, so /healthz would
+    keep reporting its last status. In error the liveness probe fails and the pod is restarted.
+
+    :param run: The reconcile loop, trident_mcc.reconciler.run
+    :param job_monitor: Tracks the running job and termination requests
+    :type job_monitor: trident_mcc.reconciler.SignalCatcher
+    :param loop: The event loop serving the app
+    :type loop: asyncio.AbstractEventLoop
+    """
+    try:
+        run(job_monitor)
+    except Exception as err:
+        logger.exception(f"Reconcile loop failed - {err}")
+        message = f"Reconcile loop failed - {err}"
+    else:
+        if job_monitor.terminate:
+            return
+        message = "Reconcile loop stopped unexpectedly"
+        logger.error(message)
+    asyncio.run_coroutine_threadsafe(
+        record_status(StatusUpdate(state=StateEnum.ERROR, message=message)), loop
+    ).result()
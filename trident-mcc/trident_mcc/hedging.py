@@ -0,0 +1,125 @@
+import logging
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import List, Optional
+
+
+logger = logging.getLogger("trident_mcc.hedging")
+
+
+def choose_svm(answers: list, errors: list):
+    """Picks the SVM to use once every hedged lookup has finished without a running SVM
+
+    The answers and errors are in management LIF order, primary first. The first SVM found
+    is used, if none was found the first error is raised, but only if every lookup failed.
+    """
+    for svm_details in answers:
+        if svm_details:
+            return svm_details
+    if all(err is not None for err in errors):
+        raise errors[0]
+    return None
+
+
+def lookup_svm(netapp_client, existing_svm_name: str, existing_svm_uuid: str):
+    if existing_svm_uuid is not None:
+        # get by UUID
+        return netapp_client.get_svm_by_uuid(existing_svm_uuid)
+    if existing_svm_name is not None:
+        # get by SVM Name
+        return netapp_client.get_svm_by_name(existing_svm_name)
+    # Assume it is an SVM scoped management Lif and we will only be able to retrieve a single svm
+    return netapp_client.get_svm()
+
+
+class HedgedLookups:
+    def __init__(self, concurrency: int = 1) -> None:
+        """Looks SVMs up through a backend's management LIF and its alternates side by side
+
+        The lookups run on a thread pool sized for concurrency backends each looking up
+        through all of their management LIFs at once. Once a running SVM is found, lookups
+        still queued are cancelled, but one already waiting on a slow or unreachable LIF
+        can't be interrupted and keeps its thread until ONTAP answers or the request times
+        out. Those abandoned lookups are counted, and the pool is replaced with a bigger one
+        when they would otherwise leave later backends' lookups queued behind them.
+
+        :param concurrency: Number of backends looked up at once (default is 1)
+        :type concurrency: int
+        """
+        self._concurrency = max(concurrency, 1)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._size = 0
+        # Lookups still running for backends that have already been answered
+        self._abandoned = 0
+
+    def _executor_for(self, lookups: int) -> ThreadPoolExecutor:
+        with self._lock:
+            size = self._concurrency * lookups + self._abandoned
+            if size > self._size:
+                if self._executor is not None:
+                    # Its threads exit once the lookups they are running finish
+                    self._executor.shutdown(wait=False)
+                logger.debug(f"Running hedged SVM lookups on {size} threads")
+                self._executor = ThreadPoolExecutor(
+                    max_workers=size, thread_name_prefix="hedge"
+                )
+                self._size = size
+            return self._executor
+
+    def _abandoned_finished(self, future) -> None:
+        with self._lock:
+            self._abandoned -= 1
+
+    def lookup_svm(
+        self, netapp_clients: list, existing_svm_name: str, existing_svm_uuid: str
+    ) -> Optional[dict]:
+        """Looks the SVM up through every client at once, the first running SVM found wins
+
+        A site that is down or slow then doesn't hold the backend up. If no client finds a
+        running SVM, see choose_svm.
+
+        :param netapp_clients: Clients for the backend's management LIF followed by its alternates
+        :type netapp_clients: List[trident_mcc.netapp_client.NetAppClient]
+        :param existing_svm_name: SVM name in the backend, None if it doesn't have one
+        :type existing_svm_name: str
+        :param existing_svm_uuid: SVM UUID recorded on the backend, None if it isn't managed yet
+        :type existing_svm_uuid: str
+        :returns: SVM details dict, or None if no SVM was found
+        :rtype: dict
+        """
+        executor = self._executor_for(len(netapp_clients))
+        futures = {
+            executor.submit(
+                lookup_svm, netapp_client, existing_svm_name, existing_svm_uuid
+            ): index
+            for index, netapp_client in enumerate(netapp_clients)
+        }
+        answers = [None] * len(netapp_clients)
+        errors = [None] * len(netapp_clients)
+        pending = set(futures)
+        try:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = futures[future]
+                    try:
+                        answers[index] = future.result()
+                    except Exception as err:
+                        logger.debug(f"Hedged SVM lookup {index} failed - {err}")
+                        errors[index] = err
+                        continue
+                    if answers[index] and answers[index].get("state") == "running":
+                        return answers[index]
+        finally:
+            self._abandon(pending)
+        return choose_svm(answers, errors)
+
+    def _abandon(self, futures: List) -> None:
+        for future in futures:
+            if future.cancel():
+                continue
+            with self._lock:
+                self._abandoned += 1
+            # Called straight away if it has finished in the meantime
+            future.add_done_callback(self._abandoned_finished)
@@ -1 +1,3 @@
-from .main import K8sclient
\ No newline at end of file
+from .main import K8sclient
+from .backend_view import BackendView
+from .rate_limiter import RateLimiter, RequestPriority
@@ -0,0 +1,95 @@
+import sys
+from typing import Dict
+
+# Only annotations with this prefix are kept, they are the only ones we read or write
+ANNOTATION_PREFIX = "trident_mcc_"
+
+
+def _intern(value):
+    # Thousands of backends share a handful of drivers, management LIFs and secrets
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class BackendView:
+    __slots__ = (
+        "name",
+        "resource_version",
+        "generation",
+        "storage_driver",
+        "management_lif",
+        "svm",
+        "credentials_name",
+        "annotations",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        resource_version: str = None,
+        generation: int = None,
+        storage_driver: str = "",
+        management_lif: str = None,
+        svm: str = None,
+        credentials_name: str = None,
+        annotations: Dict[str, str] = None,
+    ) -> None:
+        """The fields of a TridentBackendConfig the reconciler uses, and nothing else
+
+        Backends are projected into these straight from the API Server's JSON, so the full
+        object, with its managedFields, status and the ResourceField wrappers around every
+        nested dict, is never kept. Reading a field is a plain attribute lookup.
+
+        :param name: Name of the TridentBackendConfig
+        :type name: str
+        :param resource_version: metadata.resourceVersion (default is None)
+        :type resource_version: str
+        :param generation: metadata.generation, bumped by changes to the spec (default is None)
+        :type generation: int
+        :param storage_driver: spec.storageDriverName (default is "")
+        :type storage_driver: str
+        :param management_lif: spec.managementLIF (default is None)
+        :type management_lif: str
+        :param svm: spec.svm, None if it isn't set (default is None)
+        :type svm: str
+        :param credentials_name: Name of the Secret in spec.credentials (default is None)
+        :type credentials_name: str
+        :param annotations: The trident_mcc_* annotations (default is None)
+        :type annotations: Dict[str, str]
+        """
+        self.name = name
+        self.resource_version = resource_version
+        self.generation = generation
+        self.storage_driver = _intern(storage_driver)
+        self.management_lif = _intern(management_lif)
+        self.svm = svm
+        self.credentials_name = _intern(credentials_name)
+        self.annotations = annotations or {}
+
+    @classmethod
+    def from_dict(cls, backend: dict) -> "BackendView":
+        """Projects a TridentBackendConfig as decoded from the API Server's JSON
+
+        :param backend: The TridentBackendConfig object
+        :type backend: dict
+        :returns: The backend's view
+        :rtype: BackendView
+        """
+        metadata = backend.get("metadata") or {}
+        spec = backend.get("spec") or {}
+        return cls(
+            name=metadata.get("name"),
+            resource_version=metadata.get("resourceVersion"),
+            generation=metadata.get("generation"),
+            storage_driver=spec.get("storageDriverName") or "",
+            management_lif=spec.get("managementLIF"),
+            svm=spec.get("svm"),
+            credentials_name=(spec.get("credentials") or {}).get("name"),
+            annotations={
+                key: value
+                for key, value in (metadata.get("annotations") or {}).items()
+                if key.startswith(ANNOTATION_PREFIX)
+            },
+        )
+
+    def __repr__(self) -> str:
+        return f"BackendView(name={self.name!r}, resource_version={self.resource_version!r}, management_lif={self.management_lif!r}, svm={self.svm!r})"
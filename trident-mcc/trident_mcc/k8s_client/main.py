@@ -1,28 +1,76 @@
 from __future__ import annotations
+from datetime import datetime, timezone
 import logging
 from pathlib import Path
-from typing import List
+from typing import Callable, Iterator, List, Tuple
+import threading
 import time
 
 import base64
+import json
 
-from kubernetes import config as k8sconfig, dynamic
+from kubernetes import config as k8sconfig, dynamic, watch
 from kubernetes.config import ConfigException
 from kubernetes.client import api_client
 from kubernetes.dynamic.exceptions import (
+    ConflictError,
     NotFoundError,
     ResourceNotFoundError,
+    TooManyRequestsError,
     ApiException,
 )
-from kubernetes.dynamic.resource import ResourceField, ResourceInstance
+from kubernetes.dynamic.resource import Resource, ResourceField, ResourceInstance
+
+from .backend_view import BackendView
+from .rate_limiter import RateLimiter, RequestPriority
 
 
 logger = logging.getLogger("trident_mcc.k8s_client")
 
+# Longest we wait on a 429's Retry-After, and the wait if it doesn't have one
+MAX_RETRY_AFTER = 60
+DEFAULT_RETRY_AFTER = 1
+# Times a backend patch is retried after it was rejected because the backend changed
+PATCH_CONFLICT_RETRIES = 3
+
+
+def _stale_resource(err: ApiException) -> bool:
+    """Returns True if a 404 is for the resource itself rather than a missing object
+
+    When it is the object that is missing the API Server names it in the Status details.
+    """
+    try:
+        details = json.loads(err.body).get("details") or {}
+    except (TypeError, ValueError, AttributeError):
+        # Not a Status, e.g. '404 page not found' for a path the API Server doesn't serve
+        return True
+    return not details.get("name")
+
+
+def _retry_after(err: ApiException) -> float:
+    """Returns the seconds to wait from a 429 response's Retry-After header"""
+    try:
+        retry_after = float((err.headers or {}).get("Retry-After"))
+    except (TypeError, ValueError):
+        # Missing, or an HTTP date which the API Server doesn't send
+        return DEFAULT_RETRY_AFTER
+    return min(max(retry_after, 0), MAX_RETRY_AFTER)
+
 
 class K8sclient:
     def __init__(
-        self, kube_config: str = None, trident_namespace: str = "trident"
+        self,
+        kube_config: str = None,
+        trident_namespace: str = "trident",
+        label_selector: str = None,
+        field_selector: str = None,
+        list_page_size: int = None,
+        discovery_cache_file: str = None,
+        secret_cache_ttl: int = 0,
+        on_secret_rotated: Callable[[str, dict], None] = None,
+        api_qps: float = 0,
+        api_burst: int = None,
+        throttle_retries: int = 3,
     ) -> None:
         """Custom K8sclient class to allow for simplifing trident access
 
@@ -35,12 +83,67 @@ class K8sclient:
         :param trident_namespace: The kubernetes namespace for trident objects.
             (default is 'trident')
         :type trident_namespace: str
+        :param label_selector: Label selector used to restrict which TridentBackendConfigs are listed and watched.
+            (default is None)
+        :type label_selector: str
+        :param field_selector: Field selector used to restrict which TridentBackendConfigs are listed and watched.
+            (default is None)
+        :type field_selector: str
+        :param list_page_size: Maximum number of TridentBackendConfigs returned per LIST request, None lists them all in one request.
+            (default is None)
+        :type list_page_size: int
+        :param discovery_cache_file: File the dynamic client persists API discovery results to, so they survive a
+            process restart. If not specified the dynamic client default in the temp directory is used.
+            (default is None)
+        :type discovery_cache_file: str
+        :param secret_cache_ttl: Seconds decoded backend credentials are used without checking the Secret again. Once
+            expired the Secret is re-read but only decoded again if its resourceVersion changed.
+            (default is 0)
+        :type secret_cache_ttl: int
+        :param on_secret_rotated: Called with the secret name and the previously decoded credentials when a
+            cached Secret's resourceVersion changes.
+            (default is None)
+        :type on_secret_rotated: Callable[[str, dict], None]
+        :param api_qps: Requests per second made to the API Server, 0 for no limit. Requests waiting for
+            the limit are served failover patches first and verification reads last.
+            (default is 0)
+        :type api_qps: float
+        :param api_burst: Requests allowed in a burst above api_qps, None for twice api_qps.
+            (default is None)
+        :type api_burst: int
+        :param throttle_retries: Times a request answered 429 Too Many Requests is retried after its
+            Retry-After.
+            (default is 3)
+        :type throttle_retries: int
         :returns: None
         :rtype: None
         :raises TypeError: On invalid parameter types.
         :raises ValueError: On invalid parameter values (file doesn't exist, namespace doesn't exist)
 
         """
+        if list_page_size is not None and list_page_size < 1:
+            raise ValueError(
+                f"The specified 'list_page_size' ({list_page_size}) must be at least 1"
+            )
+        self._label_selector = label_selector
+        self._field_selector = field_selector
+        self._list_page_size = list_page_size
+        # Resolved API resource handles keyed by (api_version, kind)
+        self._resource_apis = {}
+        # Decoded backend credentials keyed by secret name - (resourceVersion, decoded, validated at)
+        self._secret_cache_ttl = secret_cache_ttl
+        self._on_secret_rotated = on_secret_rotated
+        self._secret_cache = {}
+        self._secret_cache_lock = threading.Lock()
+        if api_qps > 0:
+            self._rate_limiter = RateLimiter(
+                qps=api_qps,
+                burst=api_burst if api_burst is not None else int(api_qps * 2),
+            )
+        else:
+            self._rate_limiter = None
+        self._throttle_retries = throttle_retries
+
         if not kube_config:
             logger.info("Using in cluster kubernetes configuration")
             try:
@@ -77,7 +180,8 @@ class K8sclient:
         # Create Dynamic k8s client
         try:
             self.client = dynamic.DynamicClient(
-                api_client.ApiClient(configuration=self._kube_config)
+                api_client.ApiClient(configuration=self._kube_config),
+                cache_file=discovery_cache_file,
             )
         except Exception as err:
             logger.error(f"Unable to create client - please check configuration")
@@ -96,6 +200,127 @@ class K8sclient:
                 f"The specified 'trident_namespace' is of type {type(trident_namespace)} not str"
             )
 
+    def _get_resource_api(self, api_version: str, kind: str) -> Resource:
+        """Returns the dynamic client Resource for the api_version and kind
+
+        Resources are only resolved through API discovery the first time they are used,
+        after that the cached handle is returned until it is invalidated.
+
+        :param api_version: API Version of the resource e.g. 'v1' or 'trident.netapp.io/v1'
+        :type api_version: str
+        :param kind: Kind of the resource e.g. 'Secret'
+        :type kind: str
+        :returns: Resource handle that can be used to query the API
+        :rtype: kubernetes.dynamic.resource.Resource
+        :raises ResourceNotFoundError: If the resource isn't served by the API Server
+        """
+        resource_api = self._resource_apis.get((api_version, kind))
+        if resource_api is None:
+            logger.debug(f"Resolving API resource '{kind}' in '{api_version}'")
+            resource_api = self.client.resources.get(api_version=api_version, kind=kind)
+            self._resource_apis[(api_version, kind)] = resource_api
+        return resource_api
+
+    def _invalidate_resource_api(self, api_version: str, kind: str) -> None:
+        """Drops the cached Resource and refreshes the dynamic client discovery cache
+
+        Used when the API Server reports the resource path as not found, for example
+        after the Trident CRDs have been upgraded to a different version.
+
+        :param api_version: API Version of the resource e.g. 'v1' or 'trident.netapp.io/v1'
+        :type api_version: str
+        :param kind: Kind of the resource e.g. 'Secret'
+        :type kind: str
+        """
+        logger.info(f"Refreshing API discovery for '{kind}' in '{api_version}'")
+        self._resource_apis.pop((api_version, kind), None)
+        self.client.resources.invalidate_cache()
+
+    def _check_trident_installed(self) -> None:
+        """Resolves the TridentBackendConfig resource, logging why if it isn't served"""
+        try:
+            self._get_resource_api(
+                api_version="trident.netapp.io/v1", kind="TridentBackendConfig"
+            )
+        except ResourceNotFoundError as err:
+            logger.error(
+                "Unable to find trident CustomResource - Please ensure Trident is installed in Operator Mode"
+            )
+            raise err
+
+    def _resource_request(
+        self,
+        priority: RequestPriority,
+        api_version: str,
+        kind: str,
+        verb: str,
+        **kwargs,
+    ) -> ResourceInstance:
+        """Makes a request on a resource within the rate limit, resolving it again after a 404
+
+        A 404 that isn't about a missing object means the cached resource handle is stale,
+        for example after the Trident CRDs have been upgraded to a different version. The
+        resource is then resolved again through API discovery and the request retried once.
+
+        :param priority: Where the request queues if it has to wait for the rate limit
+        :type priority: trident_mcc.k8s_client.rate_limiter.RequestPriority
+        :param api_version: API Version of the resource e.g. 'v1' or 'trident.netapp.io/v1'
+        :type api_version: str
+        :param kind: Kind of the resource e.g. 'Secret'
+        :type kind: str
+        :param verb: Resource method to call e.g. get or patch
+        :type verb: str
+        :returns: The response of the request
+        :raises NotFoundError: If the object doesn't exist, or the resource still isn't found
+        """
+        try:
+            return self._request(
+                priority,
+                getattr(self._get_resource_api(api_version, kind), verb),
+                **kwargs,
+            )
+        except NotFoundError as err:
+            if not _stale_resource(err):
+                raise err
+            self._invalidate_resource_api(api_version=api_version, kind=kind)
+        return self._request(
+            priority, getattr(self._get_resource_api(api_version, kind), verb), **kwargs
+        )
+
+    def _request(
+        self, priority: RequestPriority, request: Callable, **kwargs
+    ) -> ResourceInstance:
+        """Makes a request to the API Server within the rate limit
+
+        A 429 Too Many Requests response holds back every request until its Retry-After has
+        passed, then the request is retried up to throttle_retries times.
+
+        :param priority: Where the request queues if it has to wait for the rate limit
+        :type priority: trident_mcc.k8s_client.rate_limiter.RequestPriority
+        :param request: Resource method to call e.g. get or patch
+        :type request: Callable
+        :returns: The response of the request
+        :raises TooManyRequestsError: If the request is still throttled after throttle_retries
+        """
+        attempt = 0
+        while True:
+            if self._rate_limiter is not None:
+                self._rate_limiter.acquire(priority)
+            try:
+                return request(**kwargs)
+            except TooManyRequestsError as err:
+                if attempt >= self._throttle_retries:
+                    raise err
+                attempt += 1
+                retry_after = _retry_after(err)
+                logger.warning(
+                    f"API Server throttled a {priority.name} request - retrying in {retry_after:.1f}s ({attempt}/{self._throttle_retries})"
+                )
+                if self._rate_limiter is not None:
+                    self._rate_limiter.backoff(retry_after)
+                else:
+                    time.sleep(retry_after)
+
     def _namespace_exists(self, namespace: str) -> bool:
         """Queries Kubernetes Cluster to make sure specified Namespace exists
 
@@ -107,16 +332,16 @@ class K8sclient:
         logger.debug(f"Querying API for namespace '{namespace}'.")
         # Create Namespace Query
         try:
-            namespace_api = self.client.resources.get(
-                api_version="v1", kind="Namespace"
-            )
+            self._get_resource_api(api_version="v1", kind="Namespace")
         except Exception as err:
             logger.error("Unable to access k8s api to get namespaces")
             raise err
 
         # Check Namespace
         try:
-            result = namespace_api.get(name=namespace)
+            result = self._resource_request(
+                RequestPriority.DEFAULT, "v1", "Namespace", "get", name=namespace
+            )
             if result:
                 logger.info(f"Sucessfully found namespace '{namespace}'")
                 return True
@@ -129,46 +354,25 @@ class K8sclient:
             logger.warning(f"Namespace '{namespace}' was not found")
             return False
 
-    def get_trident_backends(self) -> List[ResourceInstance] | None:
+    def get_trident_backends(self) -> List[BackendView] | None:
         """Queries K8s API and returns a list of all Trident Backend Configurations
 
         Retrieves TridentBackendConfiguration Objects from K8s API in the Trident Namespace
 
         :returns: List of TridentBackendConfiguration Objects or None if there aren't any
-        :rtype: List[kubernetes.dynamic.resource.ResourceInstance] | None
+        :rtype: List[trident_mcc.k8s_client.BackendView] | None
 
         """
         start_time = time.time()
-        # Get my trident backend api
-        logger.debug("Setting up to query trident backends from API Server")
-        try:
-            trident_backend_api = self.client.resources.get(
-                api_version="trident.netapp.io/v1", kind="TridentBackendConfig"
-            )
-        except ResourceNotFoundError as err:
-            logger.error(
-                "Unable to find trident CustomResource - Please ensure Trident is installed in Operator Mode"
-            )
-            raise err
-
         # Query API and Get Backends.
         logger.debug("Attempting to get all the TridentBackendConfigurations")
-        try:
-            backend_response = trident_backend_api.get(
-                namespace=self._trident_namespace
-            )
-        except Exception as err:
-            raise err
-
-        result = []
+        result, _ = self.list_trident_backends()
 
         # Return the List if there is at least one backend, otherwise return None
-        if len(backend_response.items) > 0:
+        if len(result) > 0:
             logger.info(
-                f"Successfully found {len(backend_response.items)} TridentBackendConfig objects in the '{self._trident_namespace}' namespace"
+                f"Successfully found {len(result)} TridentBackendConfig objects in the '{self._trident_namespace}' namespace"
             )
-            for backend in backend_response.items:
-                result.append(self._get_trident_backend_by_name(backend.metadata.name))
         else:
             logger.warning(
                 f"No TridentBackendConfigurations found in '{self._trident_namespace}' namespace."
@@ -180,32 +384,143 @@ class K8sclient:
         )
         return result if len(result) > 0 else None
 
-    def _get_trident_backend_by_name(self, backend_name: str) -> ResourceInstance:
+    def list_trident_backends(self) -> Tuple[List[BackendView], str]:
+        """Lists all Trident Backend Configurations and the list resourceVersion
+
+        Returns the objects contained in the LIST response directly, along with the
+        collection resourceVersion so a watch can be started from this point. If a
+        list_page_size was configured the backends are retrieved in pages of that size
+        using limit/continue, and each page is projected straight into BackendViews
+        so the raw response is only held one page at a time.
+
+        :returns: Tuple of the TridentBackendConfig objects and the list resourceVersion
+        :rtype: Tuple[List[trident_mcc.k8s_client.BackendView], str]
+
+        """
+        start_time = time.time()
+        logger.debug("Setting up to list trident backends from API Server")
+        self._check_trident_installed()
+
+        result = []
+        continue_token = None
+        page_count = 0
+        while True:
+            raw_response = self._resource_request(
+                RequestPriority.DEFAULT,
+                "trident.netapp.io/v1",
+                "TridentBackendConfig",
+                "get",
+                namespace=self._trident_namespace,
+                label_selector=self._label_selector,
+                field_selector=self._field_selector,
+                limit=self._list_page_size,
+                _continue=continue_token,
+                serialize=False,
+            )
+            backend_response = json.loads(raw_response.data)
+            page_count += 1
+            result.extend(
+                BackendView.from_dict(backend)
+                for backend in backend_response.get("items", [])
+            )
+            # Every page is served from the same snapshot, so share its resourceVersion
+            resource_version = backend_response["metadata"].get("resourceVersion")
+            continue_token = backend_response["metadata"].get("continue")
+            if not continue_token:
+                break
+
+        end_time = time.time()
+        logger.debug(
+            f"list_trident_backends found {len(result)} objects in {page_count} page(s) at resourceVersion '{resource_version}' in {end_time - start_time:.2f}s"
+        )
+        return result, resource_version
+
+    def watch_trident_backends(
+        self, resource_version: str, timeout_seconds: int = None
+    ) -> Iterator[Tuple[str, BackendView]]:
+        """Streams watch events for TridentBackendConfig objects in the Trident Namespace
+
+        Watch bookmarks are requested so the resourceVersion keeps advancing even when
+        no backend changes, which keeps the watch resumable after the stream times out.
+
+        :param resource_version: resourceVersion to start watching from, normally from list_trident_backends
+        :type resource_version: str
+        :param timeout_seconds: Server side timeout for the watch stream (default is None)
+        :type timeout_seconds: int
+        :returns: Iterator of (event_type, object) - event_type is one of ADDED, MODIFIED, DELETED or BOOKMARK
+        :rtype: Iterator[Tuple[str, trident_mcc.k8s_client.BackendView]]
+        :raises ApiException: With status 410 when the resource_version is too old and a relist is required
+
+        """
+        self._check_trident_installed()
+
+        logger.debug(
+            f"Watching TridentBackendConfigs from resourceVersion '{resource_version}' - timeout {timeout_seconds}s"
+        )
+        # As in _resource_request, a 404 opening the stream means the resource handle is stale
+        resource_refreshed = False
+        while True:
+            # Only starting the stream counts against the rate limit, not the events on it
+            if self._rate_limiter is not None:
+                self._rate_limiter.acquire(RequestPriority.DEFAULT)
+            trident_backend_api = self._get_resource_api(
+                api_version="trident.netapp.io/v1", kind="TridentBackendConfig"
+            )
+            # The dynamic client doesn't have a parameter for bookmarks so pass it as a raw query parameter
+            events = watch.Watch().stream(
+                trident_backend_api.get,
+                namespace=self._trident_namespace,
+                label_selector=self._label_selector,
+                field_selector=self._field_selector,
+                resource_version=resource_version,
+                timeout_seconds=timeout_seconds,
+                query_params=[("allowWatchBookmarks", "true")],
+                serialize=False,
+            )
+            try:
+                event = next(events, None)
+            except NotFoundError as err:
+                if resource_refreshed or not _stale_resource(err):
+                    raise err
+                self._invalidate_resource_api(
+                    api_version="trident.netapp.io/v1", kind="TridentBackendConfig"
+                )
+                resource_refreshed = True
+                continue
+            break
+        while event is not None:
+            yield event["type"], BackendView.from_dict(event["object"])
+            event = next(events, None)
+
+    def _get_trident_backend_by_name(
+        self, backend_name: str, priority: RequestPriority = RequestPriority.VERIFY
+    ) -> ResourceInstance:
         """Queries K8s API and returns the backend as an object for specified Trident Backend Configurations
 
         Retrieve specified TridentBackendConfiguration Object from K8s API in the Trident Namespace
 
+        :param backend_name: Name of the TridentBackendConfig
+        :type backend_name: str
+        :param priority: Where the request queues if it has to wait for the rate limit
+            (default is RequestPriority.VERIFY)
+        :type priority: trident_mcc.k8s_client.rate_limiter.RequestPriority
         :returns: List of TridentBackendConfiguration Objects or None if there aren't any
         :rtype: List[kubernetes.dynamic.resource.ResourceInstance] | None
 
         """
         logger.debug("Setting up to query trident backend from API Server")
-        # Get my trident backend api
-        try:
-            trident_backend_api = self.client.resources.get(
-                api_version="trident.netapp.io/v1", kind="TridentBackendConfig"
-            )
-        except ResourceNotFoundError as err:
-            logger.error(
-                "Unable to find trident CustomResource - Please ensure Trident is installed in Operator Mode"
-            )
-            raise err
+        self._check_trident_installed()
 
         # Query API and Get Backend.
         logger.debug(f"Attempting to get TridentBackendConfig named '{backend_name}'")
         try:
-            backend_response = trident_backend_api.get(
-                name=backend_name, namespace=self._trident_namespace
+            backend_response = self._resource_request(
+                priority,
+                "trident.netapp.io/v1",
+                "TridentBackendConfig",
+                "get",
+                name=backend_name,
+                namespace=self._trident_namespace,
             )
         except Exception as err:
             raise err
@@ -213,7 +528,7 @@ class K8sclient:
         return backend_response
 
     def _get_backend_secret(
-        self, trident_backend_config: ResourceInstance
+        self, trident_backend_config: BackendView
     ) -> ResourceInstance:
         """Queries K8s API and returns the secrets for the specified backend
 
@@ -222,9 +537,8 @@ class K8sclient:
         :rtype: kubernetes.dynamic.resource.ResourceInstance
         """
         logger.debug("Setting up to query secrets from API Server")
-        # Get my secret api
         try:
-            secrets_api = self.client.resources.get(api_version="v1", kind="Secret")
+            self._get_resource_api(api_version="v1", kind="Secret")
         except ResourceNotFoundError as err:
             logger.error(
                 "Unable to access Secrets Backend - Please verify secret configuration"
@@ -232,10 +546,14 @@ class K8sclient:
             raise err
 
         # Query API and Get Secret.
-        secret_name = trident_backend_config.spec.credentials.name
+        secret_name = trident_backend_config.credentials_name
         logger.debug("Trying to retrieve secret '{secret_name}' from Kubernetes API")
         try:
-            backend_response = secrets_api.get(
+            backend_response = self._resource_request(
+                RequestPriority.VERIFY,
+                "v1",
+                "Secret",
+                "get",
                 name=secret_name,
                 namespace=self._trident_namespace,
             )
@@ -267,95 +585,346 @@ class K8sclient:
 
         return result
 
+    @staticmethod
+    def _svm_patch(trident_backend: BackendView, svm_name: str, svm_uuid: str) -> dict:
+        """Returns the merge patch setting the backend's SVM name and our annotations
+
+        Only the fields we change are sent - the resourceVersion makes the API Server reject
+        the patch if the backend has changed since we read it, rather than overwriting that
+        change. Note that all annotations need to be strings.
+        """
+        return {
+            "metadata": {
+                "resourceVersion": trident_backend.resource_version,
+                "annotations": {
+                    "trident_mcc_managed": str(True),
+                    "trident_mcc_svm_uuid": svm_uuid,
+                    # Increment Existing Count to know it is failing over.
+                    "trident_mcc_update_count": str(
+                        int(
+                            trident_backend.annotations.get(
+                                "trident_mcc_update_count", 0
+                            )
+                        )
+                        + 1
+                    ),
+                },
+            },
+            "spec": {"svm": svm_name},
+        }
+
     def _patch_backend_with_svmname(
-        self, trident_backend: ResourceInstance, svm_name: str, svm_uuid: str
+        self, trident_backend: BackendView, svm_name: str, svm_uuid: str
     ) -> bool:
         """Takes the specified trident_backend and svm_name and patches the object.
 
         Updated the SVM Name in the TridentBackendConfig, and adds/update annotation to let you know
         it has done it, and how many times.
 
-        :param trident_backend: TridentBackendConfig ResourceInstance object you want to patch
-        :type trident_backend: kubernetes.dynamic.resource.ResourceInstance
+        If the backend changed since it was read, e.g. Trident updated its status, the patch is
+        rejected with a conflict. The backend is then read again and, if it is still the same
+        backend and still needs the new SVM Name, the patch is retried up to
+        PATCH_CONFLICT_RETRIES times.
+
+        :param trident_backend: TridentBackendConfig you want to patch
+        :type trident_backend: trident_mcc.k8s_client.BackendView
         :param svm_name: Updated svm_name that you want to patch into the object.
         :type svm_name: str
+        :param svm_uuid: UUID of the SVM, recorded in the trident_mcc_svm_uuid annotation
+        :type svm_uuid: str
         :return: True or False depending on success updating the backend.
         :rtype: bool
 
         """
         start_time = time.time()
         logger.debug("Setting up to patch trident backend from API Server")
-        # Get my trident backend api
-        try:
-            trident_backend_api = self.client.resources.get(
-                api_version="trident.netapp.io/v1", kind="TridentBackendConfig"
-            )
-        except ResourceNotFoundError as err:
-            logger.error(
-                "Unable to find trident CustomResource - Please ensure Trident is installed in Operator Mode"
-            )
-            raise err
+        self._check_trident_installed()
 
-        # Update BackendObject with new values
-        patch_backend = trident_backend.to_dict()
-        patch_backend["spec"]["svm"] = svm_name
-        # Make sure Annotations exist and if not create them before adding new key
-        # Note that all annotations need to be strings
-        if patch_backend["metadata"].get("annotations", None) is None:
-            patch_backend["metadata"]["annotations"] = {}
-        patch_backend["metadata"]["annotations"]["trident_mcc_managed"] = str(True)
-        patch_backend["metadata"]["annotations"]["trident_mcc_svm_uuid"] = svm_uuid
-        patch_backend["metadata"]["annotations"]["trident_mcc_update_count"] = str(
-            int(
-                patch_backend["metadata"]["annotations"].get(
-                    "trident_mcc_update_count", 0
+        # Patch Backend Api.
+        backend_name = trident_backend.name
+        logger.debug(f"Attempting to patch TridentBackendConfig named '{backend_name}'")
+        response = False
+        attempt = 0
+        while True:
+            try:
+                backend_response = self._resource_request(
+                    RequestPriority.FAILOVER,
+                    "trident.netapp.io/v1",
+                    "TridentBackendConfig",
+                    "patch",
+                    body=self._svm_patch(trident_backend, svm_name, svm_uuid),
+                    name=backend_name,
+                    namespace=self._trident_namespace,
+                    content_type="application/merge-patch+json",
+                )
+                break
+            except ConflictError:
+                if attempt >= PATCH_CONFLICT_RETRIES:
+                    logger.warning(
+                        f"TridentBackendConfig '{backend_name}' kept changing while being patched - not patching, it will be checked again"
+                    )
+                    backend_response = None
+                    break
+                attempt += 1
+                logger.info(
+                    f"TridentBackendConfig '{backend_name}' changed since it was read - reading it again ({attempt}/{PATCH_CONFLICT_RETRIES})"
+                )
+                try:
+                    current_backend = BackendView.from_dict(
+                        self._get_trident_backend_by_name(
+                            backend_name, priority=RequestPriority.FAILOVER
+                        ).to_dict()
+                    )
+                except NotFoundError:
+                    logger.info(
+                        f"TridentBackendConfig '{backend_name}' was deleted - not patching"
+                    )
+                    backend_response = None
+                    break
+                if (
+                    current_backend.svm == svm_name
+                    and current_backend.annotations.get("trident_mcc_svm_uuid")
+                    == svm_uuid
+                ):
+                    logger.info(
+                        f"TridentBackendConfig '{backend_name}' already has SVM Name '{svm_name}'"
+                    )
+                    return True
+                # Only retry while it is still the backend we looked the SVM up for
+                if (
+                    current_backend.management_lif != trident_backend.management_lif
+                    or (
+                        current_backend.annotations.get("trident_mcc_svm_uuid")
+                        != trident_backend.annotations.get("trident_mcc_svm_uuid")
+                    )
+                ):
+                    logger.warning(
+                        f"TridentBackendConfig '{backend_name}' now points at a different management LIF or SVM - not patching, it will be checked again"
+                    )
+                    backend_response = None
+                    break
+                trident_backend = current_backend
+
+        # The patch response is the updated object, so validate against it rather than reading it back
+        if backend_response is not None:
+            logger.info(f"Patch Complete - Validating Result")
+            if (
+                backend_response.spec.svm == svm_name
+                and (backend_response.metadata.annotations or {}).get(
+                    "trident_mcc_svm_uuid", ""
+                )
+                == svm_uuid
+            ):
+                logger.info(
+                    f"Successfully Patched Backend with new svm-name and annotations"
+                )
+                response = True
+            else:
+                logger.error(
+                    f"Unable to patch TridentBackedConfig '{backend_name}' to correct SVM Name"
                 )
-            )
-            + 1
-        )  # Increment Existing Count to know it is failing over.
 
-        # Patch Backend Api.
+        end_time = time.time()
         logger.debug(
-            f"Attempting to patch TridentBackendConfig named '{patch_backend['metadata']['name']}'"
+            f"_patch_backend_with_svmname execution took {end_time - start_time:.2f}s"
         )
-        try:
-            backend_response = trident_backend_api.patch(
-                body=patch_backend, content_type="application/merge-patch+json"
-            )
-        except Exception as err:
-            raise err
+        return response
 
-        logger.info(f"Patch Complete - Validating Result")
-        patched_svm_details = self._get_trident_backend_by_name(
-            backend_response.metadata.name
-        )
+    def _get_backend_credentials(self, trident_backend_config: BackendView) -> dict:
+        """Returns the decoded credentials for the backend, using the secret cache where possible
+
+        Cached credentials are returned without any API call until they are older than the
+        secret_cache_ttl. After that the Secret is read again, and only decoded if its
+        resourceVersion has changed, in which case on_secret_rotated is called.
+
+        :param trident_backend_config: Trident Backend Configuration Retrieved from the Trident Api.
+        :returns: Python dictionary containing the decoded KV pairs from the secret
+        :rtype: dict
+        """
+        secret_name = trident_backend_config.credentials_name
+        cached = self._secret_cache.get(secret_name)
+        if cached is not None and time.time() - cached[2] < self._secret_cache_ttl:
+            logger.debug(f"Using cached credentials from secret '{secret_name}'")
+            return cached[1]
+
+        secret = self._get_backend_secret(trident_backend_config)
+        resource_version = secret.metadata.resourceVersion
+        with self._secret_cache_lock:
+            cached = self._secret_cache.get(secret_name)
+            if cached is not None and cached[0] == resource_version:
+                logger.debug(
+                    f"Secret '{secret_name}' unchanged - not decoding it again"
+                )
+                decoded = cached[1]
+            else:
+                decoded = self._decode_secrets(secret)
+                if cached is not None:
+                    logger.info(f"Secret '{secret_name}' has changed")
+            self._secret_cache[secret_name] = (resource_version, decoded, time.time())
 
         if (
-            patched_svm_details.spec.svm == svm_name
-            and patched_svm_details.metadata.annotations.get("trident_mcc_svm_uuid", "")
-            == svm_uuid
+            cached is not None
+            and cached[0] != resource_version
+            and self._on_secret_rotated is not None
         ):
-            logger.info(
-                f"Successfully Patched Backend with new svm-name and annotations"
+            self._on_secret_rotated(secret_name, cached[1])
+        return decoded
+
+    def invalidate_backend_credentials(
+        self, trident_backend_config: BackendView
+    ) -> None:
+        """Drops the cached credentials for the backend, e.g. after ONTAP rejected them
+
+        :param trident_backend_config: Trident Backend Configuration Retrieved from the Trident Api.
+        """
+        secret_name = trident_backend_config.credentials_name
+        with self._secret_cache_lock:
+            if self._secret_cache.pop(secret_name, None) is not None:
+                logger.info(
+                    f"Invalidated cached credentials from secret '{secret_name}'"
+                )
+
+    def renew_lease(
+        self, name: str, holder_identity: str, lease_duration: int, labels: dict = None
+    ) -> None:
+        """Renews the named Lease in the Trident Namespace, creating it if it doesn't exist
+
+        :param name: Name of the Lease
+        :type name: str
+        :param holder_identity: Identity of this replica, written to spec.holderIdentity
+        :type holder_identity: str
+        :param lease_duration: Seconds the Lease is valid for without another renewal
+        :type lease_duration: int
+        :param labels: Labels set on the Lease when it is created (default is None)
+        :type labels: dict
+        """
+        # Leases use MicroTime, which needs exactly six fractional digits
+        now = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+        spec = {
+            "holderIdentity": holder_identity,
+            "leaseDurationSeconds": lease_duration,
+            "renewTime": now,
+        }
+        try:
+            self._resource_request(
+                RequestPriority.FAILOVER,
+                "coordination.k8s.io/v1",
+                "Lease",
+                "patch",
+                body={"spec": spec},
+                name=name,
+                namespace=self._trident_namespace,
+                content_type="application/merge-patch+json",
             )
-            response = True
-        else:
-            logger.error(
-                f"Unable to patch TridentBackedConfig '{trident_backend.metadata.name}' to correct SVM Name"
+        except NotFoundError:
+            logger.info(f"Creating Lease '{name}' for '{holder_identity}'")
+            spec["acquireTime"] = now
+            self._resource_request(
+                RequestPriority.FAILOVER,
+                "coordination.k8s.io/v1",
+                "Lease",
+                "create",
+                body={
+                    "apiVersion": "coordination.k8s.io/v1",
+                    "kind": "Lease",
+                    "metadata": {"name": name, "labels": labels or {}},
+                    "spec": spec,
+                },
+                namespace=self._trident_namespace,
             )
 
-        end_time = time.time()
-        logger.debug(
-            f"_patch_backend_with_svmname execution took {end_time - start_time:.2f}s"
+    def list_leases(self, label_selector: str) -> List[ResourceInstance]:
+        """Lists the Leases in the Trident Namespace matching label_selector
+
+        :param label_selector: Label selector e.g. 'trident_mcc_shard=member'
+        :type label_selector: str
+        :returns: The matching Lease objects
+        :rtype: List[kubernetes.dynamic.resource.ResourceInstance]
+        """
+        return list(
+            self._resource_request(
+                RequestPriority.FAILOVER,
+                "coordination.k8s.io/v1",
+                "Lease",
+                "get",
+                namespace=self._trident_namespace,
+                label_selector=label_selector,
+            ).items
         )
-        return response
+
+    def delete_lease(self, name: str) -> None:
+        """Deletes the named Lease from the Trident Namespace, if it still exists"""
+        try:
+            self._resource_request(
+                RequestPriority.DEFAULT,
+                "coordination.k8s.io/v1",
+                "Lease",
+                "delete",
+                name=name,
+                namespace=self._trident_namespace,
+            )
+        except NotFoundError:
+            logger.debug(f"Lease '{name}' was already deleted")
+
+    def get_config_map(self, name: str) -> ResourceInstance:
+        """Returns the named ConfigMap in the Trident Namespace, or None if it doesn't exist"""
+        try:
+            return self._resource_request(
+                RequestPriority.DEFAULT,
+                "v1",
+                "ConfigMap",
+                "get",
+                name=name,
+                namespace=self._trident_namespace,
+            )
+        except NotFoundError:
+            return None
+
+    def patch_config_map(self, name: str, binary_data: dict) -> None:
+        """Merges binary_data into the named ConfigMap in the Trident Namespace, creating it if needed
+
+        :param name: Name of the ConfigMap
+        :type name: str
+        :param binary_data: Key to base64 encoded value, a value of None removes the key
+        :type binary_data: dict
+        """
+        try:
+            self._resource_request(
+                RequestPriority.DEFAULT,
+                "v1",
+                "ConfigMap",
+                "patch",
+                body={"binaryData": binary_data},
+                name=name,
+                namespace=self._trident_namespace,
+                content_type="application/merge-patch+json",
+            )
+        except NotFoundError:
+            logger.info(f"Creating ConfigMap '{name}'")
+            self._resource_request(
+                RequestPriority.DEFAULT,
+                "v1",
+                "ConfigMap",
+                "create",
+                body={
+                    "apiVersion": "v1",
+                    "kind": "ConfigMap",
+                    "metadata": {"name": name},
+                    "binaryData": {
+                        key: value
+                        for key, value in binary_data.items()
+                        if value is not None
+                    },
+                },
+                namespace=self._trident_namespace,
+            )
 
     def get_na_connection_properties(self, trident_backend_config):
         """Takes Trident Backend Config and Returns a dict that can be passed to NetApp client"""
 
-        response = {"management_lif": trident_backend_config.spec.managementLIF}
+        response = {"management_lif": trident_backend_config.management_lif}
 
-        secrets = self._decode_secrets(self._get_backend_secret(trident_backend_config))
+        secrets = self._get_backend_credentials(trident_backend_config)
         response.update(**secrets)
 
         return response
@@ -0,0 +1,106 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from enum import IntEnum
+
+
+logger = logging.getLogger("trident_mcc.k8s_client")
+
+
+class RequestPriority(IntEnum):
+    """Order requests waiting on the RateLimiter are let through in, lowest first"""
+
+    # Patches repairing backends and Lease renewals - both are time critical during a failover
+    FAILOVER = 0
+    # Lists, watches and everything else
+    DEFAULT = 1
+    # Reads made while verifying backends, e.g. Secrets
+    VERIFY = 2
+
+
+class RateLimiter:
+    def __init__(self, qps: float = 100, burst: int = 200) -> None:
+        """Token bucket limiting the rate of requests to the API Server, served by priority
+
+        Up to burst requests are let through straight away, after that the bucket refills at
+        qps requests per second. Requests waiting for a token are let through lowest
+        RequestPriority first, and in the order they arrived within a priority, so a failover
+        patch doesn't queue behind a sweep's worth of verification reads.
+
+        When the API Server answers 429 Too Many Requests, backoff stops every request until
+        its Retry-After has passed, as API Priority and Fairness throttles the whole client.
+
+        :param qps: Sustained requests per second (default is 100)
+        :type qps: float
+        :param burst: Requests allowed in a burst, the size of the bucket (default is 200)
+        :type burst: int
+        """
+        self._qps = qps
+        self._burst = max(burst, 1)
+        self._tokens = float(self._burst)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._condition = threading.Condition()
+        # Heap of (priority, arrival) of the requests waiting for a token
+        self._waiting = []
+        self._arrivals = itertools.count()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(
+            self._burst, self._tokens + (now - self._updated) * self._qps
+        )
+        self._updated = now
+
+    def acquire(self, priority: RequestPriority = RequestPriority.DEFAULT) -> float:
+        """Waits until a request of this priority may be made
+
+        :param priority: Priority of the request (default is RequestPriority.DEFAULT)
+        :type priority: RequestPriority
+        :returns: Seconds spent waiting
+        :rtype: float
+        """
+        start_time = time.monotonic()
+        ticket = (priority, next(self._arrivals))
+        with self._condition:
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if self._waiting[0] != ticket:
+                        # Only the first in line waits for tokens, the rest wait their turn
+                        self._condition.wait()
+                        continue
+                    wait = max(
+                        self._blocked_until - now,
+                        (1 - self._tokens) / self._qps if self._tokens < 1 else 0,
+                    )
+                    if wait <= 0:
+                        self._tokens -= 1
+                        break
+                    self._condition.wait(wait)
+            finally:
+                if self._waiting[0] == ticket:
+                    heapq.heappop(self._waiting)
+                else:
+                    self._waiting.remove(ticket)
+                    heapq.heapify(self._waiting)
+                self._condition.notify_all()
+        waited = time.monotonic() - start_time
+        if waited > 1:
+            logger.debug(
+                f"Waited {waited:.2f}s for a {priority.name} request to the API Server"
+            )
+        return waited
+
+    def backoff(self, retry_after: float) -> None:
+        """Holds back every request for retry_after seconds, e.g. after a 429 response"""
+        with self._condition:
+            self._blocked_until = max(
+                self._blocked_until, time.monotonic() + retry_after
+            )
+            # Don't follow the throttled burst with another one
+            self._tokens = min(self._tokens, 0)
+            self._condition.notify_all()
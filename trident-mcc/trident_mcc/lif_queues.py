@@ -0,0 +1,70 @@
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, List, TypeVar
+
+Result = TypeVar("Result")
+
+
+def map_per_lif(
+    func: Callable[..., Result],
+    trident_backends: List,
+    max_workers: int,
+    max_per_lif: int,
+) -> List[Result]:
+    """Runs func on every backend in a thread pool, at most max_per_lif at once per management LIF
+
+    Each management LIF has its own queue of backends, and a backend is only handed to the
+    pool once its management LIF has a free slot. A worker therefore never sits waiting on a
+    busy management LIF, so a slow cluster holds up its own backends but not the others.
+    Management LIFs take turns for free workers, in the order they were first seen.
+
+    :param func: Called with each backend
+    :type func: Callable[[trident_mcc.k8s_client.BackendView], Result]
+    :param trident_backends: TridentBackendConfig objects retrieved from the K8s API
+    :type trident_backends: List[trident_mcc.k8s_client.BackendView]
+    :param max_workers: Number of backends processed at once
+    :type max_workers: int
+    :param max_per_lif: Number of backends processed at once against a management LIF
+    :type max_per_lif: int
+    :returns: What func returned for each backend, in the same order as trident_backends
+    :rtype: List[Result]
+    """
+    queues = {}
+    for index, trident_config in enumerate(trident_backends):
+        queues.setdefault(trident_config.management_lif, deque()).append(
+            (index, trident_config)
+        )
+    results = [None] * len(trident_backends)
+    in_flight = Counter()
+    # Management LIFs with backends queued and a free slot
+    ready = deque(queues)
+    running = {}
+
+    with ThreadPoolExecutor(
+        max_workers=max_workers, thread_name_prefix="reconcile"
+    ) as executor:
+
+        def submit_ready():
+            while ready and len(running) < max_workers:
+                management_lif = ready.popleft()
+                index, trident_config = queues[management_lif].popleft()
+                running[executor.submit(func, trident_config)] = index, management_lif
+                in_flight[management_lif] += 1
+                if queues[management_lif] and in_flight[management_lif] < max_per_lif:
+                    ready.append(management_lif)
+
+        submit_ready()
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, management_lif = running.pop(future)
+                results[index] = future.result()
+                in_flight[management_lif] -= 1
+                # Below the limit it is already waiting in ready, if it has anything queued
+                if (
+                    queues[management_lif]
+                    and in_flight[management_lif] == max_per_lif - 1
+                ):
+                    ready.append(management_lif)
+            submit_ready()
+    return results
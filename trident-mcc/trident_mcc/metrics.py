@@ -0,0 +1,405 @@
+from __future__ import annotations
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from trident_mcc.models import CycleReport, RepairEvent
+
+
+logger = logging.getLogger("trident_mcc.metrics")
+
+# Buckets in seconds, from a single fast API call up to a very slow sweep
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+# Buckets in seconds for failover repairs, from a triggered reconcile up to several missed polls
+REPAIR_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 900, 1800, 3600)
+REPAIR_CYCLE_BUCKETS = (1, 2, 3, 5, 10, 20)
+
+
+def _format_labels(label_names: Tuple[str, ...], label_values: Tuple[str, ...]) -> str:
+    if not label_names:
+        return ""
+    pairs = []
+    for name, value in zip(label_names, label_values):
+        value = (
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        )
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class _Metric:
+    metric_type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.metric_type}",
+        ]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(
+                    f"{self.name}{_format_labels(self.label_names, key)} {value}"
+                )
+        return lines
+
+
+class Counter(_Metric):
+    metric_type = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    metric_type = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def clear(self) -> None:
+        """Removes every labelled value, for gauges whose label values come and go"""
+        with self._lock:
+            self._values = {}
+
+
+class Histogram(_Metric):
+    metric_type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            # [bucket counts..., sum, count]
+            series = self._values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.metric_type}",
+        ]
+        with self._lock:
+            for key, series in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, series):
+                    bucket_labels = _format_labels(
+                        self.label_names + ("le",), key + (repr(float(bound)),)
+                    )
+                    lines.append(f"{self.name}_bucket{bucket_labels} {count}")
+                labels = _format_labels(self.label_names, key)
+                inf_labels = _format_labels(self.label_names + ("le",), key + ("+Inf",))
+                lines.append(f"{self.name}_bucket{inf_labels} {series[-1]}")
+                lines.append(f"{self.name}_sum{labels} {series[-2]}")
+                lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        """Holds metrics and renders them in the Prometheus text exposition format"""
+        self._metrics = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class CycleStats:
+    def __init__(self) -> None:
+        """Collects timings and ONTAP request counts while a reconcile cycle runs
+
+        Safe to use from the reconcile worker threads. The collected values are turned into
+        a CycleReport at the end of the cycle and sent with the status update.
+        """
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.phase_latencies = {}
+            self.lif_requests = {}
+            self.lif_errors = {}
+            self.repairs = []
+
+    @contextmanager
+    def time_phase(self, phase: str) -> Iterator[None]:
+        """Context manager recording how long the enclosed block took against the phase"""
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            duration = time.time() - start_time
+            with self._lock:
+                self.phase_latencies.setdefault(phase, []).append(duration)
+
+    def count_ontap_request(self, management_lif: str, error: bool = False) -> None:
+        with self._lock:
+            self.lif_requests[management_lif] = (
+                self.lif_requests.get(management_lif, 0) + 1
+            )
+            if error:
+                self.lif_errors[management_lif] = (
+                    self.lif_errors.get(management_lif, 0) + 1
+                )
+
+    def record_repair(self, repair: RepairEvent) -> None:
+        with self._lock:
+            self.repairs.append(repair)
+
+    def take_repairs(self) -> List[RepairEvent]:
+        """Returns the repairs recorded so far and removes them, so they aren't reported again"""
+        with self._lock:
+            repairs, self.repairs = self.repairs, []
+        return repairs
+
+    def report(
+        self,
+        duration: float,
+        seen: int = 0,
+        managed: int = 0,
+        patched: int = 0,
+        failed: int = 0,
+        open_circuits: List[str] = None,
+    ) -> CycleReport:
+        with self._lock:
+            return CycleReport(
+                duration=duration,
+                backends_seen=seen,
+                backends_managed=managed,
+                backends_patched=patched,
+                backends_failed=failed,
+                phase_latencies=self.phase_latencies,
+                lif_requests=self.lif_requests,
+                lif_errors=self.lif_errors,
+                repairs=self.repairs,
+                open_circuits=open_circuits or [],
+            )
+
+
+class RepairTracker:
+    def __init__(self) -> None:
+        """Follows backends from their SVM name first being seen out of date until the patch is verified
+
+        This is how long Trident is broken after a switchover. Detection is the first pass
+        that finds the backend's SVM (by its UUID) under a new name, each pass that finds it
+        again counts as another cycle, and the repair is finished once the patched backend
+        returned by the API Server has the new name. Finished repairs are added to
+        cycle_stats. A sweep sends its repairs with its CycleReport, a triggered reconcile or
+        a watch event sends them straight away, see CycleStats.take_repairs.
+        """
+        self._lock = threading.Lock()
+        # backend name -> (detected at, cycles, previous svm name)
+        self._pending = {}
+
+    def mismatch(self, backend_name: str, previous_svm_name: str) -> None:
+        """Records a pass that found the backend's SVM name out of date"""
+        with self._lock:
+            detected_at, cycles, previous_svm_name = self._pending.get(
+                backend_name, (time.time(), 0, previous_svm_name)
+            )
+            self._pending[backend_name] = (detected_at, cycles + 1, previous_svm_name)
+
+    def repaired(
+        self, backend_name: str, management_lif: str, svm_name: str
+    ) -> Optional[RepairEvent]:
+        """Finishes the backend's repair once its patch has been verified
+
+        :returns: The finished repair, or None if there wasn't a mismatch recorded for it
+        :rtype: trident_mcc.models.RepairEvent
+        """
+        repaired_at = time.time()
+        with self._lock:
+            pending = self._pending.pop(backend_name, None)
+        if pending is None:
+            return None
+        detected_at, cycles, previous_svm_name = pending
+        repair = RepairEvent(
+            backend_name=backend_name,
+            management_lif=management_lif,
+            previous_svm_name=previous_svm_name,
+            svm_name=svm_name,
+            detected_at=detected_at,
+            repaired_at=repaired_at,
+            time_to_repair=repaired_at - detected_at,
+            cycles=cycles,
+        )
+        logger.info(
+            f"TridentBackendConfig '{backend_name}' repaired '{previous_svm_name}' -> '{svm_name}' in {repair.time_to_repair:.2f}s over {cycles} cycle(s)"
+        )
+        cycle_stats.record_repair(repair)
+        return repair
+
+    def discard(self, backend_name: str) -> None:
+        """Forgets a pending repair, e.g. the backend was corrected by something else"""
+        with self._lock:
+            self._pending.pop(backend_name, None)
+
+    def prune(self, backend_names: Set[str]) -> None:
+        """Forgets pending repairs of backends that no longer exist"""
+        with self._lock:
+            for backend_name in list(self._pending):
+                if backend_name not in backend_names:
+                    del self._pending[backend_name]
+
+
+# Collected by the reconcile loop, reset after every sweep is reported
+cycle_stats = CycleStats()
+# Pending failover repairs, finished ones are reported through cycle_stats
+repair_tracker = RepairTracker()
+
+
+# Exposed by the healthz app on /metrics
+registry = Registry()
+cycle_duration = registry.register(
+    Histogram(
+        "trident_mcc_cycle_duration_seconds",
+        "Time taken by a full reconcile sweep of all backends.",
+    )
+)
+phase_duration = registry.register(
+    Histogram(
+        "trident_mcc_phase_duration_seconds",
+        "Time taken by each phase of reconciling - k8s_list, metrocluster_state, secret_fetch, ontap_lookup and patch.",
+        labels=("phase",),
+    )
+)
+ontap_requests = registry.register(
+    Counter(
+        "trident_mcc_ontap_requests_total",
+        "ONTAP REST requests made, by management LIF.",
+        labels=("management_lif",),
+    )
+)
+ontap_request_errors = registry.register(
+    Counter(
+        "trident_mcc_ontap_request_errors_total",
+        "ONTAP REST requests that failed, by management LIF.",
+        labels=("management_lif",),
+    )
+)
+backends = registry.register(
+    Gauge(
+        "trident_mcc_backends",
+        "TridentBackendConfigs in the last sweep - seen, managed (ONTAP), patched and failed.",
+        labels=("state",),
+    )
+)
+backends_patched = registry.register(
+    Counter(
+        "trident_mcc_backends_patched_total",
+        "TridentBackendConfigs patched with a new SVM name.",
+    )
+)
+last_success = registry.register(
+    Gauge(
+        "trident_mcc_last_successful_sweep_timestamp_seconds",
+        "Unix time the last successful sweep finished.",
+    )
+)
+seconds_since_success = registry.register(
+    Gauge(
+        "trident_mcc_seconds_since_last_successful_sweep",
+        "Seconds since the last successful sweep finished, -1 if there hasn't been one.",
+    )
+)
+time_to_repair = registry.register(
+    Histogram(
+        "trident_mcc_time_to_repair_seconds",
+        "Time from a backend's SVM name first being seen out of date until its patch was verified, by management LIF.",
+        labels=("management_lif",),
+        buckets=REPAIR_BUCKETS,
+    )
+)
+repair_cycles = registry.register(
+    Histogram(
+        "trident_mcc_repair_cycles",
+        "Reconcile passes from a backend's SVM name first being seen out of date until its patch was verified.",
+        buckets=REPAIR_CYCLE_BUCKETS,
+    )
+)
+ontap_circuit_open = registry.register(
+    Gauge(
+        "trident_mcc_ontap_circuit_open",
+        "1 while the circuit breaker of a management LIF is open and requests to it fail fast, 0 once it responds again.",
+        labels=("management_lif",),
+    )
+)
+_last_success_time = None
+
+
+def observe_cycle(report: CycleReport) -> None:
+    """Records a finished sweep's CycleReport into the registry"""
+    global _last_success_time
+
+    cycle_duration.observe(report.duration)
+    for phase, latencies in report.phase_latencies.items():
+        for latency in latencies:
+            phase_duration.observe(latency, phase=phase)
+    for management_lif, count in report.lif_requests.items():
+        ontap_requests.inc(count, management_lif=management_lif)
+    for management_lif, count in report.lif_errors.items():
+        ontap_request_errors.inc(count, management_lif=management_lif)
+    backends.set(report.backends_seen, state="seen")
+    backends.set(report.backends_managed, state="managed")
+    backends.set(report.backends_patched, state="patched")
+    backends.set(report.backends_failed, state="failed")
+    backends_patched.inc(report.backends_patched)
+    observe_repairs(report.repairs)
+    ontap_circuit_open.clear()
+    for management_lif in report.lif_requests:
+        ontap_circuit_open.set(0, management_lif=management_lif)
+    for management_lif in report.open_circuits:
+        ontap_circuit_open.set(1, management_lif=management_lif)
+    _last_success_time = time.time()
+    last_success.set(_last_success_time)
+
+
+def observe_repairs(repairs: List[RepairEvent]) -> None:
+    """Records finished failover repairs into the registry"""
+    for repair in repairs:
+        time_to_repair.observe(
+            repair.time_to_repair, management_lif=repair.management_lif
+        )
+        repair_cycles.observe(repair.cycles)
+
+
+def render() -> str:
+    """Returns all metrics in the Prometheus text exposition format"""
+    if _last_success_time is None:
+        seconds_since_success.set(-1)
+    else:
+        seconds_since_success.set(round(time.time() - _last_success_time, 3))
+    return registry.render()
@@ -1,5 +1,15 @@
 from typing import ItemsView
-from .models import StatusUpdate, StateEnum, AppHealth, StateMessageEnum
+from .models import (
+    StatusUpdate,
+    StateEnum,
+    AppHealth,
+    StateMessageEnum,
+    ReconcileResult,
+    CycleReport,
+    ReconcileRequest,
+    RepairEvent,
+    RepairReport,
+)
 
 
 def lookup_status_message(status_code: StateEnum) -> StateMessageEnum:
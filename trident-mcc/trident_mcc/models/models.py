@@ -2,7 +2,7 @@ from __future__ import annotations
 from datetime import datetime, timedelta
 import logging
 
-from typing import Optional
+from typing import Dict, List, Optional
 from enum import IntEnum, Enum
 from pydantic import BaseModel
 
@@ -25,9 +25,67 @@ class StateMessageEnum(str, Enum):
     TIMEOUT = "Gateway Time-Out - No Updated Status Available"
 
 
+class ReconcileResult(str, Enum):
+    """Outcome of reconciling a single TridentBackendConfig"""
+
+    IGNORED = "ignored"  # Not an ONTAP backend
+    UNCHANGED = "unchanged"
+    PATCHED = "patched"
+    FAILED = "failed"
+    SKIPPED = "skipped"  # Not checked because we are shutting down
+
+
+class RepairEvent(BaseModel):
+    """A backend whose SVM name changed on ONTAP, from first seeing it until the patch was verified"""
+
+    backend_name: str
+    management_lif: str
+    previous_svm_name: Optional[str] = None
+    svm_name: str
+    # Unix times the mismatch was first seen and the patched backend was verified
+    detected_at: float
+    repaired_at: float
+    time_to_repair: float
+    # Reconcile passes that saw the mismatch, including the one that patched it
+    cycles: int
+
+
+class CycleReport(BaseModel):
+    """Timings and counts from a reconcile sweep, used for the /metrics endpoint"""
+
+    duration: float
+    backends_seen: int = 0
+    backends_managed: int = 0
+    backends_patched: int = 0
+    backends_failed: int = 0
+    # phase -> individual latencies in seconds
+    phase_latencies: Dict[str, List[float]] = {}
+    # management lif -> request count
+    lif_requests: Dict[str, int] = {}
+    lif_errors: Dict[str, int] = {}
+    # Backends repaired by the sweep, other repairs are sent straight away in a RepairReport
+    repairs: List[RepairEvent] = []
+    # Management LIFs whose circuit breaker was open or half-open at the end of the sweep
+    open_circuits: List[str] = []
+
+
+class RepairReport(BaseModel):
+    """Failover repairs finished outside a sweep, e.g. by a triggered reconcile or a watch event"""
+
+    repairs: List[RepairEvent] = []
+
+
 class StatusUpdate(BaseModel):
     state: StateEnum
     message: Optional[str] = None
+    cycle: Optional[CycleReport] = None
+
+
+class ReconcileRequest(BaseModel):
+    """Body of POST /reconcile - leave both unset to reconcile every backend"""
+
+    backend_name: Optional[str] = None
+    management_lif: Optional[str] = None
 
 
 class AppHealth(BaseModel):
@@ -1 +1,6 @@
-from .main import NetAppClient
\ No newline at end of file
+from .main import NetAppClient
+from .connection_pool import ConnectionPool
+from .svm_inventory import SvmInventoryCache
+from .async_client import AsyncNetAppClient, AsyncOntapSession
+from .circuit_breaker import CircuitBreakers, CircuitOpenError
+from .wire_log import WireLog
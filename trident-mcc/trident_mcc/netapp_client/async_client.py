@@ -0,0 +1,481 @@
+import asyncio
+import base64
+import ipaddress
+import json
+import logging
+import ssl
+import time
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlencode, urlsplit
+
+from netapp_ontap import NetAppRestError
+
+from trident_mcc.metrics import cycle_stats
+
+from .circuit_breaker import CircuitBreakers
+from .connection_pool import credential_fingerprint
+from .main import SVM_FIELDS
+from .svm_inventory import SvmInventory, normalize_svm_name
+from .wire_log import WireLog
+
+
+logger = logging.getLogger("trident_mcc.netapp_client")
+
+SVM_COLLECTION_PATH = "/api/svm/svms"
+
+
+class OntapHttpError(NetAppRestError):
+    def __init__(self, message: str, status_code: int = None) -> None:
+        """NetAppRestError raised by the async client for an ONTAP error response
+
+        Carries the HTTP status code the same way the netapp_ontap errors do, so callers
+        can handle both clients' errors alike.
+        """
+        super().__init__(message)
+        self._status_code = status_code
+
+    @property
+    def status_code(self) -> Optional[int]:
+        return self._status_code
+
+
+class MalformedResponseError(ConnectionError):
+    """Raised by the async client for a response it can't parse as HTTP
+
+    A ConnectionError, so like a dropped connection it is retried on a new connection and
+    counts against the management LIF's circuit breaker.
+    """
+
+
+def _split_management_lif(management_lif: str) -> Tuple[str, int, str]:
+    """Returns the host and port to connect to and the Host header for a management LIF
+
+    :param management_lif: Hostname or IPv4 or IPv6 address, optionally with a port
+        e.g. 10.0.0.1, fd00::1, [fd00::1]:8443
+    :type management_lif: str
+    :rtype: Tuple[str, int, str]
+    """
+    try:
+        # A bare IPv6 address, its colons aren't a port
+        host = str(ipaddress.IPv6Address(management_lif))
+        port = None
+    except ValueError:
+        address = urlsplit(f"//{management_lif}")
+        host = address.hostname
+        port = address.port
+    host_header = f"[{host}]" if ":" in host else host
+    if port is not None:
+        host_header = f"{host_header}:{port}"
+    return host, port or 443, host_header
+
+
+class AsyncOntapSession:
+    def __init__(
+        self,
+        request_timeout: float = 30,
+        max_connections_per_lif: int = 2,
+        connect_timeout: float = None,
+        circuit_breakers: CircuitBreakers = None,
+        wire_log: WireLog = None,
+        idle_timeout: float = 600,
+    ) -> None:
+        """Minimal asyncio HTTPS client for the ONTAP REST API
+
+        Keeps idle keep-alive connections per management LIF and credentials for reuse,
+        limits the requests in flight against each management LIF and applies a timeout
+        to every request. Connections belong to the event loop that opened them, so a
+        session must only be used, and closed, on one event loop. It can be kept across
+        reconcile passes, a connection left unused for idle_timeout is closed rather than
+        reused.
+
+        :param request_timeout: Seconds a single request, including reading the response,
+            may take before it is cancelled (default is 30)
+        :type request_timeout: float
+        :param max_connections_per_lif: Maximum requests in flight against one management LIF
+            (default is 2)
+        :type max_connections_per_lif: int
+        :param connect_timeout: Seconds opening a connection may take, None leaves it to the
+            request timeout (default is None)
+        :type connect_timeout: float
+        :param circuit_breakers: Fail fast on management LIFs that stopped responding
+            (default is None)
+        :type circuit_breakers: CircuitBreakers
+        :param wire_log: Records the requests and responses (default is None)
+        :type wire_log: WireLog
+        :param idle_timeout: Seconds a connection can go unused before it is closed
+            (default is 600)
+        :type idle_timeout: float
+        """
+        self._request_timeout = request_timeout
+        self._max_connections_per_lif = max_connections_per_lif
+        self._connect_timeout = connect_timeout
+        self._circuit_breakers = circuit_breakers
+        self._wire_log = wire_log
+        self._idle_timeout = idle_timeout
+        # (management_lif, fingerprint) -> [(reader, writer, idle since)]
+        self._idle = {}
+        self._ssl_contexts = {}
+        self._lif_semaphores = {}
+
+    def _ssl_context(self, fingerprint: str, cert: str, key: str) -> ssl.SSLContext:
+        context = self._ssl_contexts.get(fingerprint)
+        if context is None:
+            # Same as the HostConnections we create - verify=False
+            context = ssl.create_default_context()
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+            if cert:
+                context.load_cert_chain(certfile=cert, keyfile=key)
+            self._ssl_contexts[fingerprint] = context
+        return context
+
+    async def get_json(
+        self, management_lif: str, path: str, **auth_credentials
+    ) -> dict:
+        """GETs path from the management LIF and returns the decoded JSON body
+
+        :param management_lif: Management address of the ONTAP cluster or SVM
+        :type management_lif: str
+        :param path: Request path including any query string e.g. /api/svm/svms?fields=name
+        :type path: str
+        :param auth_credentials: Either username/password or cert/key
+        :returns: The decoded response body
+        :rtype: dict
+        :raises OntapHttpError: If ONTAP returns an error status
+        :raises asyncio.TimeoutError: If the request takes longer than the request timeout
+        :raises MalformedResponseError: If the response can't be parsed as HTTP
+        :raises CircuitOpenError: If the management LIF's circuit breaker is open
+        """
+        fingerprint = credential_fingerprint(**auth_credentials)
+        semaphore = self._lif_semaphores.get(management_lif)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self._max_connections_per_lif)
+            self._lif_semaphores[management_lif] = semaphore
+        async with semaphore:
+            if self._circuit_breakers is not None:
+                self._circuit_breakers.check(management_lif)
+            start_time = time.time()
+            try:
+                status, body = await asyncio.wait_for(
+                    self._request(
+                        management_lif, fingerprint, path, **auth_credentials
+                    ),
+                    timeout=self._request_timeout,
+                )
+            except (asyncio.TimeoutError, OSError, asyncio.IncompleteReadError) as err:
+                if self._circuit_breakers is not None:
+                    self._circuit_breakers.record_failure(management_lif)
+                if self._wire_log is not None:
+                    self._wire_log.record(
+                        management_lif,
+                        "GET",
+                        path,
+                        duration=time.time() - start_time,
+                        error=repr(err),
+                    )
+                raise
+        if self._wire_log is not None:
+            self._wire_log.record(
+                management_lif,
+                "GET",
+                path,
+                status=status,
+                duration=time.time() - start_time,
+                response_body=body,
+            )
+        if self._circuit_breakers is not None:
+            self._circuit_breakers.record_success(management_lif)
+
+        try:
+            response = json.loads(body) if body else {}
+        except ValueError:
+            response = {}
+        if status >= 400:
+            error_message = response.get("error", {}).get("message", "")
+            raise OntapHttpError(
+                f"GET {path} on '{management_lif}' failed with status {status}: {error_message}".strip(),
+                status_code=status,
+            )
+        return response
+
+    async def _request(
+        self,
+        management_lif: str,
+        fingerprint: str,
+        path: str,
+        username: str = None,
+        password: str = None,
+        cert: str = None,
+        key: str = None,
+    ) -> Tuple[int, bytes]:
+        host, port, host_header = _split_management_lif(management_lif)
+        request = [
+            f"GET {path} HTTP/1.1",
+            f"Host: {host_header}",
+            "Accept: application/json",
+            "Connection: keep-alive",
+        ]
+        if username:
+            token = base64.b64encode(f"{username}:{password}".encode()).decode()
+            request.append(f"Authorization: Basic {token}")
+        request_bytes = ("\r\n".join(request) + "\r\n\r\n").encode()
+
+        idle = self._idle.setdefault((management_lif, fingerprint), [])
+        # ONTAP may well have closed a connection that has been idle this long
+        stale_before = time.monotonic() - self._idle_timeout
+        while idle and idle[0][2] < stale_before:
+            idle.pop(0)[1].close()
+        while True:
+            reused = bool(idle)
+            if reused:
+                reader, writer, _ = idle.pop()
+            else:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(
+                        host,
+                        port,
+                        ssl=self._ssl_context(fingerprint, cert, key),
+                    ),
+                    timeout=self._connect_timeout,
+                )
+            keep_alive = False
+            try:
+                writer.write(request_bytes)
+                await writer.drain()
+                status, headers, body = await self._read_response(reader)
+                keep_alive = headers.get("connection", "").lower() != "close"
+            except (ConnectionError, asyncio.IncompleteReadError):
+                # ONTAP may have closed an idle keep-alive connection, retry on a new one
+                if reused:
+                    continue
+                raise
+            finally:
+                if keep_alive:
+                    idle.append((reader, writer, time.monotonic()))
+                else:
+                    writer.close()
+            return status, body
+
+    @staticmethod
+    async def _read_response(
+        reader: asyncio.StreamReader,
+    ) -> Tuple[int, Dict[str, str], bytes]:
+        while True:
+            status_line = await reader.readline()
+            if not status_line:
+                raise ConnectionResetError(
+                    "Connection closed before a response was read"
+                )
+            parts = status_line.split(None, 2)
+            if (
+                len(parts) < 2
+                or not parts[0].startswith(b"HTTP/1.")
+                or not (len(parts[1]) == 3 and parts[1].isdigit())
+            ):
+                raise MalformedResponseError(
+                    f"Malformed HTTP status line {status_line[:100]!r}"
+                )
+            status = int(parts[1])
+
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            # e.g. 100 Continue or 103 Early Hints, the final response follows
+            if status >= 200:
+                break
+
+        if status in (204, 304):
+            body = b""
+        elif headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size_line = (await reader.readline()).split(b";")[0]
+                try:
+                    size = int(size_line, 16)
+                except ValueError:
+                    raise MalformedResponseError(
+                        f"Malformed chunk size {size_line[:100]!r}"
+                    ) from None
+                if size == 0:
+                    # Skip any trailers
+                    while await reader.readline() not in (b"\r\n", b"\n", b""):
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            body = b"".join(chunks)
+        elif "content-length" in headers:
+            try:
+                content_length = int(headers["content-length"])
+            except ValueError:
+                raise MalformedResponseError(
+                    f"Malformed Content-Length {headers['content-length'][:100]!r}"
+                ) from None
+            body = await reader.readexactly(content_length)
+        else:
+            # No framing, the body runs until the connection is closed
+            body = await reader.read()
+            headers["connection"] = "close"
+        return status, headers, body
+
+    async def close(self) -> None:
+        """Closes every idle connection"""
+        for connections in self._idle.values():
+            for _, writer, _ in connections:
+                writer.close()
+        self._idle = {}
+
+
+class AsyncNetAppClient:
+    def __init__(
+        self,
+        session: AsyncOntapSession,
+        management_lif: str,
+        username: str = None,
+        password: str = None,
+        cert: str = None,
+        key: str = None,
+        inventories: Dict[tuple, asyncio.Future] = None,
+    ):
+        """asyncio version of NetAppClient's SVM lookups using an AsyncOntapSession
+
+        :param session: Session used to make the ONTAP REST requests
+        :type session: AsyncOntapSession
+        :param management_lif: Management address of the ONTAP cluster or SVM
+        :type management_lif: str
+        :param inventories: Shared between the clients of one reconcile pass so each cluster's
+            SVM list is only fetched once, None queries ONTAP per lookup instead
+            (default is None)
+        :type inventories: Dict[tuple, asyncio.Future]
+        """
+        logger.debug(
+            f"Initialising Async NetApp Client with {management_lif=} username={'redacted' if username else None} password={'redacted' if password else None} cert={'redacted' if cert else None} key={'redacted' if key else None}"
+        )
+        # Make sure we only have certificate/key or username/password
+        if all([username, password]) and not any([cert, key]):
+            self._auth_credentials = {"username": username, "password": password}
+        elif all([cert, key]) and not any([username, password]):
+            self._auth_credentials = {"cert": cert, "key": key}
+        else:
+            logger.error("You must provide either username/password or cert/key")
+            raise AttributeError(
+                "You must provide either username/password or cert/key"
+            )
+
+        self._session = session
+        self._management_lif = management_lif
+        self._inventories = inventories
+        self._credential_fingerprint = credential_fingerprint(**self._auth_credentials)
+
+    async def _get_svm_collection(self, limit: int = None, **query) -> List[dict]:
+        """Queries Management Lif for SVMs returning their name, subtype, state and uuid
+
+        Follows the collection's next links until every record, or limit records, have been read.
+
+        :param limit: Stop after this many SVMs have been returned (default is None)
+        :type limit: int
+        :param query: ONTAP REST query parameters e.g. name="svm1|svm1-mc"
+        :returns: List of SVM details dicts
+        :rtype: List[dict]
+        """
+        logger.info(
+            f"Retrieving SVM List from Management Address: {self._management_lif} {query or ''}"
+        )
+        if limit is not None:
+            query["max_records"] = limit
+        path = f"{SVM_COLLECTION_PATH}?{urlencode({'fields': SVM_FIELDS, **query})}"
+
+        response = []
+        while path:
+            try:
+                page = await self._session.get_json(
+                    self._management_lif, path, **self._auth_credentials
+                )
+            except Exception as err:
+                cycle_stats.count_ontap_request(self._management_lif, error=True)
+                raise err
+            cycle_stats.count_ontap_request(self._management_lif)
+
+            response.extend(
+                {field: record.get(field) for field in SVM_FIELDS.split(",")}
+                for record in page.get("records", [])
+            )
+            if limit is not None and len(response) >= limit:
+                return response[:limit]
+            path = page.get("_links", {}).get("next", {}).get("href")
+
+        return response
+
+    async def _get_svm_inventory(self) -> SvmInventory:
+        """Returns this pass's SVM inventory for the management lif and credentials"""
+        inventory_key = (self._management_lif, self._credential_fingerprint)
+        inventory = self._inventories.get(inventory_key)
+        if inventory is None:
+            inventory = asyncio.ensure_future(self._fetch_svm_inventory())
+            self._inventories[inventory_key] = inventory
+        # Don't let one cancelled lookup cancel the fetch the other backends are waiting on
+        return await asyncio.shield(inventory)
+
+    async def _fetch_svm_inventory(self) -> SvmInventory:
+        inventory = SvmInventory(await self._get_svm_collection())
+        logger.debug(
+            f"Fetched SVM inventory for '{self._management_lif}' - {len(inventory.svms)} SVMs"
+        )
+        return inventory
+
+    async def get_svm(self):
+        """Gets Single SVM assuming there is onyl one resolvable."""
+        start_time = time.time()
+        response = None
+
+        if self._inventories is not None:
+            svm_list = (await self._get_svm_inventory()).svms
+        else:
+            # We only need to know if there is more than one
+            svm_list = await self._get_svm_collection(limit=2)
+
+        if len(svm_list) > 1:
+            logger.error(
+                "No SVM Specified and get_collection return more than 1 SVM. Try specifying SVM Name in TridentBackendConfig or use SVM Management Lif instead of cluster."
+            )
+        elif len(svm_list) == 1:
+            response = svm_list[0]
+            logger.info(
+                f"Found a single SVM '{response['name']}' on management interface."
+            )
+        logger.debug(f"get_svm execution took: {time.time() - start_time:.2f}s")
+
+        return response
+
+    async def get_svm_by_name(self, svm_name: str):
+        start_time = time.time()
+        if self._inventories is not None:
+            response = (await self._get_svm_inventory()).get_by_name(svm_name)
+        else:
+            # Ask ONTAP for both the base and MetroCluster name, the last match wins
+            if svm_name[-3:].lower() == "-mc":
+                svm_name = svm_name[:-3]
+            response = None
+            for svm in await self._get_svm_collection(name=f"{svm_name}|{svm_name}-mc"):
+                if normalize_svm_name(svm["name"]) == svm_name.lower():
+                    response = svm
+        logger.debug(f"get_svm_by_name execution took: {time.time() - start_time:.2f}s")
+
+        return response
+
+    async def get_svm_by_uuid(self, svm_uuid: str):
+        start_time = time.time()
+        if self._inventories is not None:
+            response = (await self._get_svm_inventory()).get_by_uuid(svm_uuid)
+        else:
+            response = None
+            for svm in await self._get_svm_collection(uuid=svm_uuid):
+                if svm["uuid"] == svm_uuid:
+                    response = svm
+        logger.debug(f"get_svm_by_uuid execution took: {time.time() - start_time:.2f}s")
+
+        return response
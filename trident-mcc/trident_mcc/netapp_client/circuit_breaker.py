@@ -0,0 +1,107 @@
+import logging
+import threading
+import time
+from typing import List
+
+from netapp_ontap import NetAppRestError
+
+
+logger = logging.getLogger("trident_mcc.netapp_client")
+
+
+class CircuitOpenError(NetAppRestError):
+    """Raised instead of contacting a management LIF whose circuit breaker is open"""
+
+    status_code = None
+
+
+class CircuitBreakers:
+    def __init__(
+        self,
+        failure_threshold: int = 3,
+        reset_timeout: float = 30,
+        max_reset_timeout: float = 300,
+    ) -> None:
+        """A circuit breaker per management LIF, so an unreachable site fails fast
+
+        After failure_threshold consecutive requests to a management LIF fail without a
+        response, e.g. a connect timeout or a refused connection, its circuit opens and
+        requests fail straight away with CircuitOpenError. Once reset_timeout has passed a
+        single probe request is let through (half-open). If it succeeds the circuit closes,
+        if it fails the circuit opens again for twice as long, up to max_reset_timeout.
+
+        Error responses from ONTAP don't count as failures, the LIF is reachable.
+
+        :param failure_threshold: Consecutive failures before the circuit opens (default is 3)
+        :type failure_threshold: int
+        :param reset_timeout: Seconds the circuit stays open before the first probe
+            (default is 30)
+        :type reset_timeout: float
+        :param max_reset_timeout: Longest time the circuit stays open after failed probes
+            (default is 300)
+        :type max_reset_timeout: float
+        """
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._max_reset_timeout = max_reset_timeout
+        self._lock = threading.Lock()
+        # management_lif -> [consecutive failures, open until, current reset timeout, probing]
+        self._circuits = {}
+
+    def allow(self, management_lif: str) -> bool:
+        """Returns True if a request to the management LIF may be made now
+
+        While half-open only the first caller is allowed, as the probe. Another probe is
+        allowed if it hasn't reported back within the reset timeout.
+        """
+        now = time.time()
+        with self._lock:
+            circuit = self._circuits.get(management_lif)
+            if circuit is None or circuit[1] is None:
+                return True
+            if now < circuit[1] or (circuit[3] and now < circuit[1] + circuit[2]):
+                return False
+            circuit[3] = True
+        logger.info(f"Probing management LIF '{management_lif}' - circuit half-open")
+        return True
+
+    def check(self, management_lif: str) -> None:
+        """Raises CircuitOpenError unless a request to the management LIF may be made now"""
+        if not self.allow(management_lif):
+            raise CircuitOpenError(
+                f"Circuit open for management LIF '{management_lif}' - not contacting it"
+            )
+
+    def record_success(self, management_lif: str) -> None:
+        with self._lock:
+            circuit = self._circuits.pop(management_lif, None)
+        if circuit is not None and circuit[1] is not None:
+            logger.info(f"Management LIF '{management_lif}' reachable - circuit closed")
+
+    def record_failure(self, management_lif: str) -> None:
+        """Records a request that got no response from the management LIF"""
+        with self._lock:
+            circuit = self._circuits.setdefault(
+                management_lif, [0, None, self._reset_timeout, False]
+            )
+            circuit[0] += 1
+            if circuit[3]:
+                # The probe failed, back off further
+                circuit[2] = min(circuit[2] * 2, self._max_reset_timeout)
+            elif circuit[1] is not None or circuit[0] < self._failure_threshold:
+                return
+            circuit[1] = time.time() + circuit[2]
+            circuit[3] = False
+            reset_timeout = circuit[2]
+        logger.warning(
+            f"Management LIF '{management_lif}' unreachable - circuit open for {reset_timeout:.0f}s"
+        )
+
+    def open_circuits(self) -> List[str]:
+        """Returns the management LIFs whose circuit is currently open or half-open"""
+        with self._lock:
+            return sorted(
+                management_lif
+                for management_lif, circuit in self._circuits.items()
+                if circuit[1] is not None
+            )
@@ -0,0 +1,172 @@
+import hashlib
+import logging
+import threading
+import time
+from typing import Tuple
+
+from netapp_ontap import HostConnection
+from netapp_ontap.host_connection import LoggingAdapter
+
+from .wire_log import WireLog, WireLoggingAdapter
+
+
+logger = logging.getLogger("trident_mcc.netapp_client")
+
+
+def credential_fingerprint(
+    username: str = None, password: str = None, cert: str = None, key: str = None
+) -> str:
+    """Returns a stable fingerprint for a set of ONTAP credentials
+
+    The fingerprint lets us key and compare connections without holding on to another
+    copy of the credentials in the pool keys or writing them to the logs.
+
+    :returns: Hex digest identifying the credentials
+    :rtype: str
+    """
+    digest = hashlib.sha256()
+    for value in (username, password, cert, key):
+        digest.update(str(value or "").encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class ConnectionPool:
+    def __init__(
+        self,
+        idle_timeout: int = 600,
+        connect_timeout: float = None,
+        read_timeout: float = None,
+        max_retries: int = None,
+        wire_log: WireLog = None,
+    ) -> None:
+        """Registry of long lived ONTAP HostConnections keyed by management LIF and credentials
+
+        Each HostConnection keeps its own requests Session, so handing out the same connection
+        for every backend on a management LIF reuses the HTTP keep-alive connections (and the
+        TLS sessions on them) across backends and across reconcile cycles.
+
+        netapp_ontap connects with a 6 second timeout, reads with a 45 second timeout and
+        retries 5 times, so a request to an unreachable site can take minutes. Any of these
+        can be overridden for the pooled connections.
+
+        :param idle_timeout: Seconds a connection can go unused before it is closed and evicted
+            (default is 600)
+        :type idle_timeout: int
+        :param connect_timeout: Seconds allowed to connect to a management LIF, None for the
+            netapp_ontap default (default is None)
+        :type connect_timeout: float
+        :param read_timeout: Seconds allowed between bytes of a response, None for the
+            netapp_ontap default (default is None)
+        :type read_timeout: float
+        :param max_retries: Times a request that failed to connect or read is retried, None
+            for the netapp_ontap default (default is None)
+        :type max_retries: int
+        :param wire_log: Records the requests and responses of the pooled connections
+            (default is None)
+        :type wire_log: trident_mcc.netapp_client.wire_log.WireLog
+        """
+        self._idle_timeout = idle_timeout
+        self._connect_timeout = connect_timeout
+        self._read_timeout = read_timeout
+        self._max_retries = max_retries
+        self._wire_log = wire_log
+        self._lock = threading.Lock()
+        # (management_lif, fingerprint) -> [HostConnection, last used time]
+        self._connections = {}
+
+    def get_connection(
+        self, management_lif: str, **auth_credentials
+    ) -> Tuple[HostConnection, str]:
+        """Returns a pooled HostConnection for the management LIF and credentials, creating it if needed
+
+        :param management_lif: Management address of the ONTAP cluster or SVM
+        :type management_lif: str
+        :param auth_credentials: Either username/password or cert/key
+        :returns: The HostConnection and the fingerprint of the credentials it uses
+        :rtype: Tuple[netapp_ontap.HostConnection, str]
+        """
+        fingerprint = credential_fingerprint(**auth_credentials)
+        now = time.time()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._connections.get((management_lif, fingerprint))
+            if entry is None:
+                logger.debug(f"Creating pooled connection to '{management_lif}'")
+                connection = HostConnection(
+                    host=management_lif, verify=False, **auth_credentials
+                )
+                self._configure_adapter(connection)
+                entry = [connection, now]
+                self._connections[(management_lif, fingerprint)] = entry
+            else:
+                logger.debug(f"Reusing pooled connection to '{management_lif}'")
+                entry[1] = now
+        return entry[0], fingerprint
+
+    def _configure_adapter(self, connection: HostConnection) -> None:
+        """Mounts an adapter with our timeouts, retries and wire log in place of the netapp_ontap default"""
+        if (
+            self._connect_timeout,
+            self._read_timeout,
+            self._max_retries,
+            self._wire_log,
+        ) == (None,) * 4:
+            return
+        default_adapter = LoggingAdapter(connection)
+        max_retries = 5 if self._max_retries is None else self._max_retries
+        if self._wire_log is not None:
+            adapter = WireLoggingAdapter(
+                connection, max_retries=max_retries, wire_log=self._wire_log
+            )
+        else:
+            adapter = LoggingAdapter(connection, max_retries=max_retries)
+        adapter.timeout = (
+            self._connect_timeout or default_adapter.timeout[0],
+            self._read_timeout or default_adapter.timeout[1],
+        )
+        connection.session.mount(connection.origin, adapter)
+
+    def evict(self, management_lif: str, fingerprint: str) -> None:
+        """Closes and removes a connection, e.g. after ONTAP rejected its credentials
+
+        :param management_lif: Management address the connection is for
+        :type management_lif: str
+        :param fingerprint: Fingerprint of the credentials the connection uses
+        :type fingerprint: str
+        """
+        with self._lock:
+            entry = self._connections.pop((management_lif, fingerprint), None)
+        if entry is not None:
+            logger.info(f"Evicted pooled connection to '{management_lif}'")
+            self._close(entry[0])
+
+    def evict_credentials(self, **auth_credentials) -> None:
+        """Closes and removes every connection using the specified credentials
+
+        :param auth_credentials: Either username/password or cert/key
+        """
+        fingerprint = credential_fingerprint(**auth_credentials)
+        with self._lock:
+            keys = [key for key in self._connections if key[1] == fingerprint]
+            entries = [self._connections.pop(key) for key in keys]
+        for key, entry in zip(keys, entries):
+            logger.info(
+                f"Evicted pooled connection to '{key[0]}' - credentials changed"
+            )
+            self._close(entry[0])
+
+    def _evict_idle(self, now: float) -> None:
+        """Removes connections that haven't been used within the idle timeout, call holding the lock"""
+        for key, (connection, last_used) in list(self._connections.items()):
+            if now - last_used > self._idle_timeout:
+                logger.debug(f"Evicting idle pooled connection to '{key[0]}'")
+                del self._connections[key]
+                self._close(connection)
+
+    @staticmethod
+    def _close(connection: HostConnection) -> None:
+        # Don't use connection.session here, it would create a session just to close it
+        session = getattr(connection, "_request_session", None)
+        if session is not None:
+            session.close()
@@ -1,15 +1,27 @@
 import logging
-from socket import SO_VM_SOCKETS_BUFFER_SIZE
+from itertools import islice
+from typing import List
 import time
-from urllib import response
 from netapp_ontap import HostConnection, NetAppRestError, utils
-from netapp_ontap.resources import Svm
+from netapp_ontap.resources import Metrocluster, MetroclusterOperation, Svm
 
-# Enable Debugging of ONTAP
-utils.DEBUG = 1
+from trident_mcc.metrics import cycle_stats
+
+from .circuit_breaker import CircuitBreakers
+from .connection_pool import ConnectionPool, credential_fingerprint
+from .svm_inventory import SvmInventory, SvmInventoryCache
+
+# netapp_ontap reads the same DEBUG environment variable we do, and would then log failed
+# exchanges in full, credentials included. Use the redacted, sampled WireLog instead
+utils.DEBUG = 0
 
 logger = logging.getLogger("trident_mcc.netapp_client")
 
+# The only SVM fields we use, everything else is left on the controller
+SVM_FIELDS = "name,uuid,state,subtype"
+METROCLUSTER_FIELDS = "local.mode,remote.mode"
+METROCLUSTER_OPERATION_FIELDS = "type,state,end_time"
+
 
 class NetAppClient:
     def __init__(
@@ -19,6 +31,9 @@ class NetAppClient:
         password: str = None,
         cert: str = None,
         key: str = None,
+        connection_pool: ConnectionPool = None,
+        svm_inventory_cache: SvmInventoryCache = None,
+        circuit_breakers: CircuitBreakers = None,
     ):
         # Output details we are intialising Client with - don't actually output credentials
         logger.debug(
@@ -40,49 +55,84 @@ class NetAppClient:
             f"Configuring NetApp Connection to Management Lif: {management_lif} "
         )
         self._management_lif = management_lif
+        self._connection_pool = connection_pool
+        self._svm_inventory_cache = svm_inventory_cache
+        self._circuit_breakers = circuit_breakers
+        self._credential_fingerprint = credential_fingerprint(**auth_credentials)
+
+        if connection_pool is not None:
+            self._connection, _ = connection_pool.get_connection(
+                management_lif, **auth_credentials
+            )
+        else:
+            self._connection = HostConnection(
+                host=management_lif, verify=False, **auth_credentials
+            )
 
-        self._connection = HostConnection(
-            host=management_lif, verify=False, **auth_credentials
-        )
+    def _handle_rest_error(self, err: NetAppRestError) -> None:
+        """Evicts our pooled connection if ONTAP rejected the credentials it uses"""
+        if self._connection_pool is not None and err.status_code in (401, 403):
+            logger.warning(
+                f"Authentication failed against '{self._management_lif}' - evicting pooled connection"
+            )
+            self._connection_pool.evict(
+                self._management_lif, self._credential_fingerprint
+            )
 
-    def _get_svm_collection(self):
-        # Get List of SVM's
-        logger.info(
-            f"Retrieving SVM List from Management Address: {self._management_lif} "
-        )
-        with self._connection:
-            response = [svm for svm in Svm.get_collection()]
+    def _record_reachability(self, err: NetAppRestError = None) -> None:
+        """Feeds the circuit breaker - only errors without a response mean the LIF is unreachable"""
+        if self._circuit_breakers is None:
+            return
+        if err is not None and err.status_code is None:
+            self._circuit_breakers.record_failure(self._management_lif)
+        else:
+            self._circuit_breakers.record_success(self._management_lif)
 
-        return response
+    def _get_svm_collection(self, limit: int = None, **query) -> List[dict]:
+        """Queries Management Lif for SVMs returning their name, subtype, state and uuid
 
-    def _get_svm_details(self, svm):
-        """Queries Management Lif for additional SVM details.
+        Only the fields we use are requested, and any query (e.g. name or uuid) is passed
+        to ONTAP so the filtering is done by the controller rather than by us.
 
-        Queries controller for additional SVM details returns name, subtype, state and uuid
+        :param limit: Stop after this many SVMs have been returned (default is None)
+        :type limit: int
+        :param query: ONTAP REST query parameters e.g. name="svm1|svm1-mc"
+        :returns: List of SVM details dicts
+        :rtype: List[dict]
+        """
+        logger.info(
+            f"Retrieving SVM List from Management Address: {self._management_lif} {query or ''}"
+        )
+        if limit is not None:
+            query["max_records"] = limit
+        if self._circuit_breakers is not None:
+            self._circuit_breakers.check(self._management_lif)
+        # Pass the connection explicitly rather than using it as a context manager, the
+        # context is global to netapp_ontap and not safe to share between threads
+        try:
+            svm_collection = Svm.get_collection(
+                connection=self._connection, fields=SVM_FIELDS, **query
+            )
+            response = [
+                {field: getattr(svm, field, None) for field in SVM_FIELDS.split(",")}
+                for svm in islice(svm_collection, limit)
+            ]
+        except NetAppRestError as err:
+            cycle_stats.count_ontap_request(self._management_lif, error=True)
+            self._record_reachability(err)
+            self._handle_rest_error(err)
+            raise err
+        cycle_stats.count_ontap_request(self._management_lif)
+        self._record_reachability()
 
-        :param svm: Svm object from
+        return response
 
-        """
-        with self._connection:
-            svm_details = svm.get()
-            if svm_details.is_err == True:
-                raise RuntimeError("Error Retrieving SVM Details")
-            elif svm_details.is_job == True:
-                # This shouldn't happen - so going to raise error here as I don't handle it yet
-                logger.error("Retrieving SVM details caused job to be created.")
-                raise RuntimeError(
-                    "Retrieving SVM Details returned a job, check NetApp system load"
-                )
-            elif svm_details.is_job == False and svm_details.is_err == False:
-
-                result = {
-                    "name": svm.name,
-                    "subtype": svm.subtype,
-                    "state": svm.state,
-                    "uuid": svm.uuid,
-                }
-
-        return result or None
+    def _get_svm_inventory(self) -> SvmInventory:
+        """Returns the shared SVM inventory for this management lif and credentials"""
+        return self._svm_inventory_cache.get(
+            (self._management_lif, self._credential_fingerprint),
+            self._get_svm_collection,
+        )
 
     def get_svm(self):
         """Gets Single SVM assuming there is onyl one resolvable."""
@@ -93,18 +143,21 @@ class NetAppClient:
 
         start_time = time.time()
 
-        svm_list = self._get_svm_collection()
+        if self._svm_inventory_cache is not None:
+            svm_list = self._get_svm_inventory().svms
+        else:
+            # We only need to know if there is more than one
+            svm_list = self._get_svm_collection(limit=2)
 
         if len(svm_list) > 1:
             logger.error(
                 "No SVM Specified and get_collection return more than 1 SVM. Try specifying SVM Name in TridentBackendConfig or use SVM Management Lif instead of cluster."
             )
         elif len(svm_list) == 1:
-            svm = svm_list[0]
+            response = svm_list[0]
             logger.info(
-                f"Found a single SVM '{svm.name}' on management interface. Retieving Details"
+                f"Found a single SVM '{response['name']}' on management interface."
             )
-            response = self._get_svm_details(svm)
         end_time = time.time()
         logger.debug(f"get_svm execution took: {end_time - start_time:.2f}s")
 
@@ -120,20 +173,32 @@ class NetAppClient:
 
         start_time = time.time()
 
+        if self._svm_inventory_cache is not None:
+            response = self._get_svm_inventory().get_by_name(svm_name)
+            end_time = time.time()
+            logger.debug(
+                f"get_svm_by_name execution took: {end_time - start_time:.2f}s"
+            )
+            return response
+
         # Make sure the SVM name base is what we use (in case we have already appended the new MetroCluster Name -mc)
         if svm_name[-3:].lower() == "-mc":
-            svm_base_name = svm_name[:-3].lower()
+            svm_query_name = svm_name[:-3]
         else:
-            svm_base_name = svm_name.lower()
+            svm_query_name = svm_name
+        svm_base_name = svm_query_name.lower()
 
-        svm_list = self._get_svm_collection()
+        # Ask ONTAP for both the base and MetroCluster name, then check case the same way we always have
+        svm_list = self._get_svm_collection(
+            name=f"{svm_query_name}|{svm_query_name}-mc"
+        )
 
         for svm in svm_list:
             if (
-                svm.name.lower() == svm_base_name
-                or svm.name.lower() == svm_base_name + "-mc"
+                svm["name"].lower() == svm_base_name
+                or svm["name"].lower() == svm_base_name + "-mc"
             ):
-                response = self._get_svm_details(svm)
+                response = svm
 
         end_time = time.time()
         logger.debug(f"get_svm_by_name execution took: {end_time - start_time:.2f}s")
@@ -150,13 +215,78 @@ class NetAppClient:
 
         start_time = time.time()
 
-        svm_list = self._get_svm_collection()
+        if self._svm_inventory_cache is not None:
+            response = self._get_svm_inventory().get_by_uuid(svm_uuid)
+        else:
+            svm_list = self._get_svm_collection(uuid=svm_uuid)
 
-        for svm in svm_list:
-            if svm.uuid == svm_uuid:
-                response = self._get_svm_details(svm)
+            for svm in svm_list:
+                if svm["uuid"] == svm_uuid:
+                    response = svm
 
         end_time = time.time()
         logger.debug(f"get_svm_by_uuid execution took: {end_time - start_time:.2f}s")
 
         return response or None
+
+    def invalidate_svm_inventory(self) -> None:
+        """Drops the shared SVM inventory for this management lif so the next lookup queries ONTAP"""
+        if self._svm_inventory_cache is not None:
+            self._svm_inventory_cache.invalidate(
+                (self._management_lif, self._credential_fingerprint)
+            )
+
+    def get_metrocluster_state(self) -> dict:
+        """Returns the MetroCluster mode of both sites and the latest switchover or switchback
+
+        Only the fields we use are requested, so this is two small GETs. SVM management LIFs
+        and clusters without MetroCluster can't report this, they return None.
+
+        :returns: Dict of local_mode, remote_mode and operation - the latest switchover or
+            switchback as a dict of type, state and end_time, or None if there hasn't been one
+        :rtype: dict
+        """
+        start_time = time.time()
+        if self._circuit_breakers is not None and not self._circuit_breakers.allow(
+            self._management_lif
+        ):
+            return None
+        metrocluster = Metrocluster()
+        metrocluster.set_connection(self._connection)
+        try:
+            metrocluster.get(fields=METROCLUSTER_FIELDS)
+            cycle_stats.count_ontap_request(self._management_lif)
+            operations = MetroclusterOperation.get_collection(
+                connection=self._connection,
+                fields=METROCLUSTER_OPERATION_FIELDS,
+                type="switchover|switchback",
+                order_by="start_time desc",
+                max_records=1,
+            )
+            operation = next(islice(operations, 1), None)
+            cycle_stats.count_ontap_request(self._management_lif)
+        except NetAppRestError as err:
+            cycle_stats.count_ontap_request(self._management_lif, error=True)
+            self._record_reachability(err)
+            logger.debug(
+                f"Unable to retrieve MetroCluster state from '{self._management_lif}' - {err}"
+            )
+            return None
+
+        self._record_reachability()
+
+        response = {
+            "local_mode": getattr(getattr(metrocluster, "local", None), "mode", None),
+            "remote_mode": getattr(getattr(metrocluster, "remote", None), "mode", None),
+            "operation": None,
+        }
+        if operation is not None:
+            response["operation"] = {
+                field: getattr(operation, field, None)
+                for field in METROCLUSTER_OPERATION_FIELDS.split(",")
+            }
+        logger.debug(
+            f"get_metrocluster_state execution took: {time.time() - start_time:.2f}s - {response}"
+        )
+
+        return response
@@ -0,0 +1,103 @@
+import logging
+import threading
+import time
+from typing import Callable, Dict, Hashable, List
+
+
+logger = logging.getLogger("trident_mcc.netapp_client")
+
+
+def normalize_svm_name(svm_name: str) -> str:
+    """Returns the base SVM name - lower case without the MetroCluster '-mc' suffix"""
+    svm_name = svm_name.lower()
+    if svm_name[-3:] == "-mc":
+        return svm_name[:-3]
+    return svm_name
+
+
+class SvmInventory:
+    def __init__(self, svms: List[dict]) -> None:
+        """Point in time list of the SVMs on a cluster, indexed by uuid and base name
+
+        :param svms: SVM details dicts as returned by NetAppClient._get_svm_collection
+        :type svms: List[dict]
+        """
+        self.svms = svms
+        self.fetched_at = time.time()
+        self._by_uuid = {svm["uuid"]: svm for svm in svms}
+        self._by_base_name = {}
+        for svm in svms:
+            self._by_base_name.setdefault(normalize_svm_name(svm["name"]), []).append(
+                svm
+            )
+
+    def get_by_uuid(self, svm_uuid: str) -> dict:
+        return self._by_uuid.get(svm_uuid)
+
+    def get_by_name(self, svm_name: str) -> dict:
+        """Returns the SVM matching the base name or its MetroCluster '-mc' name
+
+        If both exist the last one listed wins, the same as scanning the collection did.
+        """
+        matches = self._by_base_name.get(normalize_svm_name(svm_name))
+        return matches[-1] if matches else None
+
+
+class SvmInventoryCache:
+    def __init__(self, ttl: int = 30) -> None:
+        """Shares SVM inventories between all the backends that use the same cluster
+
+        The first backend to need a cluster's inventory fetches it, any other backend
+        asking for it at the same time waits for that fetch rather than starting its own.
+        Inventories are reused until they are older than the ttl, so with a ttl shorter
+        than the polling interval each cluster is queried once per reconcile pass.
+
+        :param ttl: Maximum age in seconds of an inventory before it is fetched again
+            (default is 30)
+        :type ttl: int
+        """
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._inventories = {}
+
+    def get(self, key: Hashable, fetch: Callable[[], List[dict]]) -> SvmInventory:
+        """Returns the cached inventory for key, calling fetch to populate it if missing or expired
+
+        :param key: Identifies the cluster, e.g. (management_lif, credential fingerprint)
+        :type key: Hashable
+        :param fetch: Callable returning the SVM list for the cluster
+        :type fetch: Callable[[], List[dict]]
+        :returns: The SVM inventory for the cluster
+        :rtype: SvmInventory
+        """
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            inventory = self._inventories.get(key)
+            if inventory is None or time.time() - inventory.fetched_at > self._ttl:
+                inventory = SvmInventory(fetch())
+                self._inventories[key] = inventory
+                logger.debug(
+                    f"Refreshed SVM inventory for '{key[0] if isinstance(key, tuple) else key}' - {len(inventory.svms)} SVMs"
+                )
+        return inventory
+
+    def invalidate(self, key: Hashable) -> None:
+        """Drops the inventory for key so the next lookup fetches it again"""
+        self._inventories.pop(key, None)
+
+    def invalidate_management_lif(self, management_lif: str) -> None:
+        """Drops every inventory fetched through management_lif, whatever credentials were used"""
+        for key in list(self._inventories):
+            if isinstance(key, tuple) and key[0] == management_lif:
+                self._inventories.pop(key, None)
+
+    def inventories(self) -> Dict[str, List[dict]]:
+        """Returns the SVMs of each cluster held, by management LIF, whatever their age"""
+        return {
+            key[0]: inventory.svms
+            for key, inventory in list(self._inventories.items())
+            if isinstance(key, tuple)
+        }
@@ -0,0 +1,215 @@
+import json
+import logging
+import random
+import re
+import threading
+import time
+from collections import deque
+from typing import Iterable, List, Optional, Union
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import requests
+from netapp_ontap.host_connection import LoggingAdapter
+
+
+logger = logging.getLogger("trident_mcc.netapp_client.wire")
+
+REDACTED = "<redacted>"
+# Body fields and query parameters whose values are never kept
+SENSITIVE_NAMES = re.compile(r"pass|secret|token|key|cert|auth|cookie", re.IGNORECASE)
+
+
+def _redact(value):
+    if isinstance(value, dict):
+        return {
+            name: REDACTED if SENSITIVE_NAMES.search(name) else _redact(item)
+            for name, item in value.items()
+        }
+    if isinstance(value, list):
+        return [_redact(item) for item in value]
+    return value
+
+
+class WireLog:
+    def __init__(
+        self,
+        sample_rate: float = 0.01,
+        management_lifs: Iterable[str] = None,
+        size: int = 100,
+        max_body: int = 4096,
+    ) -> None:
+        """Keeps the last ONTAP request and response exchanges, for debugging on demand
+
+        Replaces netapp_ontap's DEBUG flag, which formats and logs every failed exchange with
+        its credentials. Failed exchanges, an error status or no response, are always kept.
+        Successful ones are sampled at sample_rate. Kept exchanges go in a ring buffer of the
+        last size, see dump, and are logged as one line of JSON at DEBUG level to the
+        trident_mcc.netapp_client.wire logger.
+
+        Only the method, path, status, duration and bodies are kept, never the headers, so
+        the Authorization header is never kept. Body fields and query parameters whose names
+        look like credentials, e.g. password or token, are redacted, and bodies are cut to
+        max_body characters.
+
+        :param sample_rate: Fraction of successful exchanges kept (default is 0.01)
+        :type sample_rate: float
+        :param management_lifs: Only keep exchanges with these management LIFs, None for
+            every management LIF (default is None)
+        :type management_lifs: Iterable[str]
+        :param size: Number of exchanges kept (default is 100)
+        :type size: int
+        :param max_body: Characters of each body kept (default is 4096)
+        :type max_body: int
+        """
+        self._sample_rate = sample_rate
+        self._management_lifs = (
+            frozenset(management_lifs) if management_lifs is not None else None
+        )
+        self._max_body = max_body
+        # Reentrant, as dump may be called from a signal handler interrupting record
+        self._lock = threading.RLock()
+        self._exchanges = deque(maxlen=size)
+
+    def wants(self, management_lif: str) -> bool:
+        """Returns True if exchanges with the management LIF may be kept"""
+        return self._management_lifs is None or management_lif in self._management_lifs
+
+    def record(
+        self,
+        management_lif: str,
+        method: str,
+        path: str,
+        status: int = None,
+        duration: float = 0,
+        request_body: Union[str, bytes] = None,
+        response_body: Union[str, bytes] = None,
+        error: str = None,
+    ) -> None:
+        """Keeps the exchange if it failed, or if it is sampled
+
+        :param management_lif: Management LIF the request was sent to
+        :type management_lif: str
+        :param method: HTTP method e.g. GET
+        :type method: str
+        :param path: Request path including the query string
+        :type path: str
+        :param status: HTTP status of the response, None if there wasn't one (default is None)
+        :type status: int
+        :param duration: Seconds from sending the request to the response or error
+            (default is 0)
+        :type duration: float
+        :param request_body: Body sent (default is None)
+        :type request_body: Union[str, bytes]
+        :param response_body: Body received (default is None)
+        :type response_body: Union[str, bytes]
+        :param error: Why there was no response (default is None)
+        :type error: str
+        """
+        if not self.wants(management_lif):
+            return
+        failed = error is not None or status is None or status >= 400
+        if not failed and random.random() >= self._sample_rate:
+            return
+        exchange = {
+            "time": time.time(),
+            "management_lif": management_lif,
+            "method": method,
+            "path": self._redact_path(path),
+            "status": status,
+            "duration": round(duration, 4),
+            "request_body": self._redact_body(request_body),
+            "response_body": self._redact_body(response_body),
+            "error": error,
+        }
+        with self._lock:
+            self._exchanges.append(exchange)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(json.dumps(exchange))
+
+    def dump(self, management_lif: str = None) -> List[dict]:
+        """Returns the kept exchanges, oldest first
+
+        :param management_lif: Only return exchanges with this management LIF
+            (default is None)
+        :type management_lif: str
+        :rtype: List[dict]
+        """
+        with self._lock:
+            exchanges = list(self._exchanges)
+        return [
+            exchange
+            for exchange in exchanges
+            if management_lif is None or exchange["management_lif"] == management_lif
+        ]
+
+    @staticmethod
+    def _redact_path(path: str) -> str:
+        parts = urlsplit(path)
+        if not parts.query:
+            return path
+        query = urlencode(
+            [
+                (name, REDACTED if SENSITIVE_NAMES.search(name) else value)
+                for name, value in parse_qsl(parts.query, keep_blank_values=True)
+            ]
+        )
+        return f"{parts.path}?{query}"
+
+    def _redact_body(self, body: Union[str, bytes]) -> Optional[str]:
+        if not body:
+            return None
+        if isinstance(body, bytes):
+            body = body.decode("utf-8", errors="replace")
+        try:
+            body = json.dumps(_redact(json.loads(body)), separators=(",", ":"))
+        except ValueError:
+            # Not JSON, don't keep something we can't redact
+            return f"<{len(body)} characters>"
+        if len(body) > self._max_body:
+            return body[: self._max_body] + f"...<{len(body)} characters>"
+        return body
+
+
+class WireLoggingAdapter(LoggingAdapter):
+    """LoggingAdapter that records each exchange with its HostConnection's host in a WireLog"""
+
+    def __init__(self, host_connection, *args, wire_log: WireLog = None, **kwargs):
+        super().__init__(host_connection, *args, **kwargs)
+        self._wire_log = wire_log
+
+    def send(
+        self,
+        request,
+        stream=False,
+        timeout=None,
+        verify=True,
+        cert=None,
+        proxies=None,
+    ) -> requests.Response:
+        management_lif = self.host_connection.host
+        if not self._wire_log.wants(management_lif):
+            return super().send(request, stream, timeout, verify, cert, proxies)
+        start_time = time.time()
+        try:
+            response = super().send(request, stream, timeout, verify, cert, proxies)
+        except requests.RequestException as err:
+            self._wire_log.record(
+                management_lif,
+                request.method,
+                request.path_url,
+                duration=time.time() - start_time,
+                request_body=request.body,
+                error=str(err),
+            )
+            raise
+        self._wire_log.record(
+            management_lif,
+            request.method,
+            request.path_url,
+            status=response.status_code,
+            duration=time.time() - start_time,
+            request_body=request.body,
+            # A streamed body hasn't been read, and reading it would consume it
+            response_body=None if stream else response.content,
+        )
+        return response
@@ -0,0 +1,60 @@
+import time
+
+# MetroCluster modes where one site has only partly switched over or back
+METROCLUSTER_TRANSITION_MODES = (
+    "partial_switchover",
+    "partial_switchback",
+    "waiting_for_switchback",
+)
+
+
+def metrocluster_in_transition(metrocluster_state: dict, settle_period: float) -> bool:
+    """Returns True if a switchover or switchback is in progress or completed within the settle period
+
+    :param metrocluster_state: As returned by NetAppClient.get_metrocluster_state
+    :type metrocluster_state: dict
+    :param settle_period: Seconds after a switchover or switchback completes that it still
+        counts as in transition
+    :type settle_period: float
+    :rtype: bool
+    """
+    if (
+        metrocluster_state["local_mode"] in METROCLUSTER_TRANSITION_MODES
+        or metrocluster_state["remote_mode"] in METROCLUSTER_TRANSITION_MODES
+    ):
+        return True
+    operation = metrocluster_state["operation"]
+    if operation is None:
+        return False
+    if operation["state"] == "in_progress":
+        return True
+    return (
+        operation["end_time"] is not None
+        and time.time() - operation["end_time"].timestamp() < settle_period
+    )
+
+
+def next_polling_interval(
+    polling_interval: float,
+    in_transition: bool,
+    min_polling_interval: float,
+    max_polling_interval: float,
+) -> float:
+    """Returns the time until the next poll, given whether a MetroCluster is in transition
+
+    While in transition every poll is min_polling_interval apart, once stable the interval
+    doubles each poll until it is back at max_polling_interval.
+
+    :param polling_interval: Time until this poll
+    :type polling_interval: float
+    :param in_transition: True if any MetroCluster is in transition
+    :type in_transition: bool
+    :param min_polling_interval: Time between polls while in transition
+    :type min_polling_interval: float
+    :param max_polling_interval: Time between polls once stable
+    :type max_polling_interval: float
+    :rtype: float
+    """
+    if in_transition:
+        return min_polling_interval
+    return min(polling_interval * 2, max_polling_interval)
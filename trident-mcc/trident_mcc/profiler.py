@@ -0,0 +1,204 @@
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Callable, Dict, Optional
+
+
+logger = logging.getLogger("trident_mcc.profiler")
+
+# The innermost of these functions on a sampled stack names its phase, matching the phases
+# timed on /metrics. Taken from the stack rather than recorded by time_phase, so it is right
+# for the async engine too, where one thread interleaves every backend's phases.
+PHASE_FUNCTIONS = {
+    "list_trident_backends": "k8s_list",
+    "get_trident_backends": "k8s_list",
+    "watch_trident_backends": "k8s_watch",
+    "get_na_connection_properties": "secret_fetch",
+    "lookup_svm": "ontap_lookup",
+    "_lookup_svm_async": "ontap_lookup",
+    "_hedged_lookup_svm_async": "ontap_lookup",
+    "_patch_backend_with_svmname": "patch",
+    "adapt_polling_interval": "metrocluster_state",
+}
+# Where threads of ours sit between cycles, stacks ending here aren't counted
+IDLE_FRAMES = {("scheduler.py", "wait"), ("sharding.py", "_renew_loop")}
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Requests being served by the healthcheck app aren't part of a cycle
+EXCLUDED_FILES = {os.path.join(PACKAGE_DIR, "healthz.py")}
+
+
+class CycleProfiler:
+    def __init__(self, interval: float = 0.01) -> None:
+        """Samples the stacks of every thread while the next reconcile cycles run
+
+        Nothing runs until a profile is requested, the only cost then is checking an int
+        at the start of each cycle. Once requested, a thread takes a wall-clock sample of
+        every thread running trident_mcc code each interval, for the requested number of
+        cycles. Time waiting on the API Server or ONTAP shows up as well as CPU time, which
+        is usually where a slow sweep's time goes.
+
+        Each sample is attributed to a phase from the functions on its stack, see
+        PHASE_FUNCTIONS, anything else is 'other'.
+
+        :param interval: Seconds between samples (default is 0.01)
+        :type interval: float
+        """
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._requested_cycles = 0
+        self._running_cycles = 0
+        self._profiled_cycles = 0
+        self._samples = Counter()
+        self._started_at = None
+        self._thread = None
+        self._stopped = threading.Event()
+        # The last completed profile - see result()
+        self._result = None
+
+    def request(self, cycles: int = 1) -> None:
+        """Profiles the next cycles, replacing any profile in progress
+
+        :param cycles: Number of cycles to profile (default is 1)
+        :type cycles: int
+        :raises ValueError: If cycles is less than 1
+        """
+        if cycles < 1:
+            raise ValueError(f"Cycles to profile ({cycles}) must be at least 1")
+        with self._lock:
+            self._requested_cycles = cycles
+            self._profiled_cycles = 0
+            self._samples = Counter()
+        logger.info(f"Profiling the next {cycles} reconcile cycle(s)")
+
+    @property
+    def in_progress(self) -> bool:
+        return self._requested_cycles > 0
+
+    def profiled(self, func: Callable) -> Callable:
+        """Decorator marking func as a cycle, sampling it if a profile was requested"""
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not self._requested_cycles:
+                return func(*args, **kwargs)
+            self._cycle_started()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._cycle_finished()
+
+        return wrapper
+
+    def _cycle_started(self) -> None:
+        with self._lock:
+            self._running_cycles += 1
+            if self._thread is None:
+                self._started_at = time.time()
+                self._stopped.clear()
+                self._thread = threading.Thread(
+                    target=self._sample_loop, name="cycle-profiler", daemon=True
+                )
+                self._thread.start()
+
+    def _cycle_finished(self) -> None:
+        with self._lock:
+            self._running_cycles -= 1
+            if not self._requested_cycles:
+                # Another request was completed by a cycle that started alongside this one
+                return
+            self._profiled_cycles += 1
+            if self._profiled_cycles < self._requested_cycles:
+                return
+            self._requested_cycles = 0
+            thread, self._thread = self._thread, None
+            self._stopped.set()
+        if thread is not None:
+            thread.join()
+        with self._lock:
+            self._result = {
+                "cycles": self._profiled_cycles,
+                "interval": self._interval,
+                "started_at": self._started_at,
+                "finished_at": time.time(),
+                "samples": self._samples,
+            }
+        logger.info(
+            f"Profile of {self._profiled_cycles} reconcile cycle(s) complete - {self._format_phases(self.phases())}"
+        )
+
+    def _sample_loop(self) -> None:
+        own_thread = threading.get_ident()
+        while not self._stopped.wait(self._interval):
+            if not self._running_cycles:
+                continue
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                sample = self._sample(frame)
+                if sample is not None:
+                    self._samples[sample] += 1
+
+    def _sample(self, frame) -> Optional[tuple]:
+        """Returns (phase, frames outermost first) for a thread running our code, else None"""
+        frames = []
+        phase = None
+        innermost = None
+        while frame is not None:
+            code = frame.f_code
+            frames.append(code)
+            if code.co_filename.startswith(PACKAGE_DIR):
+                if code.co_filename in EXCLUDED_FILES:
+                    return None
+                if innermost is None:
+                    innermost = code
+                if phase is None:
+                    phase = PHASE_FUNCTIONS.get(code.co_name)
+            frame = frame.f_back
+        if (
+            innermost is None
+            or (os.path.basename(innermost.co_filename), innermost.co_name)
+            in IDLE_FRAMES
+        ):
+            return None
+        return phase or "other", tuple(reversed(frames))
+
+    def result(self) -> Optional[dict]:
+        """Returns the last completed profile, None if there isn't one yet"""
+        return self._result
+
+    def phases(self) -> Dict[str, float]:
+        """Returns the sampled thread seconds spent in each phase in the last completed profile"""
+        if self._result is None:
+            return {}
+        phases = Counter()
+        for (phase, _), count in self._result["samples"].items():
+            phases[phase] += count * self._result["interval"]
+        return {phase: round(seconds, 3) for phase, seconds in phases.most_common()}
+
+    def collapsed(self) -> str:
+        """Returns the last completed profile as collapsed stacks, e.g. for flamegraph.pl
+
+        Each line is the phase then the frames outermost first, separated by ';', and the
+        number of samples. Frames are 'module:function'.
+        """
+        if self._result is None:
+            return ""
+        lines = []
+        for (phase, frames), count in self._result["samples"].most_common():
+            stack = ";".join(
+                [phase]
+                + [
+                    f"{os.path.splitext(os.path.basename(code.co_filename))[0]}:{code.co_name}"
+                    for code in frames
+                ]
+            )
+            lines.append(f"{stack} {count}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _format_phases(phases: Dict[str, float]) -> str:
+        return ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in phases.items())
@@ -0,0 +1,1141 @@
+import asyncio
+import signal
+import socket
+import sys
+import os
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import requests
+from requests.exceptions import ConnectionError
+from netapp_ontap import NetAppRestError
+
+import json
+import trident_mcc.k8s_client as k8s_client
+import trident_mcc.netapp_client as na_client
+from trident_mcc.hedging import HedgedLookups, choose_svm, lookup_svm
+from trident_mcc.lif_queues import map_per_lif
+from trident_mcc.metrics import cycle_stats, repair_tracker
+from trident_mcc.polling import metrocluster_in_transition, next_polling_interval
+from trident_mcc.scheduler import ReconcileScheduler
+from trident_mcc.sharding import ShardMembership
+from trident_mcc.snapshot import (
+    ConfigMapSnapshotStore,
+    FileSnapshotStore,
+    StateSnapshot,
+)
+from trident_mcc.triggers import ReconcileScope, ReconcileTriggers
+from trident_mcc.models import ReconcileResult, RepairReport, StateEnum, StatusUpdate
+from trident_mcc.profiler import CycleProfiler
+from trident_mcc.watcher import BackendWatcher
+
+# What do we want to configure
+# ---------------------------
+"""
+Debug Logging
+Polling Interval = Default 300 (5 mins)
+Trident Namespace = Default trident - potentially auto-detect, but better to restrict
+Backend Label/Field Selector = Default None - Restrict which TridentBackendConfigs are managed
+List Page Size = Default None (single request) - Page size used when listing TridentBackendConfigs
+Discovery Cache File = Default None (dynamic client default in temp dir) - Persisted API discovery cache
+ONTAP Connection Idle Timeout = Default 600 - Seconds before an unused pooled ONTAP connection is closed
+SVM Inventory TTL = Default 30 - Seconds a cluster's SVM list is shared between backends, 0 to disable
+Secret Cache TTL = Default 300 - Seconds decoded backend credentials are reused before the Secret is checked again
+K8s API QPS = Default 100 - Requests per second made to the API Server, failover patches first, 0 for no limit
+K8s API Burst = Default 200 - Requests allowed in a burst above K8S_API_QPS
+Max Workers = Default 1 (serial) - Number of backends reconciled in parallel
+Max Workers per LIF = Default 2 - Number of backends reconciled in parallel against one management LIF
+Adaptive Polling = Poll every MIN_POLLING_INTERVAL during MetroCluster switchover/switchback, backing off to POLLING_INTERVAL
+Min Polling Interval = Default 10 - Shortest time between polls with ADAPTIVE_POLLING
+MetroCluster Settle Period = Default 300 - Seconds after a switchover/switchback completes that we keep polling quickly
+Async Engine = Reconcile backends on an asyncio event loop instead of worker threads
+ONTAP Request Timeout = Default 30 - Seconds a single ONTAP request may take, for the synchronous client the longest wait for a response
+ONTAP Connect Timeout = Default 5 - Seconds allowed to connect to a management LIF
+ONTAP Max Retries = Default 1 - Times an ONTAP request that failed to connect or read is retried
+Circuit Breaker Threshold = Default 3 - Consecutive unanswered requests before a management LIF is skipped, 0 to disable
+Circuit Breaker Reset = Default 30 - Seconds before a skipped management LIF is probed again, doubling up to POLLING_INTERVAL
+Polling Jitter = Default 0.1 - Fraction polls and retries are randomly varied by
+Failed Retry Interval = Default 30 - Seconds before a failed backend is retried on its own, 0 to wait for the next poll
+Trigger Debounce = Default 2 - Seconds without a new reconcile request before a triggered pass starts
+Trigger Max Delay = Default 10 - Maximum seconds a reconcile request waits for a burst of requests to end
+Watch Mode = Reconcile on TridentBackendConfig changes, POLLING_INTERVAL becomes the resync period
+Sharding = Split backends between replicas by management LIF, using a Lease per replica
+Shard Lease Duration = Default 15 - Seconds without a renewal before a replica's management LIFs move to the others
+Pod Name = Default hostname - Identity of this replica in its shard Lease
+State Snapshot File = Default None - File the last known state is saved to after each sweep and loaded from at startup
+State Snapshot ConfigMap = Default None - ConfigMap to save the last known state to instead, survives the pod being rescheduled
+Profile Cycles = Default 0 - Number of reconcile cycles to profile from startup, see CycleProfiler
+Profile Interval = Default 0.01 - Seconds between the profiler's stack samples
+ONTAP Wire Log Sample Rate = Default 0 (off) - Fraction of successful ONTAP exchanges kept in the wire log, failed ones are always kept
+ONTAP Wire Log LIFs = Default None (all) - Comma separated management LIFs whose exchanges are kept
+ONTAP Wire Log Size = Default 100 - Number of recent exchanges kept, dumped on SIGUSR1 or GET /debug/ontap_wire
+Unified Runtime = Read by healthz - run this loop inside the healthcheck app instead of its own process
+Repair History Size = Read by healthz - Default 100 - Number of recent failover repairs served on /repairs
+
+"""
+# TODO: Validation of environment options
+DEBUG = os.getenv("DEBUG", None)
+POLLING_INTERVAL = int(os.getenv("POLLING_INTERVAL", 300))
+TRIDENT_NAMESPACE = os.getenv("TRIDENT_NAMESPACE", "trident")
+KUBE_CONFIG_LOCATION = os.getenv("KUBE_CONFIG_LOCATION", None)
+WATCH_MODE = os.getenv("WATCH_MODE", None)
+BACKEND_LABEL_SELECTOR = os.getenv("BACKEND_LABEL_SELECTOR", None)
+BACKEND_FIELD_SELECTOR = os.getenv("BACKEND_FIELD_SELECTOR", None)
+LIST_PAGE_SIZE = int(os.getenv("LIST_PAGE_SIZE", 0)) or None
+DISCOVERY_CACHE_FILE = os.getenv("DISCOVERY_CACHE_FILE", None)
+ONTAP_CONNECTION_IDLE_TIMEOUT = int(os.getenv("ONTAP_CONNECTION_IDLE_TIMEOUT", 600))
+SVM_INVENTORY_TTL = int(os.getenv("SVM_INVENTORY_TTL", 30))
+SECRET_CACHE_TTL = int(os.getenv("SECRET_CACHE_TTL", 300))
+K8S_API_QPS = float(os.getenv("K8S_API_QPS", 100))
+K8S_API_BURST = int(os.getenv("K8S_API_BURST", 200))
+MAX_WORKERS = int(os.getenv("MAX_WORKERS", 1))
+MAX_WORKERS_PER_LIF = int(os.getenv("MAX_WORKERS_PER_LIF", 2))
+ASYNC_ENGINE = os.getenv("ASYNC_ENGINE", None)
+ADAPTIVE_POLLING = os.getenv("ADAPTIVE_POLLING", None)
+MIN_POLLING_INTERVAL = int(os.getenv("MIN_POLLING_INTERVAL", 10))
+METROCLUSTER_SETTLE_PERIOD = int(os.getenv("METROCLUSTER_SETTLE_PERIOD", 300))
+POLLING_JITTER = float(os.getenv("POLLING_JITTER", 0.1))
+FAILED_RETRY_INTERVAL = int(os.getenv("FAILED_RETRY_INTERVAL", 30))
+TRIGGER_DEBOUNCE = float(os.getenv("TRIGGER_DEBOUNCE", 2))
+TRIGGER_MAX_DELAY = float(os.getenv("TRIGGER_MAX_DELAY", 10))
+ONTAP_REQUEST_TIMEOUT = int(os.getenv("ONTAP_REQUEST_TIMEOUT", 30))
+ONTAP_CONNECT_TIMEOUT = float(os.getenv("ONTAP_CONNECT_TIMEOUT", 5))
+ONTAP_MAX_RETRIES = int(os.getenv("ONTAP_MAX_RETRIES", 1))
+CIRCUIT_BREAKER_THRESHOLD = int(os.getenv("CIRCUIT_BREAKER_THRESHOLD", 3))
+CIRCUIT_BREAKER_RESET = float(os.getenv("CIRCUIT_BREAKER_RESET", 30))
+SHARDING = os.getenv("SHARDING", None)
+SHARD_LEASE_DURATION = int(os.getenv("SHARD_LEASE_DURATION", 15))
+POD_NAME = os.getenv("POD_NAME", socket.gethostname())
+STATE_SNAPSHOT_FILE = os.getenv("STATE_SNAPSHOT_FILE", None)
+STATE_SNAPSHOT_CONFIGMAP = os.getenv("STATE_SNAPSHOT_CONFIGMAP", None)
+PROFILE_CYCLES = int(os.getenv("PROFILE_CYCLES", 0))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", 0.01))
+ONTAP_WIRE_LOG_SAMPLE_RATE = float(os.getenv("ONTAP_WIRE_LOG_SAMPLE_RATE", 0))
+ONTAP_WIRE_LOG_LIFS = os.getenv("ONTAP_WIRE_LOG_LIFS", None)
+ONTAP_WIRE_LOG_SIZE = int(os.getenv("ONTAP_WIRE_LOG_SIZE", 100))
+
+
+###
+# Initialise logging
+###
+# Check Debug environment variable to configure logging level
+if DEBUG:
+    loggerlevel = logging.DEBUG
+    app_debug = True
+else:
+    loggerlevel = logging.INFO
+    app_debug = False
+
+# Create Logger with Applicaiton Name
+logger = logging.getLogger("trident_mcc")
+# Set Level based on DEBUG environment Variable
+logger.setLevel(loggerlevel)
+ch = logging.StreamHandler()  # Std Err Logging
+# Format Log Output - 2021-01-23 00:00:00:trident_mcc.module:INFO - Message
+log_formatter = logging.Formatter(
+    "%(asctime)s:%(name)s.%(module)s:%(levelname)s - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+ch.setFormatter(log_formatter)
+logger.addHandler(ch)
+###
+
+
+# Recent ONTAP exchanges, kept for debugging - off unless a sample rate is set
+if ONTAP_WIRE_LOG_SAMPLE_RATE > 0:
+    wire_log = na_client.WireLog(
+        sample_rate=ONTAP_WIRE_LOG_SAMPLE_RATE,
+        management_lifs=(
+            [lif.strip() for lif in ONTAP_WIRE_LOG_LIFS.split(",") if lif.strip()]
+            if ONTAP_WIRE_LOG_LIFS
+            else None
+        ),
+        size=ONTAP_WIRE_LOG_SIZE,
+    )
+else:
+    wire_log = None
+# ONTAP connections are reused across backends and cycles
+connection_pool = na_client.ConnectionPool(
+    idle_timeout=ONTAP_CONNECTION_IDLE_TIMEOUT,
+    connect_timeout=ONTAP_CONNECT_TIMEOUT,
+    read_timeout=ONTAP_REQUEST_TIMEOUT,
+    max_retries=ONTAP_MAX_RETRIES,
+    wire_log=wire_log,
+)
+# Management LIFs that stop responding, e.g. a site that is down, are skipped until they answer a probe
+if CIRCUIT_BREAKER_THRESHOLD > 0:
+    circuit_breakers = na_client.CircuitBreakers(
+        failure_threshold=CIRCUIT_BREAKER_THRESHOLD,
+        reset_timeout=CIRCUIT_BREAKER_RESET,
+        max_reset_timeout=max(CIRCUIT_BREAKER_RESET, POLLING_INTERVAL),
+    )
+else:
+    circuit_breakers = None
+# SVM lists are shared between backends on the same cluster, 0 disables this and queries per backend
+if SVM_INVENTORY_TTL > 0:
+    svm_inventory_cache = na_client.SvmInventoryCache(ttl=SVM_INVENTORY_TTL)
+else:
+    svm_inventory_cache = None
+
+# Samples where the time goes in the next cycles, requested by PROFILE_CYCLES or POST /debug/profile
+cycle_profiler = CycleProfiler(interval=PROFILE_INTERVAL)
+if PROFILE_CYCLES > 0:
+    cycle_profiler.request(PROFILE_CYCLES)
+
+# Reconcile requests from the healthz app, e.g. POST /reconcile or EMS events
+reconcile_triggers = ReconcileTriggers(
+    debounce=TRIGGER_DEBOUNCE, max_delay=TRIGGER_MAX_DELAY
+)
+# Decides when the loop runs next - polls, triggers and retries of failed backends
+scheduler = ReconcileScheduler(
+    reconcile_triggers,
+    jitter=POLLING_JITTER,
+    retry_interval=FAILED_RETRY_INTERVAL,
+    max_retry_interval=POLLING_INTERVAL,
+)
+
+
+def _secret_rotated(secret_name: str, previous_credentials: dict):
+    """Closes pooled ONTAP connections still using credentials from before a secret rotation"""
+    logger.info(
+        f"Credentials in secret '{secret_name}' rotated - evicting pooled ONTAP connections"
+    )
+    connection_pool.evict_credentials(**previous_credentials)
+
+
+# Initialise K8s Client
+if KUBE_CONFIG_LOCATION:
+    k8sclient = k8s_client.K8sclient(
+        kube_config=KUBE_CONFIG_LOCATION,
+        trident_namespace=TRIDENT_NAMESPACE,
+        label_selector=BACKEND_LABEL_SELECTOR,
+        field_selector=BACKEND_FIELD_SELECTOR,
+        list_page_size=LIST_PAGE_SIZE,
+        discovery_cache_file=DISCOVERY_CACHE_FILE,
+        secret_cache_ttl=SECRET_CACHE_TTL,
+        on_secret_rotated=_secret_rotated,
+        api_qps=K8S_API_QPS,
+        api_burst=K8S_API_BURST,
+    )
+else:
+    k8sclient = k8s_client.K8sclient(
+        trident_namespace=TRIDENT_NAMESPACE,
+        label_selector=BACKEND_LABEL_SELECTOR,
+        field_selector=BACKEND_FIELD_SELECTOR,
+        list_page_size=LIST_PAGE_SIZE,
+        discovery_cache_file=DISCOVERY_CACHE_FILE,
+        secret_cache_ttl=SECRET_CACHE_TTL,
+        on_secret_rotated=_secret_rotated,
+        api_qps=K8S_API_QPS,
+        api_burst=K8S_API_BURST,
+    )
+
+# Replicas split the management LIFs between them, a change in replicas triggers a full pass
+if SHARDING:
+    shard_membership = ShardMembership(
+        k8sclient,
+        identity=POD_NAME,
+        lease_duration=SHARD_LEASE_DURATION,
+        on_change=lambda members: request_reconcile(),
+    )
+else:
+    shard_membership = None
+
+# The last known state is saved after every sweep, so a restart doesn't start from nothing
+if STATE_SNAPSHOT_FILE:
+    snapshot_store = FileSnapshotStore(STATE_SNAPSHOT_FILE)
+elif STATE_SNAPSHOT_CONFIGMAP:
+    snapshot_store = ConfigMapSnapshotStore(
+        k8sclient,
+        STATE_SNAPSHOT_CONFIGMAP,
+        identity=POD_NAME,
+        members=(
+            (lambda: shard_membership.members) if shard_membership is not None else None
+        ),
+    )
+else:
+    snapshot_store = None
+# Loaded by run(), then replaced after every full sweep
+state_snapshot = None
+# Set when a snapshot was loaded, the first full sweep then checks what changed first
+warm_start = False
+
+
+# Interupt Handler - To cleaning exits loops, waking the scheduler and skipping backends not yet started
+class SignalCatcher:
+    terminate = False
+    in_progress = False
+
+    def __init__(self, install_handlers: bool = True):
+        # The unified runtime leaves signals to uvicorn and calls stop on shutdown
+        if install_handlers:
+            signal.signal(signal.SIGINT, self.exit_cleanly)
+            signal.signal(signal.SIGTERM, self.exit_cleanly)
+            if wire_log is not None:
+                signal.signal(signal.SIGUSR1, self.dump_wire_log)
+
+    def start_job(self):
+        self._start_time = time.time()
+        logger.debug("Starting Interation")
+        self.in_progress = True
+
+    def end_job(self):
+        self._end_time = time.time()
+        logger.debug(
+            f"Ending Iteration - duration: '{self._end_time - self._start_time:.2f}s'"
+        )
+        self.in_progress = False
+
+    def stop(self):
+        """Asks the loop to finish - waits end now, in progress passes skip the backends they haven't started"""
+        self.terminate = True
+        scheduler.stop()
+
+    def dump_wire_log(self, *args):
+        """Logs the exchanges kept in the ONTAP wire log, oldest first"""
+        exchanges = wire_log.dump()
+        logger.info(f"Dumping {len(exchanges)} ONTAP exchanges from the wire log")
+        for exchange in exchanges:
+            logger.info(json.dumps(exchange))
+
+    def exit_cleanly(self, *args):
+        logger.info(f"Received termination signal- Terminating Cleanly")
+        self.stop()
+        if not self.in_progress:
+            sys.exit()
+
+
+# Set when the reconcile loop runs inside the healthz app, status updates and repairs then
+# skip the HTTP POST
+_status_sink = None
+_repair_sink = None
+
+
+def set_status_sink(
+    sink: Callable[[StatusUpdate], None],
+    repair_sink: Callable[[RepairReport], None] = None,
+):
+    """Delivers status updates and repairs in-process instead of POSTing them to the healthcheck API
+
+    :param sink: Callable taking a StatusUpdate, called from the reconcile thread
+    :type sink: Callable[[trident_mcc.models.StatusUpdate], None]
+    :param repair_sink: Callable taking a RepairReport, called from the reconcile thread,
+        None leaves repairs to be sent with the next sweep's status update (default is None)
+    :type repair_sink: Callable[[trident_mcc.models.RepairReport], None]
+    """
+    global _status_sink, _repair_sink
+    _status_sink = sink
+    _repair_sink = repair_sink
+
+
+def update_healthcheck(status_update: StatusUpdate):
+    """Updates Healthcheck API
+
+    Does HTTP Post to the healthcheck backend with a StatusUpdate Message, or hands it to
+    the status sink when running in the unified runtime
+
+    :param status_update: StatusUpdate State and Message to set the healthcheck to
+    :type status_update: trident_mcc.models.StatusUpdate
+    """
+    logger.debug("update_healthcheck starting.")
+    start_time = time.time()
+    APIURL = "http://localhost:8000/update_status"
+    headers = {"Content-Type": "application/json"}
+
+    if not isinstance(status_update, StatusUpdate):
+        raise TypeError(
+            f"Expected status_update to be of type 'trident_mcc.models.StatusUpdate' not '{type(status_update)}'"
+        )
+
+    if _status_sink is not None:
+        _status_sink(status_update)
+        logger.debug(f"update_healthcheck finished in {time.time() - start_time:.2f}s")
+        return
+
+    _post_to_healthcheck(APIURL, status_update.json(), headers)
+
+    end_time = time.time()
+    logger.debug(f"update_healthcheck finished in {end_time - start_time:.2f}s")
+
+
+def report_repairs():
+    """Sends the failover repairs finished since the last report to the healthcheck straight away
+
+    A sweep sends its repairs with its status update. Repairs made by a triggered reconcile,
+    a retry or a watch event are sent with this as soon as they are made, so they show on
+    /repairs and /metrics without waiting up to a polling interval for the next sweep.
+    """
+    if _status_sink is not None and _repair_sink is None:
+        return
+    repairs = cycle_stats.take_repairs()
+    if not repairs:
+        return
+    repair_report = RepairReport(repairs=repairs)
+    if _repair_sink is not None:
+        _repair_sink(repair_report)
+        return
+    _post_to_healthcheck(
+        "http://localhost:8000/update_repairs",
+        repair_report.json(),
+        {"Content-Type": "application/json"},
+    )
+
+
+def _post_to_healthcheck(url: str, data: str, headers: dict):
+    try:
+        response = requests.post(url=url, data=data, headers=headers)
+    except ConnectionError as err:
+        logger.error(
+            f"Unable to connect to Healthcheck Service - Make sure it is running"
+        )
+    else:
+        if response.status_code == 200:
+            logger.debug(f"Successfully updated healthcheck service")
+        else:
+            logger.error(
+                f"Update to Healthcheck Service failed with status_code {response.status_code}"
+            )
+
+
+# Comma separated management LIFs, e.g. the partner site's, that SVM lookups are also sent to
+ALTERNATE_LIFS_ANNOTATION = "trident_mcc_alternate_lifs"
+# Runs the lookups against a backend's management LIF and its alternates side by side
+hedged_lookups = HedgedLookups(concurrency=MAX_WORKERS)
+
+
+def _alternate_lifs(trident_config) -> List[str]:
+    """Returns the management LIFs in the backend's alternate LIFs annotation, if it has one"""
+    annotation = trident_config.annotations.get(ALTERNATE_LIFS_ANNOTATION, "")
+    alternate_lifs = []
+    for management_lif in annotation.split(","):
+        management_lif = management_lif.strip()
+        if (
+            management_lif
+            and management_lif != trident_config.management_lif
+            and management_lif not in alternate_lifs
+        ):
+            alternate_lifs.append(management_lif)
+    return alternate_lifs
+
+
+async def _lookup_svm_async(netapp_client, existing_svm_name, existing_svm_uuid):
+    if existing_svm_uuid is not None:
+        return await netapp_client.get_svm_by_uuid(existing_svm_uuid)
+    if existing_svm_name is not None:
+        return await netapp_client.get_svm_by_name(existing_svm_name)
+    return await netapp_client.get_svm()
+
+
+async def _hedged_lookup_svm_async(
+    netapp_clients: list, existing_svm_name, existing_svm_uuid
+):
+    """asyncio version of HedgedLookups.lookup_svm, the lookups still running are cancelled"""
+    tasks = {
+        asyncio.ensure_future(
+            _lookup_svm_async(netapp_client, existing_svm_name, existing_svm_uuid)
+        ): index
+        for index, netapp_client in enumerate(netapp_clients)
+    }
+    answers = [None] * len(netapp_clients)
+    errors = [None] * len(netapp_clients)
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                index = tasks[task]
+                try:
+                    answers[index] = task.result()
+                except Exception as err:
+                    logger.debug(f"Hedged SVM lookup {index} failed - {err}")
+                    errors[index] = err
+                    continue
+                if answers[index] and answers[index].get("state") == "running":
+                    return answers[index]
+    finally:
+        for task in pending:
+            task.cancel()
+    return choose_svm(answers, errors)
+
+
+def _is_ontap_backend(trident_config) -> bool:
+    """Returns True for ONTAP backends, the only ones that can be on a MetroCluster"""
+    if not "ontap" in trident_config.storage_driver:
+        logger.debug(
+            f"TridentBackendConfig '{trident_config.name}' not an ONTAP backend. It is '{trident_config.storage_driver}'"
+        )
+        return False
+    return True
+
+
+def _existing_svm(trident_config) -> Tuple[Optional[str], Optional[str]]:
+    """Returns the backend's SVM name and, once we manage it, the SVM UUID in its annotations"""
+    return trident_config.svm, trident_config.annotations.get(
+        "trident_mcc_svm_uuid", None
+    )
+
+
+def _lif_connection_properties(trident_config) -> List[dict]:
+    """Returns the NetApp client arguments for the backend's management LIF and its alternates
+
+    The credentials are pulled from the backend's secret via the k8s api. The alternates use
+    the same credentials as the backend's own management LIF.
+
+    :param trident_config: TridentBackendConfig object retrieved from the K8s API
+    :type trident_config: trident_mcc.k8s_client.BackendView
+    :rtype: List[dict]
+    """
+    with cycle_stats.time_phase("secret_fetch"):
+        connection_properties = k8sclient.get_na_connection_properties(trident_config)
+    return [
+        dict(connection_properties, management_lif=management_lif)
+        for management_lif in [connection_properties["management_lif"]]
+        + _alternate_lifs(trident_config)
+    ]
+
+
+def _repairing(trident_config, svm_details: dict) -> bool:
+    """Returns True if a managed backend's SVM has a new name e.g. after a switchover
+
+    Rather than it being a backend we haven't recorded the SVM UUID of yet.
+    """
+    existing_svm_name, existing_svm_uuid = _existing_svm(trident_config)
+    return existing_svm_uuid is not None and svm_details["name"] != existing_svm_name
+
+
+def _result_without_patch(
+    trident_config, svm_details: dict
+) -> Optional[ReconcileResult]:
+    """Returns the outcome if the looked up SVM means no patch is needed, else None
+
+    :param trident_config: TridentBackendConfig object retrieved from the K8s API
+    :type trident_config: trident_mcc.k8s_client.BackendView
+    :param svm_details: The SVM found on ONTAP, None if there wasn't one
+    :type svm_details: dict
+    :rtype: trident_mcc.models.ReconcileResult
+    """
+    be_name = trident_config.name
+    existing_svm_name, existing_svm_uuid = _existing_svm(trident_config)
+    if not svm_details:
+        logger.error(
+            f"Unable to match get SVM Details for backend {be_name}- Please check configuration"
+        )
+        return ReconcileResult.FAILED
+
+    if (
+        svm_details["uuid"] == existing_svm_uuid
+        and svm_details["name"] == existing_svm_name
+    ):
+        logger.info(
+            f"SVM Details for TridentBackendConfig '{be_name}' - SVM Name '{existing_svm_name}' - UUID '{existing_svm_uuid}' have not changed"
+        )
+        repair_tracker.discard(be_name)
+        return ReconcileResult.UNCHANGED
+
+    if _repairing(trident_config, svm_details):
+        repair_tracker.mismatch(be_name, existing_svm_name)
+    return None
+
+
+def _patch_result(trident_config, svm_details: dict, patched: bool) -> ReconcileResult:
+    """Returns the outcome of patching the backend, recording a completed repair"""
+    if patched and _repairing(trident_config, svm_details):
+        repair_tracker.repaired(
+            trident_config.name, trident_config.management_lif, svm_details["name"]
+        )
+    return ReconcileResult.PATCHED if patched else ReconcileResult.FAILED
+
+
+def reconcile_backend(trident_config) -> ReconcileResult:
+    """Validates a single TridentBackendConfig against ONTAP and patches it if the SVM changed
+
+    :param trident_config: TridentBackendConfig object retrieved from the K8s API
+    :type trident_config: trident_mcc.k8s_client.BackendView
+    :returns: The outcome of reconciling this backend
+    :rtype: trident_mcc.models.ReconcileResult
+    """
+    logger.debug(f"Processing TridentBackendConfig - '{trident_config.name}'")
+    # 1. If it is  ONTAP it might be metro do stuff - otherwise ignore non-metro backends
+    if not _is_ontap_backend(trident_config):
+        return ReconcileResult.IGNORED
+
+    # Is this already managed by us, e.g. have we already update the UUID in annotations
+    existing_svm_name, existing_svm_uuid = _existing_svm(trident_config)
+
+    # Initialize NetApp Backend - Using credentials pulled from the k8s api
+    netapp_clients = [
+        na_client.NetAppClient(
+            **connection_properties,
+            connection_pool=connection_pool,
+            svm_inventory_cache=svm_inventory_cache,
+            circuit_breakers=circuit_breakers,
+        )
+        for connection_properties in _lif_connection_properties(trident_config)
+    ]
+
+    with cycle_stats.time_phase("ontap_lookup"):
+        if len(netapp_clients) > 1:
+            svm_details = hedged_lookups.lookup_svm(
+                netapp_clients, existing_svm_name, existing_svm_uuid
+            )
+        else:
+            svm_details = lookup_svm(
+                netapp_clients[0], existing_svm_name, existing_svm_uuid
+            )
+
+    result = _result_without_patch(trident_config, svm_details)
+    if result is not None:
+        return result
+
+    with cycle_stats.time_phase("patch"):
+        patched = k8sclient._patch_backend_with_svmname(
+            trident_config,
+            svm_name=svm_details["name"],
+            svm_uuid=svm_details["uuid"],
+        )
+    return _patch_result(trident_config, svm_details, patched)
+
+
+# Time between polls, only moves away from POLLING_INTERVAL with ADAPTIVE_POLLING
+polling_interval = POLLING_INTERVAL
+# Management LIFs found switching over or back by the last ADAPTIVE_POLLING check
+metrocluster_transitioning_lifs = set()
+
+
+def adapt_polling_interval(trident_backends):
+    """Sets polling_interval from the MetroCluster state of the clusters behind the backends
+
+    Each management LIF is asked once for its MetroCluster mode and latest switchover or
+    switchback. While any of them is in transition, or has only just finished, we poll every
+    MIN_POLLING_INTERVAL and drop that cluster's shared SVM inventory so each poll sees the
+    current SVM names. Once everything is stable the interval doubles each poll until it is
+    back at POLLING_INTERVAL.
+
+    :param trident_backends: TridentBackendConfig objects being reconciled this cycle
+    :type trident_backends: List[trident_mcc.k8s_client.BackendView]
+    """
+    global polling_interval, metrocluster_transitioning_lifs
+    checked_lifs = set()
+    transitioning_lifs = []
+    for trident_config in trident_backends:
+        management_lif = trident_config.management_lif
+        if (
+            not "ontap" in trident_config.storage_driver
+            or management_lif in checked_lifs
+        ):
+            continue
+        checked_lifs.add(management_lif)
+        try:
+            netapp_client = na_client.NetAppClient(
+                **k8sclient.get_na_connection_properties(trident_config),
+                connection_pool=connection_pool,
+                svm_inventory_cache=svm_inventory_cache,
+                circuit_breakers=circuit_breakers,
+            )
+            metrocluster_state = netapp_client.get_metrocluster_state()
+        except Exception as err:
+            logger.warning(
+                f"Unable to check MetroCluster state via '{management_lif}' - {err}"
+            )
+            continue
+        if metrocluster_state is not None and metrocluster_in_transition(
+            metrocluster_state, METROCLUSTER_SETTLE_PERIOD
+        ):
+            transitioning_lifs.append(management_lif)
+            netapp_client.invalidate_svm_inventory()
+
+    metrocluster_transitioning_lifs = set(transitioning_lifs)
+    if transitioning_lifs and polling_interval != MIN_POLLING_INTERVAL:
+        logger.info(
+            f"MetroCluster switchover or switchback in progress or recently completed via {transitioning_lifs} - polling every {MIN_POLLING_INTERVAL}s"
+        )
+    polling_interval = next_polling_interval(
+        polling_interval,
+        bool(transitioning_lifs),
+        MIN_POLLING_INTERVAL,
+        POLLING_INTERVAL,
+    )
+
+
+def _reconcile_safely(trident_config) -> ReconcileResult:
+    """Runs reconcile_backend unless the loop is stopping
+
+    Errors are logged and reported as a failure so one bad backend doesn't stop the others
+    being processed.
+
+    :param trident_config: TridentBackendConfig object retrieved from the K8s API
+    :type trident_config: trident_mcc.k8s_client.BackendView
+    :returns: The outcome of reconciling this backend
+    :rtype: trident_mcc.models.ReconcileResult
+    """
+    if scheduler.stopped:
+        return ReconcileResult.SKIPPED
+    try:
+        return reconcile_backend(trident_config)
+    except Exception as err:
+        logger.exception(
+            f"Unable to reconcile TridentBackendConfig '{trident_config.name}' - {err}"
+        )
+        # ONTAP rejected the credentials, make sure we read the secret again next time
+        if isinstance(err, NetAppRestError) and err.status_code in (401, 403):
+            k8sclient.invalidate_backend_credentials(trident_config)
+        return ReconcileResult.FAILED
+
+
+async def reconcile_backend_async(
+    trident_config,
+    ontap_session: na_client.AsyncOntapSession,
+    svm_inventories: dict = None,
+) -> ReconcileResult:
+    """asyncio version of reconcile_backend used by the async engine
+
+    ONTAP is queried with the AsyncNetAppClient. The K8s calls - the secret fetch, which is
+    normally served from the secret cache, and the patch - use the synchronous client in
+    a worker thread so they don't block the event loop.
+
+    :param trident_config: TridentBackendConfig object retrieved from the K8s API
+    :type trident_config: trident_mcc.k8s_client.BackendView
+    :param ontap_session: Session used for the ONTAP requests
+    :type ontap_session: trident_mcc.netapp_client.AsyncOntapSession
+    :param svm_inventories: Shared per cluster SVM inventories for this pass, None to query
+        ONTAP per backend (default is None)
+    :type svm_inventories: dict
+    :returns: The outcome of reconciling this backend
+    :rtype: trident_mcc.models.ReconcileResult
+    """
+    logger.debug(f"Processing TridentBackendConfig - '{trident_config.name}'")
+    if not _is_ontap_backend(trident_config):
+        return ReconcileResult.IGNORED
+
+    existing_svm_name, existing_svm_uuid = _existing_svm(trident_config)
+
+    netapp_clients = [
+        na_client.AsyncNetAppClient(
+            ontap_session,
+            **connection_properties,
+            inventories=svm_inventories,
+        )
+        for connection_properties in await asyncio.to_thread(
+            _lif_connection_properties, trident_config
+        )
+    ]
+
+    with cycle_stats.time_phase("ontap_lookup"):
+        if len(netapp_clients) > 1:
+            svm_details = await _hedged_lookup_svm_async(
+                netapp_clients, existing_svm_name, existing_svm_uuid
+            )
+        else:
+            svm_details = await _lookup_svm_async(
+                netapp_clients[0], existing_svm_name, existing_svm_uuid
+            )
+
+    result = _result_without_patch(trident_config, svm_details)
+    if result is not None:
+        return result
+
+    with cycle_stats.time_phase("patch"):
+        patched = await asyncio.to_thread(
+            k8sclient._patch_backend_with_svmname,
+            trident_config,
+            svm_name=svm_details["name"],
+            svm_uuid=svm_details["uuid"],
+        )
+    return _patch_result(trident_config, svm_details, patched)
+
+
+# SVMs of each cluster from the async engine's last pass, by management LIF
+_async_inventories = {}
+
+
+# The async engine's event loop and ONTAP session. Kept for the life of the process, as the
+# session's keep-alive connections belong to the loop that opened them
+_async_loop = None
+_ontap_session = None
+_async_loop_lock = threading.Lock()
+
+
+def _async_engine_loop() -> asyncio.AbstractEventLoop:
+    """Returns the async engine's event loop, starting it on its own thread the first time"""
+    global _async_loop, _ontap_session
+    with _async_loop_lock:
+        if _async_loop is None:
+            _ontap_session = na_client.AsyncOntapSession(
+                request_timeout=ONTAP_REQUEST_TIMEOUT,
+                max_connections_per_lif=MAX_WORKERS_PER_LIF,
+                connect_timeout=ONTAP_CONNECT_TIMEOUT,
+                circuit_breakers=circuit_breakers,
+                wire_log=wire_log,
+                idle_timeout=ONTAP_CONNECTION_IDLE_TIMEOUT,
+            )
+            _async_loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_async_loop.run_forever, name="async-engine", daemon=True
+            ).start()
+        return _async_loop
+
+
+def _stop_async_engine():
+    """Closes the async engine's ONTAP connections and stops its event loop, if it was started"""
+    global _async_loop
+    with _async_loop_lock:
+        if _async_loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(
+                _ontap_session.close(), _async_loop
+            ).result(timeout=ONTAP_REQUEST_TIMEOUT)
+        except Exception as err:
+            logger.warning(f"Unable to close ONTAP connections - {err}")
+        _async_loop.call_soon_threadsafe(_async_loop.stop)
+        _async_loop = None
+
+
+async def _reconcile_all_async(trident_backends) -> List[ReconcileResult]:
+    """Reconciles every backend concurrently on one event loop
+
+    Runs on the async engine's event loop, see _async_engine_loop. ONTAP requests are
+    limited to MAX_WORKERS_PER_LIF in flight per management LIF, and each is cancelled if it
+    takes longer than ONTAP_REQUEST_TIMEOUT.
+
+    :param trident_backends: TridentBackendConfig objects to reconcile
+    :type trident_backends: List[trident_mcc.k8s_client.BackendView]
+    :returns: The outcome of reconciling each backend, in the same order
+    :rtype: List[trident_mcc.models.ReconcileResult]
+    """
+    # Follow SVM_INVENTORY_TTL - share one SVM list per cluster, or query per backend
+    svm_inventories = {} if svm_inventory_cache is not None else None
+
+    async def reconcile(trident_config) -> ReconcileResult:
+        if scheduler.stopped:
+            return ReconcileResult.SKIPPED
+        try:
+            return await reconcile_backend_async(
+                trident_config, _ontap_session, svm_inventories
+            )
+        except Exception as err:
+            logger.exception(
+                f"Unable to reconcile TridentBackendConfig '{trident_config.name}' - {err}"
+            )
+            if isinstance(err, NetAppRestError) and err.status_code in (401, 403):
+                k8sclient.invalidate_backend_credentials(trident_config)
+            return ReconcileResult.FAILED
+
+    try:
+        return await asyncio.gather(
+            *(reconcile(trident_config) for trident_config in trident_backends)
+        )
+    finally:
+        for (management_lif, _), inventory in (svm_inventories or {}).items():
+            if (
+                inventory.done()
+                and not inventory.cancelled()
+                and not inventory.exception()
+            ):
+                _async_inventories[management_lif] = inventory.result().svms
+
+
+def _reconcile_all(trident_backends) -> List[ReconcileResult]:
+    """Reconciles the backends with the configured engine - async, thread pool or serial"""
+    if ASYNC_ENGINE:
+        return asyncio.run_coroutine_threadsafe(
+            _reconcile_all_async(trident_backends), _async_engine_loop()
+        ).result()
+    if MAX_WORKERS > 1:
+        return map_per_lif(
+            _reconcile_safely, trident_backends, MAX_WORKERS, MAX_WORKERS_PER_LIF
+        )
+    return [_reconcile_safely(trident_config) for trident_config in trident_backends]
+
+
+def request_reconcile(backend_name: str = None, management_lif: str = None):
+    """Wakes the reconcile loop to check a backend, the backends on a management LIF, or everything
+
+    Bursts of requests are coalesced into a single pass, see ReconcileTriggers.
+
+    :param backend_name: Name of the TridentBackendConfig to reconcile (default is None)
+    :type backend_name: str
+    :param management_lif: Reconcile every backend using this management LIF (default is None)
+    :type management_lif: str
+    """
+    reconcile_triggers.request(backend_name=backend_name, management_lif=management_lif)
+
+
+def reconcile_triggered(scope: ReconcileScope, trident_backends=None):
+    """Reconciles only the backends in scope without waiting for the next poll
+
+    Unlike check_backends this doesn't report a status update, the next full poll does that.
+    Any repairs it made are reported straight away, see report_repairs.
+
+    :param scope: The backends to reconcile
+    :type scope: trident_mcc.triggers.ReconcileScope
+    :param trident_backends: Already retrieved TridentBackendConfig objects, if None they are
+        listed from the K8s API (default is None)
+    :type trident_backends: List[trident_mcc.k8s_client.BackendView]
+    """
+    if trident_backends is None:
+        with cycle_stats.time_phase("k8s_list"):
+            trident_backends = k8sclient.get_trident_backends() or []
+    selected_backends = [
+        trident_config
+        for trident_config in trident_backends
+        if scope.matches(trident_config)
+    ]
+    # Not limited to our shard - EMS events and POST /reconcile reach whichever replica the
+    # Service picks, and a patch racing the owner's is rejected on its resourceVersion
+    if not selected_backends:
+        logger.warning(
+            f"Triggered reconcile matched no TridentBackendConfigs - {scope}"
+        )
+        return
+
+    # Triggers follow a change on the storage, so don't answer them from a shared inventory
+    if svm_inventory_cache is not None:
+        for management_lif in {be.management_lif for be in selected_backends}:
+            svm_inventory_cache.invalidate_management_lif(management_lif)
+
+    results = _reconcile_all(selected_backends)
+    scheduler.record_results(selected_backends, results)
+    logger.info(
+        f"Triggered reconcile of {len(selected_backends)} backends - Patched: {results.count(ReconcileResult.PATCHED)} - Failed: {results.count(ReconcileResult.FAILED)}"
+    )
+    report_repairs()
+
+
+def _sweep_inventories() -> Dict[str, List[dict]]:
+    """Returns the SVMs of each cluster seen by the last sweep, by management LIF"""
+    if ASYNC_ENGINE:
+        return dict(_async_inventories)
+    if svm_inventory_cache is not None:
+        return svm_inventory_cache.inventories()
+    return {}
+
+
+def _load_snapshot():
+    """Loads the state snapshot saved before we were restarted, if there is one"""
+    global state_snapshot, warm_start
+    state_snapshot = snapshot_store.load()
+    if state_snapshot is None:
+        return
+    warm_start = True
+    logger.info(
+        f"Loaded state snapshot from {time.time() - (state_snapshot.saved_at or 0):.0f}s ago - {len(state_snapshot.backends)} backends, {len(state_snapshot.inventories)} clusters, switched over {sorted(state_snapshot.switchover_lifs)}"
+    )
+
+
+def _save_snapshot(trident_backends, results: List[ReconcileResult]):
+    """Replaces the state snapshot with the outcome of a full sweep and saves it"""
+    global state_snapshot
+    state_snapshot = StateSnapshot.from_sweep(
+        state_snapshot,
+        trident_backends,
+        results,
+        _sweep_inventories(),
+        metrocluster_transitioning_lifs,
+    )
+    try:
+        if snapshot_store.save(state_snapshot):
+            logger.debug(
+                f"Saved state snapshot - {len(state_snapshot.backends)} backends"
+            )
+    except Exception as err:
+        logger.warning(f"Unable to save state snapshot - {err}")
+
+
+def _warm_start_order(trident_backends):
+    """Splits the first sweep after a warm start into the backends to check now and the rest
+
+    Backends on clusters the snapshot saw switched over, or switching, are checked first,
+    then those that changed or weren't verified before the restart. The others are only
+    deferred, to a triggered reconcile of their management LIFs straight after the sweep,
+    as the storage may have failed over while we were down.
+
+    :param trident_backends: TridentBackendConfig objects in this sweep
+    :type trident_backends: List[trident_mcc.k8s_client.BackendView]
+    :returns: The backends to check now in priority order, and the deferred backends
+    :rtype: Tuple[list, list]
+    """
+    switchover_lifs = state_snapshot.switchover_lifs
+    prioritised, changed, deferred = [], [], []
+    for trident_config in trident_backends:
+        if trident_config.management_lif in switchover_lifs:
+            prioritised.append(trident_config)
+        elif state_snapshot.changed(trident_config):
+            changed.append(trident_config)
+        else:
+            deferred.append(trident_config)
+    logger.info(
+        f"Warm start - checking {len(prioritised)} backends on switched over clusters and {len(changed)} changed backends first, deferring {len(deferred)}"
+    )
+    return prioritised + changed, deferred
+
+
+@cycle_profiler.profiled
+def check_backends(trident_backends=None):
+    """Reconciles every TridentBackendConfig and reports the result to the healthcheck
+
+    :param trident_backends: Already retrieved TridentBackendConfig objects, if None they are
+        listed from the K8s API (default is None)
+    :type trident_backends: List[trident_mcc.k8s_client.BackendView]
+    """
+    start_time = time.time()
+    # Get all the backends
+    if trident_backends is None:
+        with cycle_stats.time_phase("k8s_list"):
+            trident_backends = k8sclient.get_trident_backends()
+    if not trident_backends:
+        status_message = f"No Backends found"
+        logger.info(status_message)
+        update_healthcheck(
+            StatusUpdate(
+                state=StateEnum.OK,
+                message=status_message,
+                cycle=cycle_stats.report(duration=time.time() - start_time),
+            )
+        )
+        cycle_stats.reset()
+        return
+    if shard_membership is not None:
+        trident_backends = shard_membership.owned(trident_backends)
+        logger.info(
+            f"Shard '{shard_membership.identity}' owns {len(trident_backends)} backends - members {sorted(shard_membership.members)}"
+        )
+
+    if ADAPTIVE_POLLING:
+        with cycle_stats.time_phase("metrocluster_state"):
+            adapt_polling_interval(trident_backends)
+
+    global warm_start
+    deferred_backends = []
+    if warm_start:
+        warm_start = False
+        trident_backends, deferred_backends = _warm_start_order(trident_backends)
+
+    results = _reconcile_all(trident_backends)
+    if scheduler.stopped:
+        logger.info("Shutting down - abandoning the rest of this sweep")
+        cycle_stats.reset()
+        return
+    trident_backends = trident_backends + deferred_backends
+    results = results + [ReconcileResult.SKIPPED] * len(deferred_backends)
+    scheduler.record_results(trident_backends, results, full=True)
+    repair_tracker.prune({be.name for be in trident_backends})
+
+    # Sucessfully Processed all backends report success
+    all_backends_count = len(results)
+    managed_backend_count = all_backends_count - results.count(ReconcileResult.IGNORED)
+    patch_count = results.count(ReconcileResult.PATCHED)
+    failed_count = results.count(ReconcileResult.FAILED)
+    status_message = f"Successfully Checked Backends - ONTAP Backends being monitored: {managed_backend_count}/{all_backends_count} - Patched: {patch_count}/{managed_backend_count} backends - Failed: {failed_count}/{managed_backend_count} backends"
+    if deferred_backends:
+        status_message += (
+            f" - Deferred after warm start: {len(deferred_backends)} backends"
+        )
+    logger.info(status_message)
+    update_healthcheck(
+        StatusUpdate(
+            state=StateEnum.OK,
+            message=status_message,
+            cycle=cycle_stats.report(
+                duration=time.time() - start_time,
+                seen=all_backends_count,
+                managed=managed_backend_count,
+                patched=patch_count,
+                failed=failed_count,
+                open_circuits=(
+                    circuit_breakers.open_circuits()
+                    if circuit_breakers is not None
+                    else []
+                ),
+            ),
+        )
+    )
+    cycle_stats.reset()
+
+    if snapshot_store is not None:
+        _save_snapshot(trident_backends, results)
+    for management_lif in sorted({be.management_lif for be in deferred_backends}):
+        request_reconcile(management_lif=management_lif)
+
+
+def _reconcile_changed(trident_config) -> ReconcileResult:
+    """Reconciles a backend a watch event added or changed, reporting any repair straight away"""
+    result = _reconcile_safely(trident_config)
+    report_repairs()
+    return result
+
+
+def watch_backends(job_monitor: SignalCatcher):
+    """Event driven reconciliation of TridentBackendConfigs, see BackendWatcher
+
+    :param job_monitor: Signal handler used to track in progress work and termination
+    :type job_monitor: SignalCatcher
+    """
+    BackendWatcher(
+        k8sclient,
+        scheduler,
+        sweep=check_backends,
+        reconcile=_reconcile_changed,
+        reconcile_scope=reconcile_triggered,
+        resync_interval=lambda: polling_interval,
+        owns=shard_membership.owns if shard_membership is not None else None,
+        trigger_check_interval=max(TRIGGER_MAX_DELAY, 1),
+        max_retry_interval=POLLING_INTERVAL,
+    ).run(job_monitor)
+
+
+def poll_backends(job_monitor: SignalCatcher):
+    """Reconciles every backend each polling_interval, and triggered reconciles in between
+
+    :param job_monitor: Tracks the running job and termination requests
+    :type job_monitor: SignalCatcher
+    """
+    while not job_monitor.terminate:
+        job_monitor.start_job()
+        try:
+            check_backends()
+        finally:
+            # Clean Up
+            pass
+        job_monitor.end_job()
+        # Check to see if we got termination during run, before waiting
+        if job_monitor.terminate:
+            break
+        next_poll = time.time() + scheduler.jittered(polling_interval)
+        logger.debug(f"Next poll in {next_poll - time.time():.0f}s")
+        # Wait for the next poll, handling triggered reconciles and retries meanwhile
+        while not job_monitor.terminate:
+            scope = scheduler.wait(next_poll)
+            if scope is None or scope.full:
+                break
+            job_monitor.start_job()
+            reconcile_triggered(scope)
+            job_monitor.end_job()
+
+
+def run(job_monitor: SignalCatcher):
+    """Runs the reconcile loop until job_monitor is told to terminate
+
+    :param job_monitor: Tracks the running job and termination requests
+    :type job_monitor: SignalCatcher
+    """
+    if shard_membership is not None:
+        shard_membership.start()
+    if snapshot_store is not None:
+        _load_snapshot()
+    try:
+        if WATCH_MODE:
+            logger.info("Starting in watch mode")
+            watch_backends(job_monitor)
+        else:
+            poll_backends(job_monitor)
+    finally:
+        # Leave the shard straight away, rather than once our Lease lapses
+        if shard_membership is not None:
+            shard_membership.stop()
+        _stop_async_engine()
+    logger.info("Terminating")
@@ -0,0 +1,150 @@
+import logging
+import random
+import threading
+import time
+from typing import List, Optional
+
+from trident_mcc.models import ReconcileResult
+from trident_mcc.triggers import ReconcileScope, ReconcileTriggers
+
+
+logger = logging.getLogger("trident_mcc.scheduler")
+
+
+class ReconcileScheduler:
+    def __init__(
+        self,
+        triggers: ReconcileTriggers,
+        jitter: float = 0.1,
+        retry_interval: float = 30,
+        max_retry_interval: float = 300,
+    ) -> None:
+        """Decides when the reconcile loop runs next, without ever sleeping uninterruptibly
+
+        Between full polls the loop waits here for whichever comes first - a triggered
+        reconcile, a failed backend being due for a retry, the next poll, or shutdown. Failed
+        backends are retried on their own after retry_interval, doubling on every further
+        failure up to max_retry_interval, instead of waiting for the next full poll.
+
+        :param triggers: Source of triggered reconcile requests
+        :type triggers: trident_mcc.triggers.ReconcileTriggers
+        :param jitter: Fraction that poll and retry intervals are randomly varied by, so
+            replicas and retries don't line up (default is 0.1)
+        :type jitter: float
+        :param retry_interval: Seconds after a failure that a backend is retried, 0 to only
+            retry on the next poll (default is 30)
+        :type retry_interval: float
+        :param max_retry_interval: Longest retry interval after repeated failures (default is 300)
+        :type max_retry_interval: float
+        """
+        self._triggers = triggers
+        self._jitter = jitter
+        self._retry_interval = retry_interval
+        self._max_retry_interval = max_retry_interval
+        self._lock = threading.Lock()
+        # backend name -> (consecutive failures, retry due time)
+        self._retries = {}
+        self.stopped = False
+
+    def jittered(self, interval: float) -> float:
+        """Returns interval randomly varied by up to the jitter fraction either way"""
+        return interval * (1 + random.uniform(-self._jitter, self._jitter))
+
+    def record_results(
+        self, trident_backends, results: List[ReconcileResult], full: bool = False
+    ) -> None:
+        """Schedules retries for the backends that failed and clears them for the rest
+
+        :param trident_backends: The TridentBackendConfig objects that were reconciled
+        :type trident_backends: List[trident_mcc.k8s_client.BackendView]
+        :param results: The outcome for each backend, in the same order
+        :type results: List[trident_mcc.models.ReconcileResult]
+        :param full: True if these were all the backends, so retries for any others are dropped
+            (default is False)
+        :type full: bool
+        """
+        now = time.time()
+        with self._lock:
+            if full:
+                names = {be.name for be in trident_backends}
+                for name in list(self._retries):
+                    if name not in names:
+                        del self._retries[name]
+
+            for trident_config, result in zip(trident_backends, results):
+                name = trident_config.name
+                if result == ReconcileResult.SKIPPED:
+                    continue
+                if result != ReconcileResult.FAILED or not self._retry_interval:
+                    self._retries.pop(name, None)
+                    continue
+                failures = self._retries.get(name, (0, None))[0] + 1
+                delay = min(
+                    self._retry_interval * 2 ** (failures - 1), self._max_retry_interval
+                )
+                self._retries[name] = (failures, now + self.jittered(delay))
+                logger.debug(
+                    f"TridentBackendConfig '{name}' failed {failures} time(s) - retrying in {delay:.0f}s"
+                )
+
+    def wait(self, deadline: float) -> Optional[ReconcileScope]:
+        """Waits until deadline for a triggered reconcile or a failed backend to be due a retry
+
+        :param deadline: Time the next full poll is due
+        :type deadline: float
+        :returns: The backends to reconcile now, or None once the deadline is reached or the
+            scheduler is stopped
+        :rtype: trident_mcc.triggers.ReconcileScope
+        """
+        while not self.stopped:
+            with self._lock:
+                retry_due = min(
+                    (due for _, due in self._retries.values()), default=None
+                )
+            wake_at = deadline if retry_due is None else min(deadline, retry_due)
+
+            scope = self._triggers.wait(max(wake_at - time.time(), 0))
+            if self.stopped:
+                return None
+            if scope is not None:
+                return scope
+
+            now = time.time()
+            if now >= deadline:
+                return None
+            scope = self._take_due_retries(now)
+            if scope is not None:
+                return scope
+        return None
+
+    def poll(self) -> Optional[ReconcileScope]:
+        """Returns the backends to reconcile now without waiting, see wait
+
+        For loops that block on something else, e.g. a watch stream, and check between times.
+
+        :returns: The backends to reconcile now, or None if nothing is due
+        :rtype: trident_mcc.triggers.ReconcileScope
+        """
+        if self.stopped:
+            return None
+        scope = self._triggers.take()
+        if scope is not None:
+            return scope
+        return self._take_due_retries(time.time())
+
+    def _take_due_retries(self, now: float) -> Optional[ReconcileScope]:
+        with self._lock:
+            due_names = {name for name, (_, due) in self._retries.items() if due <= now}
+            # Until their results are recorded, e.g. if the backend has since been deleted
+            for name in due_names:
+                failures, _ = self._retries[name]
+                self._retries[name] = (failures, now + self._max_retry_interval)
+        if not due_names:
+            return None
+        logger.info(f"Retrying failed TridentBackendConfigs {sorted(due_names)}")
+        return ReconcileScope(backend_names=due_names)
+
+    def stop(self) -> None:
+        """Stops the scheduler, waking the loop straight away if it is waiting"""
+        self.stopped = True
+        self._triggers.interrupt()
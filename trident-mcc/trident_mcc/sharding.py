@@ -0,0 +1,178 @@
+import hashlib
+import logging
+import threading
+import time
+from typing import Callable, Iterable, Set
+
+from kubernetes.client.exceptions import ApiException
+
+
+logger = logging.getLogger("trident_mcc.sharding")
+
+# Every replica's Lease carries this label, it is how replicas find each other
+SHARD_LABEL = "trident_mcc_shard"
+SHARD_LABEL_SELECTOR = f"{SHARD_LABEL}=member"
+# Leases not renewed for this many lease durations are deleted by the other replicas
+STALE_LEASE_FACTOR = 4
+
+
+def shard_owner(key: str, members: Iterable[str]) -> str:
+    """Returns the member that owns key, using rendezvous (highest random weight) hashing
+
+    Every replica computes the same owner from the same members, and when a member joins
+    or leaves only the keys it gains or loses move - the rest stay where they are.
+
+    :param key: What is being sharded, e.g. a management LIF
+    :type key: str
+    :param members: Identities of the live replicas
+    :type members: Iterable[str]
+    :returns: Identity of the owning replica
+    :rtype: str
+    """
+    return max(
+        members,
+        key=lambda member: hashlib.sha256(f"{member}/{key}".encode()).digest(),
+    )
+
+
+class ShardMembership:
+    def __init__(
+        self,
+        k8sclient,
+        identity: str,
+        lease_duration: int = 15,
+        on_change: Callable[[Set[str]], None] = None,
+    ) -> None:
+        """Splits management LIFs between replicas, using a Kubernetes Lease per replica
+
+        Each replica renews its own Lease every third of lease_duration, and lists the
+        others. A replica whose Lease hasn't been seen to change for lease_duration is
+        treated as gone, and its management LIFs move to the remaining replicas. Liveness
+        is judged by when we saw a renewal rather than the renewTime written in it, so the
+        replicas' clocks don't need to agree.
+
+        Sharding by management LIF keeps every backend of a cluster on one replica, so its
+        SVM inventory is still only fetched once. While membership changes two replicas may
+        briefly both check a backend, which is safe - patches carry the resourceVersion
+        they were based on, so the second one is rejected by the API Server.
+
+        :param k8sclient: Client used to renew, list and delete the Leases
+        :type k8sclient: trident_mcc.k8s_client.K8sclient
+        :param identity: Unique name of this replica, e.g. the pod name
+        :type identity: str
+        :param lease_duration: Seconds without a renewal before a replica is treated as gone
+            (default is 15)
+        :type lease_duration: int
+        :param on_change: Called from the renewal thread with the new members whenever they
+            change (default is None)
+        :type on_change: Callable[[Set[str]], None]
+        """
+        self._k8sclient = k8sclient
+        self.identity = identity
+        self.lease_name = f"trident-mcc-shard-{identity}"
+        self._lease_duration = lease_duration
+        self._on_change = on_change
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        # Lease name -> (holder identity, renewTime, time we saw that renewTime)
+        self._observed = {}
+        self.members = {identity}
+
+    def owns(self, management_lif: str) -> bool:
+        """Returns True if this replica should reconcile the backends on management_lif"""
+        with self._lock:
+            members = self.members
+        return shard_owner(management_lif, members) == self.identity
+
+    def owned(self, trident_backends):
+        """Returns the TridentBackendConfigs whose management LIF this replica owns"""
+        return [
+            trident_config
+            for trident_config in trident_backends
+            if self.owns(trident_config.management_lif)
+        ]
+
+    def renew(self) -> bool:
+        """Renews our Lease and refreshes the members from everyone else's
+
+        :returns: True if the members changed
+        :rtype: bool
+        """
+        self._k8sclient.renew_lease(
+            self.lease_name,
+            self.identity,
+            self._lease_duration,
+            labels={SHARD_LABEL: "member"},
+        )
+        now = time.time()
+        observed = {}
+        for lease in self._k8sclient.list_leases(SHARD_LABEL_SELECTOR):
+            # Missing fields read as None on dynamic client objects, so check the label too
+            if (lease.metadata.labels or {}).get(SHARD_LABEL) != "member":
+                continue
+            name = lease.metadata.name
+            holder, renew_time = lease.spec.holderIdentity, lease.spec.renewTime
+            previous = self._observed.get(name)
+            if previous is not None and previous[:2] == (holder, renew_time):
+                observed[name] = previous
+            else:
+                observed[name] = (holder, renew_time, now)
+
+            if (
+                name != self.lease_name
+                and now - observed[name][2] > self._lease_duration * STALE_LEASE_FACTOR
+            ):
+                logger.info(f"Deleting stale shard Lease '{name}' of '{holder}'")
+                try:
+                    self._k8sclient.delete_lease(name)
+                except ApiException as err:
+                    logger.warning(f"Unable to delete stale Lease '{name}' - {err}")
+        self._observed = observed
+
+        members = {
+            holder
+            for holder, _, seen_at in observed.values()
+            if holder and now - seen_at <= self._lease_duration
+        }
+        members.add(self.identity)
+        with self._lock:
+            changed = members != self.members
+            self.members = members
+        if changed:
+            logger.info(f"Shard members changed - now {sorted(members)}")
+        return changed
+
+    def start(self) -> None:
+        """Joins the shard and keeps renewing our Lease in a daemon thread until stopped"""
+        try:
+            self.renew()
+        except ApiException as err:
+            logger.error(f"Unable to join shard as '{self.identity}' - {err}")
+        self._thread = threading.Thread(
+            target=self._renew_loop, name="shard-lease", daemon=True
+        )
+        self._thread.start()
+
+    def _renew_loop(self) -> None:
+        while not self._stopped.wait(self._lease_duration / 3):
+            try:
+                changed = self.renew()
+            except Exception as err:
+                # Keep our shard, the other replicas take it over once our Lease lapses
+                logger.error(f"Unable to renew shard Lease '{self.lease_name}' - {err}")
+                continue
+            if changed and self._on_change is not None:
+                self._on_change(set(self.members))
+
+    def stop(self) -> None:
+        """Leaves the shard, deleting our Lease so the others take over straight away"""
+        self._stopped.set()
+        # Don't let an in flight renewal recreate the Lease after we delete it
+        if self._thread is not None:
+            self._thread.join(timeout=self._lease_duration / 3)
+        try:
+            self._k8sclient.delete_lease(self.lease_name)
+            logger.info(f"Left shard - deleted Lease '{self.lease_name}'")
+        except Exception as err:
+            logger.warning(f"Unable to delete shard Lease '{self.lease_name}' - {err}")
@@ -0,0 +1,336 @@
+import abc
+import base64
+import gzip
+import hashlib
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from trident_mcc.models import ReconcileResult
+
+
+logger = logging.getLogger("trident_mcc.snapshot")
+
+# Bumped whenever the layout changes, older snapshots are then ignored
+SNAPSHOT_VERSION = 1
+SNAPSHOT_KEY_SUFFIX = ".json.gz"
+
+
+class StateSnapshot:
+    def __init__(
+        self,
+        backends: Dict[str, Tuple[str, str, str, str]] = None,
+        inventories: Dict[str, List[Tuple[str, str, str, str]]] = None,
+        transitioning_lifs: Iterable[str] = (),
+        saved_at: float = None,
+    ) -> None:
+        """The last known state of the backends and clusters, kept so a restart starts warm
+
+        Saved after every full sweep and loaded on startup, so the first pass after a restart
+        can check the backends that changed while we were down, and those on clusters that
+        were switched over, before the rest. Credentials are never included.
+
+        :param backends: Backend name to (resourceVersion, management LIF, SVM name, SVM UUID)
+            as last verified (default is None)
+        :type backends: Dict[str, Tuple[str, str, str, str]]
+        :param inventories: Management LIF to the (name, uuid, state, subtype) of each SVM on
+            the cluster (default is None)
+        :type inventories: Dict[str, List[Tuple[str, str, str, str]]]
+        :param transitioning_lifs: Management LIFs whose MetroCluster was switching over or
+            back (default is ())
+        :type transitioning_lifs: Iterable[str]
+        :param saved_at: Unix time the snapshot was taken (default is None)
+        :type saved_at: float
+        """
+        self.backends = backends or {}
+        self.inventories = inventories or {}
+        self.transitioning_lifs = set(transitioning_lifs)
+        self.saved_at = saved_at
+
+    @classmethod
+    def from_sweep(
+        cls,
+        previous: Optional["StateSnapshot"],
+        trident_backends,
+        results: List[ReconcileResult],
+        inventories: Dict[str, List[dict]],
+        transitioning_lifs: Iterable[str] = (),
+    ) -> "StateSnapshot":
+        """Builds the snapshot after a full sweep
+
+        Only backends verified unchanged are recorded. Failed ones are left out so they are
+        checked straight away after a restart, and so are patched ones, as all we have is the
+        backend as it was before the patch. Skipped backends keep their previous entry.
+
+        :param previous: Snapshot taken after the previous sweep, or loaded at startup
+        :type previous: StateSnapshot
+        :param trident_backends: The TridentBackendConfig objects that were reconciled
+        :type trident_backends: List[trident_mcc.k8s_client.BackendView]
+        :param results: The outcome for each backend, in the same order
+        :type results: List[trident_mcc.models.ReconcileResult]
+        :param inventories: Management LIF to the SVM details dicts fetched this sweep
+        :type inventories: Dict[str, List[dict]]
+        :param transitioning_lifs: Management LIFs whose MetroCluster was switching over or
+            back (default is ())
+        :type transitioning_lifs: Iterable[str]
+        :returns: The new snapshot
+        :rtype: StateSnapshot
+        """
+        backends = {}
+        for trident_config, result in zip(trident_backends, results):
+            name = trident_config.name
+            if result == ReconcileResult.SKIPPED:
+                if previous is not None and name in previous.backends:
+                    backends[name] = previous.backends[name]
+                continue
+            if result != ReconcileResult.UNCHANGED:
+                continue
+            backends[name] = (
+                trident_config.resource_version,
+                trident_config.management_lif,
+                trident_config.svm,
+                trident_config.annotations.get("trident_mcc_svm_uuid", None),
+            )
+        # Keep the previous inventory of clusters this sweep didn't query, e.g. every backend
+        # on them was deferred, as long as some backend still uses them
+        backend_lifs = {entry[1] for entry in backends.values()}
+        merged_inventories = {
+            management_lif: svms
+            for management_lif, svms in (
+                previous.inventories.items() if previous is not None else ()
+            )
+            if management_lif in backend_lifs
+        }
+        merged_inventories.update(
+            {
+                management_lif: [
+                    (svm["name"], svm["uuid"], svm["state"], svm["subtype"])
+                    for svm in svms
+                ]
+                for management_lif, svms in inventories.items()
+            }
+        )
+        return cls(
+            backends=backends,
+            inventories=merged_inventories,
+            transitioning_lifs=transitioning_lifs,
+            saved_at=time.time(),
+        )
+
+    @property
+    def switchover_lifs(self) -> Set[str]:
+        """Management LIFs that were mid switchover or switchback, or serving switched over SVMs
+
+        After a switchover the surviving cluster runs its partner's SVMs as sync_destination
+        copies, so those clusters are where backends are most likely to need repairing.
+        """
+        return self.transitioning_lifs | {
+            management_lif
+            for management_lif, svms in self.inventories.items()
+            if any(
+                subtype == "sync_destination" and state == "running"
+                for _, _, state, subtype in svms
+            )
+        }
+
+    def changed(self, trident_config) -> bool:
+        """Returns True if the backend isn't recorded as verified at its current resourceVersion"""
+        entry = self.backends.get(trident_config.name)
+        return (
+            entry is None
+            or entry[0] is None
+            or entry[0] != trident_config.resource_version
+            or entry[1] != trident_config.management_lif
+        )
+
+    def _content(self) -> dict:
+        return {
+            "version": SNAPSHOT_VERSION,
+            "backends": self.backends,
+            "inventories": self.inventories,
+            "transitioning_lifs": sorted(self.transitioning_lifs),
+        }
+
+    def digest(self) -> str:
+        """Hash of the snapshot's content, ignoring when it was taken"""
+        return hashlib.sha256(
+            json.dumps(self._content(), sort_keys=True).encode()
+        ).hexdigest()
+
+    def dumps(self) -> bytes:
+        """Returns the snapshot as gzipped compact JSON"""
+        return gzip.compress(
+            json.dumps(
+                {**self._content(), "saved_at": self.saved_at}, separators=(",", ":")
+            ).encode()
+        )
+
+    @classmethod
+    def loads(cls, data: bytes) -> "StateSnapshot":
+        """Reads a snapshot written by dumps
+
+        :raises ValueError: If the data isn't a snapshot of the current SNAPSHOT_VERSION
+        """
+        try:
+            content = json.loads(gzip.decompress(data))
+        except (OSError, EOFError) as err:
+            raise ValueError(f"Not a gzipped snapshot - {err}")
+        if content.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(
+                f"Snapshot version {content.get('version')} is not {SNAPSHOT_VERSION}"
+            )
+        return cls(
+            backends={
+                name: tuple(entry) for name, entry in content["backends"].items()
+            },
+            inventories={
+                management_lif: [tuple(svm) for svm in svms]
+                for management_lif, svms in content["inventories"].items()
+            },
+            transitioning_lifs=content["transitioning_lifs"],
+            saved_at=content["saved_at"],
+        )
+
+    @classmethod
+    def merge(cls, snapshots: List["StateSnapshot"]) -> "StateSnapshot":
+        """Combines snapshots, e.g. from several replicas, the newest entries winning"""
+        merged = cls()
+        for snapshot in sorted(snapshots, key=lambda snapshot: snapshot.saved_at or 0):
+            merged.backends.update(snapshot.backends)
+            merged.inventories.update(snapshot.inventories)
+            merged.transitioning_lifs |= snapshot.transitioning_lifs
+            merged.saved_at = snapshot.saved_at
+        return merged
+
+
+class _SnapshotStore(abc.ABC):
+    def __init__(self) -> None:
+        self._saved_digest = None
+
+    @abc.abstractmethod
+    def load(self) -> Optional[StateSnapshot]:
+        """Returns the saved snapshot, or None if there isn't a usable one"""
+
+    @abc.abstractmethod
+    def _write(self, data: bytes) -> None:
+        """Replaces the saved snapshot with data, as returned by StateSnapshot.dumps"""
+
+    def save(self, snapshot: StateSnapshot) -> bool:
+        """Saves the snapshot, unless its content is the same as the last one saved
+
+        :returns: True if the snapshot was written
+        :rtype: bool
+        """
+        digest = snapshot.digest()
+        if digest == self._saved_digest:
+            return False
+        self._write(snapshot.dumps())
+        self._saved_digest = digest
+        return True
+
+
+class FileSnapshotStore(_SnapshotStore):
+    def __init__(self, path: str) -> None:
+        """Keeps the snapshot in a local file, e.g. on an emptyDir that survives container restarts
+
+        :param path: File to save the snapshot to
+        :type path: str
+        """
+        super().__init__()
+        self._path = Path(path)
+
+    def load(self) -> Optional[StateSnapshot]:
+        try:
+            snapshot = StateSnapshot.loads(self._path.read_bytes())
+        except FileNotFoundError:
+            logger.info(f"No state snapshot at '{self._path}' - starting cold")
+            return None
+        except (OSError, ValueError, KeyError) as err:
+            logger.warning(f"Ignoring unreadable state snapshot '{self._path}' - {err}")
+            return None
+        self._saved_digest = snapshot.digest()
+        return snapshot
+
+    def _write(self, data: bytes) -> None:
+        # Write then rename, so a crash mid write never leaves a truncated snapshot
+        temp_path = self._path.with_name(f".{self._path.name}.tmp")
+        temp_path.write_bytes(data)
+        os.replace(temp_path, self._path)
+
+
+class ConfigMapSnapshotStore(_SnapshotStore):
+    def __init__(
+        self,
+        k8sclient,
+        name: str,
+        identity: str,
+        members: Callable[[], Set[str]] = None,
+    ) -> None:
+        """Keeps the snapshot in a ConfigMap in the Trident Namespace, so it survives rescheduling
+
+        Each replica writes its snapshot under its own key and loading merges every key, so
+        a replica started with a new name, or given another replica's shard, starts warm.
+        Keys of replicas that are no longer members are removed when we save.
+
+        :param k8sclient: Client used to read and patch the ConfigMap
+        :type k8sclient: trident_mcc.k8s_client.K8sclient
+        :param name: Name of the ConfigMap
+        :type name: str
+        :param identity: Unique name of this replica, e.g. the pod name
+        :type identity: str
+        :param members: Returns the identities of the live replicas, None if this is the
+            only one (default is None)
+        :type members: Callable[[], Set[str]]
+        """
+        super().__init__()
+        self._k8sclient = k8sclient
+        self._name = name
+        self._identity = identity
+        self._members = members
+
+    def _stored_keys(self) -> Dict[str, str]:
+        config_map = self._k8sclient.get_config_map(self._name)
+        if config_map is None or not config_map.binaryData:
+            return {}
+        return {
+            key: value
+            for key, value in dict(config_map.binaryData).items()
+            if key.endswith(SNAPSHOT_KEY_SUFFIX)
+        }
+
+    def load(self) -> Optional[StateSnapshot]:
+        try:
+            stored_keys = self._stored_keys()
+        except Exception as err:
+            logger.warning(
+                f"Unable to read state snapshot ConfigMap '{self._name}' - {err}"
+            )
+            return None
+        snapshots = []
+        for key, value in stored_keys.items():
+            try:
+                snapshots.append(StateSnapshot.loads(base64.b64decode(value)))
+            except (ValueError, KeyError) as err:
+                logger.warning(f"Ignoring unreadable state snapshot '{key}' - {err}")
+        if not snapshots:
+            logger.info(
+                f"No state snapshot in ConfigMap '{self._name}' - starting cold"
+            )
+            return None
+        return StateSnapshot.merge(snapshots)
+
+    def _write(self, data: bytes) -> None:
+        members = self._members() if self._members is not None else set()
+        members = set(members) | {self._identity}
+        binary_data = {
+            key: None
+            for key in self._stored_keys()
+            if key[: -len(SNAPSHOT_KEY_SUFFIX)] not in members
+        }
+        binary_data[self._identity + SNAPSHOT_KEY_SUFFIX] = base64.b64encode(
+            data
+        ).decode()
+        self._k8sclient.patch_config_map(self._name, binary_data)
@@ -0,0 +1,140 @@
+import logging
+import threading
+import time
+from typing import Optional, Set, Tuple
+
+
+logger = logging.getLogger("trident_mcc.triggers")
+
+
+class ReconcileScope:
+    def __init__(
+        self,
+        full: bool = False,
+        backend_names: Set[str] = None,
+        management_lifs: Set[str] = None,
+    ) -> None:
+        """The backends a triggered reconcile should check
+
+        :param full: Check every backend, the names and LIFs are then ignored (default is False)
+        :type full: bool
+        :param backend_names: TridentBackendConfig names to check (default is None)
+        :type backend_names: Set[str]
+        :param management_lifs: Check every backend using one of these management LIFs (default is None)
+        :type management_lifs: Set[str]
+        """
+        self.full = full
+        self.backend_names = backend_names or set()
+        self.management_lifs = management_lifs or set()
+
+    def matches(self, trident_config) -> bool:
+        """Returns True if the TridentBackendConfig is in scope"""
+        return (
+            self.full
+            or trident_config.name in self.backend_names
+            or trident_config.management_lif in self.management_lifs
+        )
+
+    def __repr__(self) -> str:
+        if self.full:
+            return "ReconcileScope(full)"
+        return f"ReconcileScope(backend_names={sorted(self.backend_names)}, management_lifs={sorted(self.management_lifs)})"
+
+
+class ReconcileTriggers:
+    def __init__(self, debounce: float = 2, max_delay: float = 10) -> None:
+        """Collects reconcile requests and coalesces bursts of them into one pass
+
+        Requests can come from any thread. The reconcile loop waits on them in place of
+        sleeping, and once one arrives it keeps waiting until no new request has arrived for
+        the debounce period, or max_delay has passed since the first one, so a storm of EMS
+        events becomes a single pass over the union of their scopes.
+
+        :param debounce: Seconds without a new request before the pending ones are handed out
+            (default is 2)
+        :type debounce: float
+        :param max_delay: Maximum seconds a request waits for a burst to end (default is 10)
+        :type max_delay: float
+        """
+        self._debounce = debounce
+        self._max_delay = max_delay
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+        self._scope = None
+        self._first_request = None
+        self._last_request = None
+        self._interrupted = threading.Event()
+
+    def request(self, backend_name: str = None, management_lif: str = None) -> None:
+        """Asks for a reconcile of a backend, the backends on a management LIF, or everything
+
+        :param backend_name: Name of the TridentBackendConfig to reconcile (default is None)
+        :type backend_name: str
+        :param management_lif: Reconcile every backend using this management LIF (default is None)
+        :type management_lif: str
+        """
+        now = time.time()
+        with self._lock:
+            if self._scope is None:
+                self._scope = ReconcileScope()
+                self._first_request = now
+            self._last_request = now
+            if backend_name is None and management_lif is None:
+                self._scope.full = True
+            if backend_name is not None:
+                self._scope.backend_names.add(backend_name)
+            if management_lif is not None:
+                self._scope.management_lifs.add(management_lif)
+        logger.debug(f"Reconcile requested - {backend_name=} {management_lif=}")
+        self._event.set()
+
+    def wait(self, timeout: float) -> Optional[ReconcileScope]:
+        """Waits up to timeout for reconcile requests and returns their combined scope
+
+        :param timeout: Maximum seconds to wait for a request
+        :type timeout: float
+        :returns: The scope of every request in the burst, or None if there wasn't one or
+            the wait was interrupted
+        :rtype: ReconcileScope
+        """
+        if not self._event.wait(timeout) or self._interrupted.is_set():
+            return None
+
+        # Let the burst finish before starting the pass
+        while True:
+            scope, ready_at = self._take(time.time())
+            if ready_at is None:
+                return scope
+            if self._interrupted.wait(ready_at - time.time()):
+                return None
+
+    def take(self) -> Optional[ReconcileScope]:
+        """Returns the combined scope of the pending requests if their burst has ended, without waiting
+
+        :returns: The scope, or None if there aren't any requests or their burst is still going
+        :rtype: ReconcileScope
+        """
+        scope, _ = self._take(time.time())
+        return scope
+
+    def _take(self, now: float) -> Tuple[Optional[ReconcileScope], Optional[float]]:
+        """Returns (scope, None) once the burst has ended, else (None, when it will have ended)"""
+        with self._lock:
+            if self._scope is None:
+                self._event.clear()
+                return None, None
+            ready_at = min(
+                self._last_request + self._debounce,
+                self._first_request + self._max_delay,
+            )
+            if now < ready_at:
+                return None, ready_at
+            scope = self._scope
+            self._scope = None
+            self._event.clear()
+            return scope, None
+
+    def interrupt(self) -> None:
+        """Wakes every current and future wait with no scope, used when shutting down"""
+        self._interrupted.set()
+        self._event.set()
@@ -0,0 +1,202 @@
+import logging
+import time
+from typing import Callable, List
+
+import urllib3
+from kubernetes.client.exceptions import ApiException
+
+from trident_mcc.metrics import cycle_stats
+from trident_mcc.models import ReconcileResult
+from trident_mcc.triggers import ReconcileScope
+
+
+logger = logging.getLogger("trident_mcc.watcher")
+
+
+class BackendWatcher:
+    def __init__(
+        self,
+        k8sclient,
+        scheduler,
+        sweep: Callable[[List], None],
+        reconcile: Callable[..., ReconcileResult],
+        reconcile_scope: Callable[[ReconcileScope, List], None],
+        resync_interval: Callable[[], float],
+        owns: Callable[[str], bool] = None,
+        trigger_check_interval: float = 10,
+        retry_interval: float = 1,
+        max_retry_interval: float = 300,
+    ) -> None:
+        """Event driven reconciliation of TridentBackendConfigs
+
+        Keeps a local store of TridentBackendConfig objects updated from a watch and
+        reconciles a backend as soon as it is added or changed. A full sweep of the store is
+        only done as a periodic resync every resync_interval, the namespace is only relisted
+        at startup or when the watch has expired.
+
+        Everything runs on the thread calling run, so a resync, an event's reconcile and a
+        triggered reconcile never overlap, and the store is only touched from that thread.
+        Triggered reconciles and retries of failed backends are picked up between events,
+        and the watch stream is restarted every trigger_check_interval so they are picked
+        up while no events arrive too.
+
+        If the list or watch fails for any other reason than the watch expiring, e.g. a 403,
+        an API Server error or a dropped connection, the namespace is relisted after
+        retry_interval, doubling on every further failure up to max_retry_interval.
+        Triggered reconciles of the backends already in the store still run meanwhile.
+
+        :param k8sclient: Client used to list and watch the TridentBackendConfigs
+        :type k8sclient: trident_mcc.k8s_client.K8sclient
+        :param scheduler: Source of triggered reconciles and retries
+        :type scheduler: trident_mcc.scheduler.ReconcileScheduler
+        :param sweep: Reconciles every backend in the store, e.g. check_backends
+        :type sweep: Callable[[List], None]
+        :param reconcile: Reconciles a single changed backend
+        :type reconcile: Callable[[trident_mcc.k8s_client.BackendView], ReconcileResult]
+        :param reconcile_scope: Reconciles the backends in the store matching a triggered
+            scope, e.g. reconcile_triggered
+        :type reconcile_scope: Callable[[ReconcileScope, List], None]
+        :param resync_interval: Returns the seconds between full sweeps of the store
+        :type resync_interval: Callable[[], float]
+        :param owns: Returns True if this replica reconciles backends on the management LIF,
+            None for every management LIF (default is None)
+        :type owns: Callable[[str], bool]
+        :param trigger_check_interval: Longest seconds a watch stream is kept open before
+            checking for triggered reconciles (default is 10)
+        :type trigger_check_interval: float
+        :param retry_interval: Seconds before relisting after the list or watch failed
+            (default is 1)
+        :type retry_interval: float
+        :param max_retry_interval: Longest seconds between relists after repeated failures
+            (default is 300)
+        :type max_retry_interval: float
+        """
+        self._k8sclient = k8sclient
+        self._scheduler = scheduler
+        self._sweep = sweep
+        self._reconcile = reconcile
+        self._reconcile_scope = reconcile_scope
+        self._resync_interval = resync_interval
+        self._owns = owns
+        self._trigger_check_interval = trigger_check_interval
+        self._retry_interval = retry_interval
+        self._max_retry_interval = max_retry_interval
+        # Backend name -> BackendView, as of resource_version
+        self.backends = {}
+        self.resource_version = None
+        self._next_resync = 0
+        # Consecutive failed lists or watches
+        self._failures = 0
+
+    def run(self, job_monitor) -> None:
+        """Lists, watches and reconciles until job_monitor is told to terminate
+
+        :param job_monitor: Tracks the running job and termination requests
+        :type job_monitor: trident_mcc.reconciler.SignalCatcher
+        """
+        while not job_monitor.terminate:
+            try:
+                if self.resource_version is None or time.time() >= self._next_resync:
+                    self._resync(job_monitor)
+                    if job_monitor.terminate:
+                        break
+                self._watch(job_monitor)
+            except ApiException as err:
+                if err.status == 410:
+                    logger.info("TridentBackendConfig watch expired - relisting")
+                    self.resource_version = None
+                else:
+                    self._back_off(job_monitor, err)
+            except urllib3.exceptions.HTTPError as err:
+                self._back_off(job_monitor, err)
+            else:
+                self._failures = 0
+
+    def _back_off(self, job_monitor, err: Exception) -> None:
+        """Waits before relisting after a failure, running triggered reconciles meanwhile"""
+        self._failures += 1
+        delay = min(
+            self._retry_interval * 2 ** (self._failures - 1), self._max_retry_interval
+        )
+        logger.error(
+            f"Unable to list or watch TridentBackendConfigs - relisting in {delay:.0f}s ({self._failures} failure(s)) - {err}"
+        )
+        self.resource_version = None
+        retry_at = time.time() + self._scheduler.jittered(delay)
+        while not job_monitor.terminate:
+            scope = self._scheduler.wait(retry_at)
+            if scope is None:
+                break
+            self._run_scope(job_monitor, scope)
+
+    def _resync(self, job_monitor) -> None:
+        job_monitor.start_job()
+        try:
+            if self.resource_version is None:
+                with cycle_stats.time_phase("k8s_list"):
+                    trident_backends, self.resource_version = (
+                        self._k8sclient.list_trident_backends()
+                    )
+                self.backends = {be.name: be for be in trident_backends}
+            self._sweep(list(self.backends.values()))
+        finally:
+            job_monitor.end_job()
+        self._next_resync = time.time() + self._scheduler.jittered(
+            self._resync_interval()
+        )
+
+    def _watch(self, job_monitor) -> None:
+        stream_end = min(self._next_resync, time.time() + self._trigger_check_interval)
+        for event_type, trident_config in self._k8sclient.watch_trident_backends(
+            self.resource_version,
+            timeout_seconds=max(int(stream_end - time.time()), 1),
+        ):
+            self.resource_version = trident_config.resource_version
+            if event_type != "BOOKMARK":
+                self._handle_event(job_monitor, event_type, trident_config)
+            if job_monitor.terminate:
+                return
+            self._run_due(job_monitor)
+        self._run_due(job_monitor)
+
+    def _handle_event(self, job_monitor, event_type: str, trident_config) -> None:
+        be_name = trident_config.name
+        logger.debug(f"Received {event_type} event for '{be_name}'")
+        if event_type == "DELETED":
+            self.backends.pop(be_name, None)
+            return
+
+        previous = self.backends.get(be_name)
+        self.backends[be_name] = trident_config
+        # Status only updates don't bump the generation, nor do they need a reconcile
+        if (
+            previous is not None
+            and previous.generation == trident_config.generation
+            and previous.annotations == trident_config.annotations
+        ):
+            return
+        if self._owns is not None and not self._owns(trident_config.management_lif):
+            return
+
+        job_monitor.start_job()
+        try:
+            result = self._reconcile(trident_config)
+        finally:
+            job_monitor.end_job()
+        self._scheduler.record_results([trident_config], [result])
+
+    def _run_due(self, job_monitor) -> None:
+        """Runs the triggered reconcile or retry that is due, if there is one"""
+        scope = self._scheduler.poll()
+        if scope is not None:
+            self._run_scope(job_monitor, scope)
+
+    def _run_scope(self, job_monitor, scope: ReconcileScope) -> None:
+        job_monitor.start_job()
+        try:
+            if scope.full:
+                self._sweep(list(self.backends.values()))
+            else:
+                self._reconcile_scope(scope, list(self.backends.values()))
+        finally:
+            job_monitor.end_job()